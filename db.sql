@@ -1 +1,5 @@
-CREATE EXTENSION postgis_raster;
\ No newline at end of file
+CREATE EXTENSION postgis_raster;
+
+-- Out-db rasters (RASTER_STORAGE_MODE "out-db") are read from the band COGs in the media volume
+ALTER SYSTEM SET postgis.enable_outdb_rasters = true;
+ALTER SYSTEM SET postgis.gdal_enabled_drivers = 'GTiff';
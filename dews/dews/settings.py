@@ -230,11 +230,59 @@ SAT_DATA_PATH = Path(MEDIA_ROOT) / "sat_data"
 EXTRACTED_FILES_PATH = SAT_DATA_PATH / "extracted"
 ARCHIVE_FILES_PATH = SAT_DATA_PATH / "archive"
 IMAGES_FILES_PATH = SAT_DATA_PATH / "images"
+BAND_COG_FILES_PATH = SAT_DATA_PATH / "band_cogs"  # out-db rasters, the database server needs access to the same path
 
 OTHER_FILES_PATH = Path(MEDIA_ROOT) / "other"
 
 FILES_PATH_LIST = [SAT_DATA_PATH, EXTRACTED_FILES_PATH, ARCHIVE_FILES_PATH,
-                   IMAGES_FILES_PATH, OTHER_FILES_PATH]
+                   IMAGES_FILES_PATH, BAND_COG_FILES_PATH, OTHER_FILES_PATH]
+
+# Ingestion
+# Archives are ingested by `python manage.py runworker`, the web tier only enqueues jobs
+INGEST_WORKER_CONCURRENCY = int(getenv("INGEST_WORKER_CONCURRENCY", 2))  # parallel ingest processes
+INGEST_WORKER_POLL_INTERVAL = 5  # in seconds, queue polling interval of an idle worker
+INGEST_JOB_MAX_ATTEMPTS = int(getenv("INGEST_JOB_MAX_ATTEMPTS", 3))
+INGEST_JOB_RETRY_DELAY = 60  # in seconds, multiplied by the number of attempts
+INGEST_JOB_HEARTBEAT_INTERVAL = 30  # in seconds
+INGEST_JOB_STALE_TIMEOUT = 600  # in seconds, running jobs without heartbeat are requeued
+INGEST_JOB_REQUEUE_INTERVAL = 60  # in seconds, how often idle workers look for stale jobs
+DEFAULT_METRICS_TO_CALC = ["ndvi", "rgb"]
+BAND_IMPORT_MAX_WORKERS = int(getenv("BAND_IMPORT_MAX_WORKERS", 4))  # parallel band imports per ingest
+# "raster2pgsql": pipes `raster2pgsql` to `psql`, "copy": in-process import using `COPY ... FROM STDIN`
+RASTER_IMPORT_ENGINE = getenv("RASTER_IMPORT_ENGINE", "raster2pgsql")
+RASTER_TILE_SIZE = 256  # in pixels, tile width and height of the "copy" engine and of out-db rasters
+# "in-db": pixel values are stored in the database, "out-db": bands are converted into tiled COGs on disk and
+# only the tiles' georeference and file path are stored (needs `postgis.enable_outdb_rasters`, see `db.sql`)
+RASTER_STORAGE_MODE = getenv("RASTER_STORAGE_MODE", "in-db")
+# storage mode by mission or product type overriding `RASTER_STORAGE_MODE`, e.g. "sentinel-2b=out-db,grd=in-db"
+RASTER_STORAGE_MODES = dict(item.lower().split("=", 1)
+                            for item in getenv("RASTER_STORAGE_MODES", "").split(",") if "=" in item)
+BAND_COG_COMPRESSION = getenv("BAND_COG_COMPRESSION", "DEFLATE")  # e.g. "DEFLATE", "ZSTD" or "LZW"
+# "selective": extracts only the archive members used by the ingestion, "full": extracts every member
+ARCHIVE_EXTRACTION_MODE = getenv("ARCHIVE_EXTRACTION_MODE", "selective")
+ARCHIVE_EXTRACTION_WORKERS = 4  # parallel member extractions per archive
+# "reference" (use extracted file in place), "link" (hardlink into uploads) or "copy"
+BAND_FILE_STORAGE_MODE = getenv("BAND_FILE_STORAGE_MODE", "reference")
+
+# Metrics
+# "numpy": indices from the band files with images, COGs and statistics; "postgis": index tables from the band tables
+METRICS_ENGINE = getenv("METRICS_ENGINE", "numpy")
+INDEX_MAX_BLOCKS = int(getenv("INDEX_MAX_BLOCKS", 64))  # raster blocks per band in memory during index calculation
+# in bytes, bands shared by several metrics are cached up to this size, bigger bands are read block-wise
+BAND_CACHE_MEMORY_BUDGET = int(getenv("BAND_CACHE_MEMORY_BUDGET_MB", 1024)) * 1024 ** 2
+INDEX_IMAGE_FORMAT = getenv("INDEX_IMAGE_FORMAT", "png")  # "png" or "webp"
+INDEX_IMAGE_MAX_SIZE = int(getenv("INDEX_IMAGE_MAX_SIZE", 0))  # in pixels, longest image side; 0 keeps native resolution
+# in pixels, longest side of the preview images published before the full resolution ones; 0 disables previews
+INDEX_PREVIEW_SIZE = int(getenv("INDEX_PREVIEW_SIZE", 1024))
+INDEX_COG_BLOCK_SIZE = int(getenv("INDEX_COG_BLOCK_SIZE", 512))  # in pixels, tile width and height of index values COGs
+INDEX_COG_COMPRESSION = getenv("INDEX_COG_COMPRESSION", "DEFLATE")  # e.g. "DEFLATE", "ZSTD" or "LZW"
+INDEX_HISTOGRAM_BINS = int(getenv("INDEX_HISTOGRAM_BINS", 200))  # fixed histogram bins of index statistics
+INDEX_STATS_PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+# Scene classification (SCL band) classes excluded from indices and their statistics, empty disables masking:
+# 0 no data, 1 saturated or defective, 3 cloud shadows, 8 cloud medium probability, 9 cloud high probability, 10 thin cirrus
+SCL_MASK_CLASSES = [int(scl_class) for scl_class in getenv("SCL_MASK_CLASSES", "0,1,3,8,9,10").split(",") if scl_class]
+# in pixels, polygons of value queries with more pixels are read decimated
+VALUE_QUERY_MAX_PIXELS = int(getenv("VALUE_QUERY_MAX_PIXELS", 1000000))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
@@ -7,4 +7,6 @@ admin.site.register(SatData)
 admin.site.register(Band)
 admin.site.register(Area)
 admin.site.register(Index)
+admin.site.register(IndexStats)
 admin.site.register(SHRequest)
+admin.site.register(IngestJob)
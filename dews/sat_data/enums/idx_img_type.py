@@ -9,6 +9,8 @@ class IdxImgType(Enum):
     EVI = "evi"
     SMI = "smi"
     NDWI = "ndwi"
+    NDSI = "ndsi"
+    NMDI = "nmdi"
 
     @staticmethod
     def get_all():
@@ -2,6 +2,7 @@ from enum import Enum
 
 
 class Status(Enum):
+    QUEUED = "queued"
     DONE = "done"
     IN_PROGRESS = "in progress"
     FAILED = "failed"
\ No newline at end of file
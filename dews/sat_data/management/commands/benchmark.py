@@ -0,0 +1,158 @@
+import os
+import random
+import tempfile
+import time
+import uuid
+
+import rasterio
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rasterio.windows import Window
+
+from sat_data.services.band_raster import BAND_RASTER_TABLE, create_partition, drop_partition, get_band_cog_dir, \
+    remove_band_cogs
+from sat_data.services.raster_loader import CopyRasterLoader, OutDbRasterLoader, Raster2PgsqlLoader
+from sat_data.services.renderer import render_index_img
+
+
+class Command(BaseCommand):
+    help = "Benchmarks processing steps with a local file (e.g. the raster import engines, the raster storage modes or the image renderers)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", type=str, choices=["import", "storage", "render"],
+                            help="Processing step to benchmark")
+        parser.add_argument("source_path", type=str, help="File used for the benchmark (e.g. a band's .jp2 file)")
+        parser.add_argument("-r", "--repeat", type=int, default=3,
+                            help="[OPTIONAL] Number of runs per variant (default: 3)")
+        parser.add_argument("-t", "--tile-size", type=int, default=1024,
+                            help="[OPTIONAL] Width and height of the rendered tile in pixels (default: 1024)")
+
+    def handle(self, *args, **options):
+        source_path: str = options.get("source_path")
+        repeat: int = max(1, options.get("repeat"))
+
+        # Check if file exists
+        if not os.path.exists(source_path):
+            raise CommandError(
+                f"File does not exist. source_path='{source_path}'")
+
+        target = options.get("target")
+        if target == "import":
+            results = self.benchmark_import(source_path, repeat)
+        elif target == "storage":
+            results = self.benchmark_storage(source_path, repeat)
+        elif target == "render":
+            results = self.benchmark_render(source_path, repeat, options.get("tile_size"))
+
+        # Speedup relative to the first variant
+        baseline = min(next(iter(results.values())))
+        for variant, timings in results.items():
+            self.stdout.write(
+                f"{variant:<16} min={min(timings):.3f}s avg={sum(timings) / len(timings):.3f}s runs={len(timings)} speedup={baseline / min(timings):.1f}x")
+
+    def benchmark_import(self, source_path: str, repeat: int) -> dict:
+        """ Imports the raster with every import engine and as out-db raster into temporary partitions of the band raster table."""
+        results = {}
+        for loader in [Raster2PgsqlLoader(), CopyRasterLoader(), OutDbRasterLoader()]:
+            results[loader.engine] = []
+            for _ in range(repeat):
+                sat_data_id = uuid.uuid4()
+                create_partition(sat_data_id)
+                start = time.perf_counter()
+                ok = loader.load(band_path=source_path, sat_data_id=sat_data_id, band="benchmark", band_range=0)
+                duration = time.perf_counter() - start
+                drop_partition(sat_data_id)
+                remove_band_cogs(sat_data_id)
+                if not ok:
+                    raise CommandError(
+                        f"Import failed. engine='{loader.engine}', source_path='{source_path}'")
+                results[loader.engine].append(duration)
+        return results
+
+    def benchmark_storage(self, source_path: str, repeat: int) -> dict:
+        """
+        Compares in-db and out-db rasters: prints the database and file sizes and queries the value of a random
+        point and the mean of a window (a quarter of the raster's width and height) per run.
+        """
+        with rasterio.open(source_path) as dataset:
+            bounds = dataset.bounds
+            srid = dataset.crs.to_epsg() if dataset.crs else 0
+        width = bounds.right - bounds.left
+        height = bounds.top - bounds.bottom
+        window = (bounds.left + width * 3 / 8, bounds.bottom + height * 3 / 8,
+                  bounds.left + width * 5 / 8, bounds.bottom + height * 5 / 8)
+
+        results = {}
+        for storage_mode, loader in [("in-db", CopyRasterLoader()), ("out-db", OutDbRasterLoader())]:
+            sat_data_id = uuid.uuid4()
+            partition_name = create_partition(sat_data_id)
+            try:
+                if not loader.load(band_path=source_path, sat_data_id=sat_data_id, band="benchmark", band_range=0):
+                    raise CommandError(
+                        f"Import failed. storage_mode='{storage_mode}', source_path='{source_path}'")
+                with connection.cursor() as cursor:
+                    cursor.execute(f'ANALYZE "{partition_name}";')
+                    cursor.execute("SELECT pg_total_relation_size(%s);", (partition_name,))
+                    db_size = cursor.fetchone()[0]
+                    file_size = sum(entry.stat().st_size for entry in os.scandir(get_band_cog_dir(sat_data_id))) \
+                        if os.path.isdir(get_band_cog_dir(sat_data_id)) else 0
+                    self.stdout.write(
+                        f"{storage_mode:<16} database={db_size / 1024 ** 2:.1f}MB files={file_size / 1024 ** 2:.1f}MB")
+
+                    results[f"{storage_mode} point"] = []
+                    results[f"{storage_mode} window"] = []
+                    for _ in range(repeat):
+                        point = (random.uniform(bounds.left, bounds.right), random.uniform(bounds.bottom, bounds.top))
+                        start = time.perf_counter()
+                        cursor.execute(f'''
+                            SELECT ST_Value(rast, 1, ST_SetSRID(ST_MakePoint(%s, %s), %s)) FROM {BAND_RASTER_TABLE}
+                            WHERE sat_data_id = %s AND ST_Intersects(ST_ConvexHull(rast), ST_SetSRID(ST_MakePoint(%s, %s), %s));
+                        ''', (*point, srid, str(sat_data_id), *point, srid))
+                        cursor.fetchall()
+                        results[f"{storage_mode} point"].append(time.perf_counter() - start)
+
+                        start = time.perf_counter()
+                        cursor.execute(f'''
+                            SELECT (ST_SummaryStatsAgg(ST_Clip(rast, ST_MakeEnvelope(%s, %s, %s, %s, %s)), 1, true)).mean
+                            FROM {BAND_RASTER_TABLE}
+                            WHERE sat_data_id = %s AND ST_Intersects(ST_ConvexHull(rast), ST_MakeEnvelope(%s, %s, %s, %s, %s));
+                        ''', (*window, srid, str(sat_data_id), *window, srid))
+                        cursor.fetchall()
+                        results[f"{storage_mode} window"].append(time.perf_counter() - start)
+            finally:
+                drop_partition(sat_data_id)
+                remove_band_cogs(sat_data_id)
+        return results
+
+    def benchmark_render(self, source_path: str, repeat: int, tile_size: int) -> dict:
+        """ Renders a tile of the raster with matplotlib (the former renderer) and with the colormap LUT renderer."""
+        with rasterio.open(source_path) as dataset:
+            window = Window(0, 0, min(tile_size, dataset.width), min(tile_size, dataset.height))
+            values = dataset.read(1, window=window, out_dtype="float32")
+        self.stdout.write(f"Rendering tile of {values.shape[1]} x {values.shape[0]} pixels.")
+
+        variants = {}
+        try:
+            import matplotlib
+            matplotlib.use("agg")
+            import matplotlib.pyplot as plt
+
+            def render_matplotlib(save_loc):
+                plt.imshow(values, cmap="RdYlGn")
+                plt.axis("off")
+                plt.savefig(save_loc, dpi=200, bbox_inches="tight", pad_inches=0.0)
+                plt.close("all")
+            variants["matplotlib"] = render_matplotlib
+        except ImportError:
+            self.stdout.write(self.style.WARNING("matplotlib is not installed, skipping its variant."))
+        variants["lut"] = lambda save_loc: render_index_img(values, save_loc, cmap="RdYlGn")
+
+        results = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for variant, render in variants.items():
+                results[variant] = []
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    render(os.path.join(tmp_dir, f"{variant}_{i}.png"))
+                    results[variant].append(time.perf_counter() - start)
+        return results
@@ -1,64 +1,172 @@
-from io import BytesIO
+import glob
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from django.http import HttpRequest, QueryDict
-from django.middleware.csrf import get_token
+from django.db import connections
 
-from dews.settings import DB_USER
+from dews.settings import DB_USER, DEFAULT_METRICS_TO_CALC
 from sat_data.enums.sat_mission import SatMission
-from sat_data.views import create_sat_data
+from sat_data.services.ingest_worker import IngestWorker
+from sat_data.services.job_queue import JobQueue
+
+MANIFEST_NAME = "importdata_manifest.json"
+
+
+def init_import_process():
+    # Forked processes must not share the parent's database connections
+    connections.close_all()
+
+
+def import_archive(source_path: str, mission: str) -> tuple:
+    """
+    Imports one archive. Runs in a worker process of the bulk import.
+
+    :return: Tuple of SatData id (None on failure), duration in seconds and error message
+    """
+    start = time.perf_counter()
+    try:
+        user = User.objects.get(username=DB_USER)
+        sat_data = IngestWorker.ingest(
+            user=user,
+            archive_path=source_path,
+            mission=mission or SatMission.get_mission_by_filename(source_path),
+            metrics_to_calc=DEFAULT_METRICS_TO_CALC,
+        )
+        return str(sat_data.id), time.perf_counter() - start, ""
+    except Exception as e:
+        return None, time.perf_counter() - start, str(e)
 
 
 class Command(BaseCommand):
     help = "Imports satellite data archives"
 
     def add_arguments(self, parser):
-        parser.add_argument("source_path", type=str, help="Archive location")
+        parser.add_argument("source_path", type=str,
+                            help="Archive location, a directory containing archives or a glob pattern (e.g. '/data/S2B_*.zip')")
         parser.add_argument("-m", "--mission", type=str,
                             help="[OPTIONAL] Dash seperated and lower case satellite mission of archive (e.g. 'sentinel-1a')")
+        parser.add_argument("--enqueue", action="store_true",
+                            help="[OPTIONAL] Hand the archives to the ingest workers instead of importing them in this process")
+        parser.add_argument("-j", "--jobs", type=int, default=1,
+                            help="[OPTIONAL] Number of archives imported in parallel worker processes (default: 1)")
+        parser.add_argument("--manifest", type=str,
+                            help=f"[OPTIONAL] Resume manifest of a bulk import (default: '{MANIFEST_NAME}' next to the archives)")
 
     def handle(self, *args, **options):
-        source_path: str = options.get("source_path")
+        # Workers and the extraction must not depend on the current working directory
+        source_path: str = os.path.abspath(options.get("source_path"))
         mission: str = options.get("mission")
-        # Check mission
-        if not mission:
-            mission = SatMission.get_mission_by_filename(source_path)
 
-        # Check if archive exists
-        if not os.path.exists(source_path):
+        # Collect archives
+        archive_paths = self.collect_archives(source_path)
+        if not archive_paths:
             raise CommandError(
                 f"Archive does not exist. source_path='{source_path}'")
 
-        # Create SatData object
-        with open(source_path, "rb") as f:
-            content = f.read()
-        # Create request object
-        request = HttpRequest()
-        request.user = User.objects.get(username=DB_USER)
-        request.method = "POST"
-        request.path = "/sat_data/upload/" # TODO: check if ptional?!
-        request.POST = QueryDict("", mutable=True)
-        request.POST.update({
-            "csrfmiddlewaretoken": get_token(request),
-            "name": f"{os.path.basename(source_path)}",
-        })
-        archive = InMemoryUploadedFile(
-            file=BytesIO(content),
-            field_name='archive',
-            name=os.path.basename(source_path),
-            content_type='application/zip',
-            size=len(content),
-            charset=None
-        )        
-        request.FILES["archive"] = archive
-        ok = create_sat_data(request, source_path)
-        if not ok:
-            raise CommandError(
-                f"Failed to create SatData object. source_path='{source_path}'")
+        # The archives are read from disk by the ingestion, they are never loaded into memory
+        if options.get("enqueue"):
+            user = User.objects.get(username=DB_USER)
+            for archive_path in archive_paths:
+                job = JobQueue.enqueue(
+                    user=user,
+                    archive_path=archive_path,
+                    mission=mission or SatMission.get_mission_by_filename(archive_path),
+                    metrics_to_calc=DEFAULT_METRICS_TO_CALC,
+                )
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Successfully enqueued archive. source_path='{archive_path}', job.id='{job.id}'")
+                )
+            return
+
+        if len(archive_paths) == 1 and os.path.isfile(source_path):
+            # Single archive
+            sat_data_id, _, error = import_archive(source_path, mission)
+            if sat_data_id is None:
+                raise CommandError(
+                    f"Failed to create SatData object. source_path='{source_path}', error='{error}'")
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Successfully imported archive. source_path='{source_path}', sat_data.id='{sat_data_id}'")
+            )
+            return
 
+        # Bulk import
+        manifest_path = options.get("manifest")
+        if not manifest_path:
+            manifest_dir = source_path if os.path.isdir(source_path) else os.path.dirname(source_path)
+            manifest_path = os.path.join(manifest_dir, MANIFEST_NAME)
+        self.import_bulk(archive_paths, mission, max(1, options.get("jobs")), manifest_path)
+
+    def collect_archives(self, source_path: str) -> list:
+        """ Returns the archive paths of a file, a directory or a glob pattern."""
+        if os.path.isfile(source_path):
+            return [source_path]
+        if os.path.isdir(source_path):
+            source_path = os.path.join(source_path, "*.zip")
+        return sorted(path for path in glob.glob(source_path) if os.path.isfile(path))
+
+    def load_manifest(self, manifest_path: str) -> dict:
+        if not os.path.exists(manifest_path):
+            return {"done": {}, "failed": {}}
+        with open(manifest_path, "r") as file_ref:
+            manifest = json.load(file_ref)
+        manifest.setdefault("done", {})
+        manifest.setdefault("failed", {})
+        return manifest
+
+    def save_manifest(self, manifest_path: str, manifest: dict):
+        # Replace atomically, so a crash never leaves a truncated manifest
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w") as file_ref:
+            json.dump(manifest, file_ref, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def import_bulk(self, archive_paths: list, mission: str, jobs: int, manifest_path: str):
+        """ Imports the archives in parallel and records finished archives in the resume manifest."""
+        manifest = self.load_manifest(manifest_path)
+        pending = [path for path in archive_paths if path not in manifest["done"]]
+        skipped = len(archive_paths) - len(pending)
         self.stdout.write(
-            self.style.SUCCESS(
-                f"Successfully imported archive. source_path='{source_path}'")
-        )
+            f"Importing {len(pending)} archive(s) with {jobs} process(es). skipped='{skipped}', manifest='{manifest_path}'")
+
+        # Forked processes must not share the parent's database connections
+        connections.close_all()
+        total_bytes = 0
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_import_process) as executor:
+            futures = {executor.submit(import_archive, path, mission): path for path in pending}
+            for i, future in enumerate(as_completed(futures), start=1):
+                path = futures[future]
+                sat_data_id, duration, error = future.result()
+                size = os.path.getsize(path)
+                if sat_data_id is None:
+                    manifest["failed"][path] = {"duration": duration, "error": error}
+                    self.stdout.write(self.style.ERROR(
+                        f"[{i}/{len(pending)}] Failed '{os.path.basename(path)}' after {duration:.1f}s. error='{error}'"))
+                else:
+                    manifest["failed"].pop(path, None)
+                    manifest["done"][path] = {"sat_data_id": sat_data_id, "duration": duration}
+                    total_bytes += size
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(
+                        f"[{i}/{len(pending)}] Imported '{os.path.basename(path)}' in {duration:.1f}s. "
+                        f"throughput='{total_bytes / 1024 ** 2 / elapsed:.1f} MB/s', archives_per_hour='{i / elapsed * 3600:.1f}'")
+                self.save_manifest(manifest_path, manifest)
+
+        # Report per archive timings
+        self.stdout.write("\nTimings:")
+        for path in pending:
+            if path in manifest["done"]:
+                self.stdout.write(f"  {manifest['done'][path]['duration']:>9.1f}s  done    {os.path.basename(path)}")
+            elif path in manifest["failed"]:
+                self.stdout.write(f"  {manifest['failed'][path]['duration']:>9.1f}s  failed  {os.path.basename(path)}")
+
+        failed = [path for path in pending if path in manifest["failed"]]
+        summary = f"Imported {len(pending) - len(failed)} of {len(pending)} archive(s) in {time.perf_counter() - start:.1f}s."
+        if failed:
+            raise CommandError(f"{summary} Rerun the command to retry the failed archives.")
+        self.stdout.write(self.style.SUCCESS(summary))
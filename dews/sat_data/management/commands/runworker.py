@@ -0,0 +1,81 @@
+import multiprocessing
+import signal
+import socket
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from dews.settings import INGEST_WORKER_CONCURRENCY
+from sat_data.services.ingest_worker import IngestWorker
+
+
+WORKER_SUPERVISE_INTERVAL = 5  # in seconds
+
+
+def run_worker(name: str, once: bool):
+    # Forked processes must not share the parent's database connections
+    connections.close_all()
+    worker = IngestWorker(name=name)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    worker.run(once=once)
+
+
+def start_worker(name: str, once: bool) -> multiprocessing.Process:
+    process = multiprocessing.Process(
+        target=run_worker, args=(name, once), name=name)
+    process.start()
+    return process
+
+
+class Command(BaseCommand):
+    help = "Runs ingest worker processes which process queued archives"
+
+    def add_arguments(self, parser):
+        parser.add_argument("-c", "--concurrency", type=int, default=INGEST_WORKER_CONCURRENCY,
+                            help="[OPTIONAL] Number of worker processes (default: INGEST_WORKER_CONCURRENCY)")
+        parser.add_argument("--once", action="store_true",
+                            help="[OPTIONAL] Exit as soon as the queue is empty")
+
+    def handle(self, *args, **options):
+        concurrency: int = max(1, options.get("concurrency"))
+        once: bool = options.get("once")
+
+        connections.close_all()
+        processes = {}
+        for i in range(concurrency):
+            name = f"{socket.gethostname()}-worker-{i}"
+            processes[name] = start_worker(name, once)
+        self.stdout.write(
+            f"Started {concurrency} ingest worker process(es).")
+
+        stopping = False
+
+        def terminate(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for process in processes.values():
+                process.terminate()
+        signal.signal(signal.SIGTERM, terminate)
+        signal.signal(signal.SIGINT, terminate)
+
+        # Restart workers which died unexpectedly (e.g. killed by the OOM killer)
+        while not stopping and processes:
+            for name, process in list(processes.items()):
+                process.join(timeout=WORKER_SUPERVISE_INTERVAL / len(processes))
+                if process.is_alive() or stopping:
+                    continue
+                if once and process.exitcode == 0:
+                    del processes[name]
+                    continue
+                self.stderr.write(
+                    f"Ingest worker process exited unexpectedly, restarting it. worker='{name}', exitcode='{process.exitcode}'")
+                processes[name] = start_worker(name, once)
+
+        for process in processes.values():
+            if stopping:
+                # Also stops a worker restarted right before the signal
+                process.terminate()
+            process.join()
+
+        self.stdout.write(
+            self.style.SUCCESS("Stopped ingest worker processes."))
@@ -0,0 +1,45 @@
+# Generated by Django 5.0 on 2026-10-18 09:12
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+import django.utils.timezone
+import sat_data.models
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sat_data', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive_path', models.CharField(max_length=255, verbose_name='Archive Path')),
+                ('mission', models.CharField(blank=True, default='unknown', max_length=50)),
+                ('metrics_to_calc', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=300), default=list, size=None)),
+                ('status', models.CharField(blank=True, db_index=True, default='queued', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('max_attempts', models.IntegerField(default=3)),
+                ('error', models.TextField(blank=True, default='')),
+                ('worker', models.CharField(blank=True, default='', max_length=100, verbose_name='Worker')),
+                ('creation_time', models.DateTimeField(auto_now_add=True)),
+                ('update_time', models.DateTimeField(auto_now=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('start_time', models.DateTimeField(blank=True, null=True)),
+                ('finish_time', models.DateTimeField(blank=True, null=True)),
+                ('sat_data', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingest_jobs', to='sat_data.satdata')),
+                ('user', models.ForeignKey(blank=True, default=sat_data.models.get_dews_user, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'ingest_job',
+                'ordering': ['creation_time'],
+            },
+        ),
+    ]
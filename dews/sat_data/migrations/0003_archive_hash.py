@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sat_data', '0002_ingestjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='satdata',
+            name='archive_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='Archive SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='ingestjob',
+            name='archive_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64, verbose_name='Archive SHA-256'),
+        ),
+    ]
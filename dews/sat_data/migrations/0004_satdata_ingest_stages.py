@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sat_data', '0003_archive_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='satdata',
+            name='ingest_stages',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Ingest Stages'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.0 on 2026-10-18 14:20
+
+from django.db import migrations, models
+import sat_data.models
+import utils.services.overwrite_storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sat_data', '0004_satdata_ingest_stages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='index',
+            name='cog',
+            field=models.FileField(blank=True, max_length=255, null=True, storage=utils.services.overwrite_storage.OverwriteStorage(), upload_to=sat_data.models.index_upload_path, verbose_name='Index COG'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0 on 2026-10-18 14:55
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sat_data', '0005_index_cog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexStats',
+            fields=[
+                ('valid_count', models.BigIntegerField(default=0, verbose_name='Valid Pixels')),
+                ('mean', models.FloatField(blank=True, null=True)),
+                ('std', models.FloatField(blank=True, null=True)),
+                ('min', models.FloatField(blank=True, null=True)),
+                ('max', models.FloatField(blank=True, null=True)),
+                ('percentiles', models.JSONField(blank=True, default=dict)),
+                ('hist_min', models.FloatField()),
+                ('hist_max', models.FloatField()),
+                ('hist_counts', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), default=list, size=None)),
+                ('index', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='sat_data.index')),
+            ],
+            options={
+                'db_table': 'index_stats',
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0 on 2026-10-18 17:20
+
+import re
+
+from django.contrib.postgres.operations import CreateExtension
+from django.db import migrations
+
+
+def move_band_tables(apps, schema_editor):
+    """ Moves the tiles of the former per band tables (e.g. "s2b_<id>_b04_r10m") into the band raster partitions."""
+    SatData = apps.get_model("sat_data", "SatData")
+    with schema_editor.connection.cursor() as cursor:
+        for sat_data in SatData.objects.exclude(band_tables__isnull=True).iterator():
+            band_tables = sat_data.band_tables or {}
+            partition_name = f"band_raster_{sat_data.id.hex}"
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS "{partition_name}" PARTITION OF band_raster FOR VALUES IN (%s);',
+                (str(sat_data.id),))
+
+            for range_string in ["unknown", "r10m", "r20m", "r60m"]:
+                for table_name in band_tables.get(range_string, []):
+                    # Band is the part after the SatData id, the range is stripped
+                    match = re.match(rf"^.*{sat_data.id}_(.+?)(_r\d+m)?$", table_name)
+                    if match is None:
+                        continue
+                    band_range = int(range_string[1:-1]) if range_string != "unknown" else 0
+                    cursor.execute(f'''
+                        INSERT INTO band_raster (sat_data_id, band, range, rast, filename)
+                        SELECT %s, %s, %s, rast, NULL FROM "{table_name}";
+                    ''', (str(sat_data.id), match.group(1), band_range))
+                    cursor.execute(f'DROP TABLE "{table_name}";')
+
+            sat_data.band_tables = {"partition": [partition_name], "index": band_tables.get("index", [])}
+            sat_data.save(update_fields=["band_tables"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sat_data', '0006_indexstats'),
+    ]
+
+    operations = [
+        CreateExtension('postgis_raster'),
+        migrations.RunSQL(
+            sql='''
+                CREATE TABLE band_raster (
+                    rid bigserial,
+                    sat_data_id uuid NOT NULL,
+                    band varchar(50) NOT NULL,
+                    range integer NOT NULL DEFAULT 0,
+                    rast raster NOT NULL,
+                    filename text,
+                    PRIMARY KEY (sat_data_id, rid)
+                ) PARTITION BY LIST (sat_data_id);
+                CREATE INDEX band_raster_rast_gist ON band_raster USING gist (ST_ConvexHull(rast));
+                CREATE INDEX band_raster_band_range ON band_raster (band, range);
+            ''',
+            reverse_sql='DROP TABLE IF EXISTS band_raster;',
+        ),
+        migrations.RunPython(move_band_tables, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0 on 2026-10-18 19:05
+
+from django.db import migrations
+
+
+# Same as `OVERVIEW_FACTORS` in `sat_data.services.band_raster` at the time of this migration
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32]
+
+
+def create_overviews(apps, schema_editor):
+    """ Creates the overview partitions of existing SatData objects, their tiles are rescaled tile by tile."""
+    SatData = apps.get_model("sat_data", "SatData")
+    with schema_editor.connection.cursor() as cursor:
+        for sat_data in SatData.objects.exclude(band_tables__isnull=True).iterator():
+            for factor in OVERVIEW_FACTORS:
+                partition_name = f"o_{factor}_band_raster_{sat_data.id.hex}"
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{partition_name}" PARTITION OF o_{factor}_band_raster FOR VALUES IN (%s);',
+                    (str(sat_data.id),))
+                cursor.execute(f'''
+                    INSERT INTO o_{factor}_band_raster (sat_data_id, band, range, rast, filename)
+                    SELECT sat_data_id, band, range,
+                        ST_Rescale(rast, ST_ScaleX(rast) * %s, ST_ScaleY(rast) * %s, 'NearestNeighbour'), filename
+                    FROM band_raster WHERE sat_data_id = %s;
+                ''', (factor, factor, str(sat_data.id)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sat_data', '0007_band_raster'),
+    ]
+
+    operations = [
+        # Overview tables "o_<factor>_band_raster" like `raster2pgsql -l` creates them, registered in `raster_overviews`
+        migrations.RunSQL(
+            sql=[f'''
+                CREATE TABLE o_{factor}_band_raster (
+                    rid bigserial,
+                    sat_data_id uuid NOT NULL,
+                    band varchar(50) NOT NULL,
+                    range integer NOT NULL DEFAULT 0,
+                    rast raster NOT NULL,
+                    filename text,
+                    PRIMARY KEY (sat_data_id, rid)
+                ) PARTITION BY LIST (sat_data_id);
+                CREATE INDEX o_{factor}_band_raster_rast_gist ON o_{factor}_band_raster USING gist (ST_ConvexHull(rast));
+                CREATE INDEX o_{factor}_band_raster_band_range ON o_{factor}_band_raster (band, range);
+                SELECT AddOverviewConstraints('o_{factor}_band_raster'::name, 'rast'::name,
+                                              'band_raster'::name, 'rast'::name, {factor});
+            ''' for factor in OVERVIEW_FACTORS],
+            reverse_sql=[f'DROP TABLE IF EXISTS o_{factor}_band_raster;' for factor in OVERVIEW_FACTORS],
+        ),
+        migrations.RunPython(create_overviews, migrations.RunPython.noop),
+    ]
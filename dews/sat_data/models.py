@@ -11,6 +11,7 @@ import uuid
 import logging
 
 from django.urls import reverse
+from django.utils import timezone
 from sat_data.enums.sat_mission import SatMission
 from sat_data.enums.sat_prod_type import SatProdType
 from sat_data.enums.status import Status
@@ -18,7 +19,7 @@ from sat_data.enums.status import Status
 
 from utils.services.model_util import ModelUtil
 from sat_data.enums.sat_band import SatBand
-from dews.settings import IMAGES_FILES_PATH, MEDIA_ROOT, ARCHIVE_FILES_PATH, DB_USER
+from dews.settings import IMAGES_FILES_PATH, MEDIA_ROOT, ARCHIVE_FILES_PATH, DB_USER, INGEST_JOB_MAX_ATTEMPTS
 from utils.services.overwrite_storage import OverwriteStorage
 
 
@@ -107,12 +108,20 @@ class SatData(models.Model):
                                           verbose_name="Processing Done",
                                           blank=True,
                                           null=True)
+    ingest_stages = models.JSONField(default=dict,
+                                     verbose_name="Ingest Stages",
+                                     blank=True)
     archive = models.FileField(max_length=255,
                                null=True,
                                blank=True,
                                upload_to=archive_upload_path,
                                verbose_name="Archive",
                                storage=OverwriteStorage())
+    archive_hash = models.CharField(max_length=64,
+                                    unique=True,
+                                    null=True,
+                                    blank=True,
+                                    verbose_name="Archive SHA-256")
     mtd = models.FileField(max_length=255,
                            null=True,
                            blank=True,
@@ -191,13 +200,17 @@ class SatData(models.Model):
         return reverse("sat_data:sat_data_details_view", kwargs={"sat_data_id": self.id})
 
     # Methods
-    def get_band(self, *required_bands):
+    def get_bands(self, *required_bands, resolution: int = None) -> dict:
         """
-        Returns a Band object that contains all the required bands.
+        Returns the Band objects of the required bands by band name (e.g. {"b04": <Band>, "b8a": <Band>}).
+
+        Pass strings as separate arguments. For example: `get_bands("b04", "b8a", resolution=10)`
 
-        Pass strings as separate arguments. For example: `get_band_info("aot", "b03", "b05")`
+        Every band is taken in the requested resolution (`Band.range` in meters) if it exists, otherwise in its
+        highest resolution. Bands of different resolutions are aligned when read together (see `BlockProcessor`).
+        Bands which do not exist are missing in the dict.
 
-        See `Band` object for a list of all accessible bands.
+        :return: None if a band is not allowed or does not exist
         """
         # Check if bands allowed
         allowed_bands = SatBand.get_all()
@@ -209,17 +222,41 @@ class SatData(models.Model):
                     f"Band '{band}' is not allowed or does not exist! allowed_bands='{allowed_bands}, required_bands='{required_bands}''")
                 return None
 
-        # Reverse relation accessible through "<related_model>_set"
-        bands = self.band_set.all()
+        def rank(band: Band) -> tuple:
+            # Requested resolution first, then highest resolution, unknown range (0) last
+            return (band.range != resolution, band.range == 0, band.range)
 
-        for band in bands:
-            # Check if all required bands have values in the BandInfo object
-            if all(getattr(band, f"{band}_path") for band in required_bands):
-                return band
+        bands = {}
+        for band in self.bands.filter(type__in=required_bands):
+            if band.type not in bands or rank(band) < rank(bands[band.type]):
+                bands[band.type] = band
 
-        logging.warning(
-            f"Could not find a band info item containing all required bands. required_bands='{required_bands}''")
-        return None
+        missing_bands = [band for band in required_bands if band not in bands]
+        if missing_bands:
+            logging.warning(
+                f"Could not find all required bands. required_bands='{required_bands}', missing_bands='{missing_bands}'")
+        return bands
+
+    def is_stage_done(self, stage: str) -> bool:
+        """ Returns whether the ingest stage (e.g. "extract", "bands") finished successfully."""
+        return (self.ingest_stages or {}).get(stage, {}).get("status") == Status.DONE.value
+
+    def set_stage_status(self, stage: str, status: str, error: str = "", save: bool = True):
+        """
+        Records the status of an ingest stage and saves the SatData object.
+
+        The stage's outputs are fields of the SatData object, so they are checkpointed by the same save.
+        Pass `save=False` if the caller saves the object itself (e.g. with a `UnitOfWork`).
+        """
+        if self.ingest_stages is None:
+            self.ingest_stages = {}
+        self.ingest_stages[stage] = {
+            "status": status,
+            "time": timezone.now().isoformat(),
+            "error": str(error),
+        }
+        if save:
+            self.save()
 
     def img_save_loc(self, index_name: str = ""):
         """
@@ -300,6 +337,13 @@ class Index(models.Model):
                             upload_to=index_upload_path,
                             verbose_name="Index img",
                             storage=OverwriteStorage())
+    # Index values as float32 Cloud Optimized GeoTIFF
+    cog = models.FileField(max_length=255,
+                           null=True,
+                           blank=True,
+                           upload_to=index_upload_path,
+                           verbose_name="Index COG",
+                           storage=OverwriteStorage())
     archived_img_paths = models.TextField()
 
     # Relationships
@@ -317,6 +361,42 @@ class Index(models.Model):
     def __str__(self):
         return f"Index<'{self.id}', SatData '{self.sat_data.id}'>"
 
+
+class IndexStats(models.Model):
+    """ Statistics of an index' valid (not NaN) values."""
+    # Attributes
+    valid_count = models.BigIntegerField(default=0, verbose_name="Valid Pixels")
+    mean = models.FloatField(blank=True, null=True)
+    std = models.FloatField(blank=True, null=True)
+    min = models.FloatField(blank=True, null=True)
+    max = models.FloatField(blank=True, null=True)
+    # Approximated from the histogram, by percentile (e.g. {"50": 0.42})
+    percentiles = models.JSONField(default=dict, blank=True)
+    # Fixed bins: equal width from `hist_min` to `hist_max`, values outside are counted in the first or last bin
+    hist_min = models.FloatField()
+    hist_max = models.FloatField()
+    hist_counts = ArrayField(models.BigIntegerField(), default=list)
+
+    # Relationships
+    index = models.OneToOneField(
+        Index,
+        on_delete=models.CASCADE,
+        related_name="stats",
+        primary_key=True,
+    )  # Primary key!
+
+    # Meta data
+    class Meta:
+        db_table = "index_stats"
+
+    # Methods
+    def to_dict(self):
+        return ModelUtil.to_dict(self)
+
+    def __str__(self):
+        return f"IndexStats<Index '{self.index.id}'>"
+
+
 class SHRequest(models.Model):
     """ Represents a request to the Sentinel Hub API."""
     id = models.UUIDField(
@@ -377,3 +457,74 @@ class SHRequest(models.Model):
     def __str__(self):
         return f"SHRequest<'{self.id}'>"
         # return f"SHRequest<SatData '{self.sat_data.id}'>"
+
+
+class IngestJob(models.Model):
+    """ Represents an archive waiting for or going through ingestion by an ingest worker."""
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+        verbose_name="ID",
+    )
+    archive_path = models.CharField(
+        max_length=255,
+        verbose_name="Archive Path",
+    )
+    mission = models.CharField(
+        max_length=50,
+        blank=True,
+        default=SatMission.UNKNOWN.value,
+    )
+    archive_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default="",
+        db_index=True,
+        verbose_name="Archive SHA-256",
+    )
+    metrics_to_calc = ArrayField(
+        models.CharField(max_length=300), default=list)
+    status = models.CharField(
+        max_length=20,
+        blank=True,
+        default=Status.QUEUED.value,
+        db_index=True,
+    )
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=INGEST_JOB_MAX_ATTEMPTS)
+    error = models.TextField(blank=True, default="")
+    worker = models.CharField(
+        max_length=100,
+        blank=True,
+        default="",
+        verbose_name="Worker",
+    )
+    creation_time = models.DateTimeField(auto_now_add=True)
+    update_time = models.DateTimeField(auto_now=True)  # heartbeat of running jobs
+    run_after = models.DateTimeField(default=timezone.now)  # delays retries
+    start_time = models.DateTimeField(blank=True, null=True)
+    finish_time = models.DateTimeField(blank=True, null=True)
+
+    # Relationships
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        blank=True,
+        default=get_dews_user,
+    )
+    sat_data = models.ForeignKey(
+        SatData,
+        on_delete=models.SET_NULL,
+        related_name="ingest_jobs",
+        null=True,
+        blank=True,
+    )
+
+    # Meta data
+    class Meta:
+        db_table = "ingest_job"
+        ordering = ["creation_time"]  # ascending order, oldest job first
+
+    def __str__(self):
+        return f"IngestJob<'{self.id}', '{self.status}'>"
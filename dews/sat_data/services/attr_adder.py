@@ -1,28 +1,31 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
-from multiprocessing import Process
 import re
 import os
 import logging
 import threading
 import uuid
 from geopy.geocoders import Nominatim
-import subprocess
 from datetime import date
 
 from django.contrib.gis.geos import Polygon
 from django.contrib.gis.gdal import GDALRaster
-from dews.settings import DB_HOST, DB_NAME, DB_PORT, DB_USER, DB_PASSWORD
+from django.db import connection
 
 from sat_data.services.path_finder import PathFinder
+from sat_data.services.raster_loader import get_raster_loader, get_storage_mode
+from sat_data.services.band_raster import PARTITION_KEY, create_partition, get_imported_bands
+from sat_data.services.unit_of_work import UnitOfWork
 from sat_data.services.utils.file_utils import FileUtils
 from sat_data.services.utils.dataset_utils import get_dataset
-import sat_data.services.metrics_calc as mc
+from sat_data.services.metrics_runner import calculate_metrics
 from sat_data.enums.sat_mission import SatMission
+from sat_data.enums.status import Status
 from sat_data.enums.sat_prod_type import S2BProdType, S3AProdType, S3BProdType
 from sat_data.models import Area, Band, SatData, TimeTravel, remove_media_root
 from sat_data.enums.sat_prod_type import S1AProdType, S2AProdType, S2BProdType
-from dews.settings import MEDIA_ROOT
+from dews.settings import MEDIA_ROOT, BAND_IMPORT_MAX_WORKERS, BAND_FILE_STORAGE_MODE, DEFAULT_METRICS_TO_CALC
 
 
 logger = logging.getLogger("django")
@@ -60,13 +63,23 @@ class AttrAdder():
     ]
     path_dict = {}
 
+    # Ingest stages in order of execution, each one is run by its `run_<stage>_stage` method
+    stages = [
+        "product_type",
+        "paths",
+        "thumbnail",
+        "coordinates",
+        "area",
+        "time_travel",
+        "bands",
+    ]
+
     def __init__(self, sat_data: SatData, extracted_path: str, mission: str, sh_request=False, bbox=None, bands=None, date=None) -> None:
         logger.debug("AttrAdder object created.")
         # Set processing status
         sat_data.processing_done = False
         logger.debug(
             f"Set processing status to '{sat_data.processing_done}'. sat_data.id='{sat_data.id}'")
-        sat_data.save()
 
         if sat_data is None:
             logger.error(
@@ -85,6 +98,8 @@ class AttrAdder():
                 f"Set SatData variable in AttrAdder object. sat_data='{sat_data}'")
             self.sat_data = sat_data
             self.id = sat_data.id
+            # Changes are written by the stage checkpoints
+            self.unit_of_work = UnitOfWork(sat_data)
             self.extracted_path = extracted_path
             if MEDIA_ROOT in extracted_path:
                 self.extracted_abs_path = extracted_path
@@ -97,12 +112,54 @@ class AttrAdder():
             self.bbox = bbox
             self.bands = bands
             self.date = date
+            # Resumed ingestions skip the product type stage
+            self.product_type = sat_data.product_type
+            self.path_dict = {}
+            self.metadata_dict = {}
             logger.debug(
                 f"Set AttrAdder class variables. sat_data.id='{self.id}'")
 
     def start(self):
-        """ Starts the process of adding attributes to SatData object."""
+        """
+        Starts the process of adding attributes to SatData object.
+
+        The process is split into stages (see `stages`). The status of every stage is saved in the SatData object,
+        so a retry resumes from the first incomplete stage.
+        """
         logger.debug(f"Starting AttrAdder process... sat_data.id='{self.id}'")
+        for stage in self.stages:
+            if self.sat_data.is_stage_done(stage):
+                logger.info(
+                    f"Skipping stage which is already done. sat_data.id='{self.id}', stage='{stage}'")
+                continue
+
+            logger.debug(f"Running stage... sat_data.id='{self.id}', stage='{stage}'")
+            try:
+                getattr(self, f"run_{stage}_stage")()
+            except Exception as e:
+                logger.error(
+                    f"Stage failed. sat_data.id='{self.id}', stage='{stage}', error='{e}'")
+                self.unit_of_work.discard()
+                self.sat_data.set_stage_status(stage, Status.FAILED.value, e)
+                raise
+            # Checkpoint stage status and outputs
+            self.sat_data.set_stage_status(stage, Status.DONE.value, save=False)
+            self.unit_of_work.flush()
+            logger.debug(f"Stage done. sat_data.id='{self.id}', stage='{stage}'")
+
+        # Metrics calculation
+        # self.metrics_calculation()
+        # logger.debug(f"Metrics calculation done. sat_data.id='{self.id}'")
+
+        # Save operation is executed in views
+        logger.debug(f"AttrAdder done! sat_data.id='{self.id}'")
+
+        # Processing is done after the metrics calculation (see `IngestWorker.finish`)
+        # Save SatData object
+        logger.debug(f"Execute final save. sat_data.id='{self.id}'")
+        self.unit_of_work.flush()
+
+    def run_product_type_stage(self):
         # Set prod type and mission
         self.set_product_type()
         self.set_extracted_path()
@@ -110,20 +167,8 @@ class AttrAdder():
         self.set_name()
         logger.debug(f"Set product type and mission. sat_data.id='{self.id}'")
 
+    def run_paths_stage(self):
         if not self.sh_request:
-            # Get path dictionary (only for archives!)
-            logger.debug(f"Calling PathFinder... sat_data.id='{self.id}'")
-            path_finder = PathFinder()
-            self.path_dict = path_finder.get_path_dict(
-                extracted_path=self.extracted_abs_path,
-                mission=self.mission,
-                product_type=self.sat_data.product_type,
-            )
-            logger.debug(
-                f"Successfully created path dictionary. sat_data.id='{self.id}'")
-            logger.debug(
-                f"SatData id: {self.sat_data.id}, Path dict: {self.path_dict}")
-
             # Set file paths
             self.set_mtd()
             self.set_manifest()
@@ -140,36 +185,43 @@ class AttrAdder():
                 self.extracted_abs_path, "response.tar")
             self.check_for_tar_file(tar_path)
 
+    def run_thumbnail_stage(self):
         self.set_thumbnail()
         logger.debug(
             f"Set thumbnail. sat_data.id='{self.id}', sat_data.thumbnail='{self.sat_data.thumbnail}'")
 
-        # Set other info
+    def run_coordinates_stage(self):
         self.set_coordinates()
+
+    def run_area_stage(self):
         self.set_area_details()
-        self.set_time_travel()
 
+    def run_time_travel_stage(self):
+        self.set_time_travel()
         logger.debug(
             f"Set coordinates, capture info/area details and TimeTravel object. sat_data.id='{self.id}'")
 
+    def run_bands_stage(self):
         # Long time consuming process:
         self.set_bands()
         logger.debug(f"Set bands. sat_data.id='{self.id}'")
 
-        # Metrics calculation
-        # self.metrics_calculation()
-        # logger.debug(f"Metrics calculation done. sat_data.id='{self.id}'")
-
-        # Save operation is executed in views
-        logger.debug(f"AttrAdder done! sat_data.id='{self.id}'")
-
-        # Set processing status
-        self.sat_data.processing_done = True
-        logger.debug(
-            f"Set processing status to '{self.sat_data.processing_done}'. sat_data.id='{self.id}'")
-        # Save SatData object
-        logger.debug(f"Execute final save. sat_data.id='{self.id}'")
-        self.sat_data.save()
+    def get_path_dict(self) -> dict:
+        """ Returns the path dictionary of the archive. It is created on first use, as resumed stages may need it."""
+        if not self.path_dict:
+            # Get path dictionary (only for archives!)
+            logger.debug(f"Calling PathFinder... sat_data.id='{self.id}'")
+            path_finder = PathFinder()
+            self.path_dict = path_finder.get_path_dict(
+                extracted_path=self.extracted_abs_path,
+                mission=self.mission,
+                product_type=self.sat_data.product_type,
+            )
+            logger.debug(
+                f"Successfully created path dictionary. sat_data.id='{self.id}'")
+            logger.debug(
+                f"SatData id: {self.sat_data.id}, Path dict: {self.path_dict}")
+        return self.path_dict
 
     def check_for_tar_file(self, tar_path):
         if os.path.exists(tar_path):
@@ -193,42 +245,15 @@ class AttrAdder():
         logger.debug(
             f"Set extracted path. sat_data.id='{self.id}', extracted_path='{self.extracted_path}'")
 
-    def metrics_calculation(self):
-        logger.debug(f"Calculating metrics... sat_data.id='{self.id}'")
-
-        metrics_calculator = mc.MetricsCalculator(
-            sat_data=self.sat_data,
-            bands_paths=self.bands_paths,
-            metrics_to_calc=["ndvi", "smi", "rgb"])  # TODO: given by user
-        process = Process(target=metrics_calculator.start, args=(self,))
-        logger.debug(
-            f"Starting metrics calculation process... sat_data.id='{self.id}'")
-        process.start()
-
-        # # Calculate NDVI
-        # if "B04" in self.bands and "B08" in self.bands:
-        #     logger.debug(f"Calculate NDVI. sat_data.id='{self.id}', image_path_04='{self.bands_paths['b04']}', image_path_08='{self.bands_paths['b08']}'")
-        #     mc.calculate_ndvi(
-        #         sat_data=self.sat_data,
-        #         image_path_04=self.bands_paths["b04"],
-        #         image_path_08=self.bands_paths["b08"],
-        #         save_location=FileUtils.generate_path(
-        #             self.extracted_abs_path),
-        #     )
-        # # Calculate SMI
-        # if "B8A" in self.bands and "B11" in self.bands:
-        #     mc.calculate_smi(
-        #         sat_data=self.sat_data,
-        #         image_path_8a=self.bands_paths["b8a"],
-        #         image_path_11=self.bands_paths["b11"],
-        #         save_location=FileUtils.generate_path(
-        #             self.extracted_abs_path),
-        #     )
+    def metrics_calculation(self, metrics_to_calc: list = DEFAULT_METRICS_TO_CALC):
+        """ Calculates the metrics, the SatData object has to be saved before."""
+        logger.debug(f"Calculating metrics... sat_data.id='{self.id}', metrics_to_calc='{metrics_to_calc}'")
+        return calculate_metrics(self.sat_data, metrics_to_calc)
 
     def set_mtd(self):
         """ Sets mtd attribte in SatData object."""
         logger.debug(f"Setting mtd ... sat_data.id='{self.id}'")
-        mtd_path = self.path_dict["mtd"]
+        mtd_path = self.get_path_dict()["mtd"]
 
         if mtd_path == "":
             logger.info(
@@ -292,7 +317,7 @@ class AttrAdder():
         else:
             # Archive upload
             # Check if metadata_dict is empty
-            if not self.metadata_dict:
+            if not self.load_metadata_dict():
                 logger.warn(
                     f"Metadata dictionary is empty. sat_data.id='{self.id}'")
                 return
@@ -327,12 +352,6 @@ class AttrAdder():
             f"Getting country using Nominatim... sat_data.id='{self.id}'")
         country = self.get_country()
 
-        # Save SatData object
-        try:
-            self.sat_data.save()
-        except Exception as e:
-            logger.error(
-                f"Could not save SatData object. sat_data.id='{self.id}', exception='{e}'")
         # Create AreaInfo object
         area = Area(sat_data=self.sat_data,
                     country=country,
@@ -345,13 +364,19 @@ class AttrAdder():
         self.sat_data.area = area
         logger.debug(
             f"Set AreaInfo object as attribute to SatData object. sat_data.id='{self.id}'")
-        self.sat_data.save()
-        logger.debug(f"Saved SatData object. sat_data.id='{self.id}'")
         area.sat_data = self.sat_data
         logger.debug(
             f"Set SatData object as attribute to AreaInfo object. sat_data.id='{self.id}'")
-        area.save()
-        logger.debug(f"Saved AreaInfo object. sat_data.id='{self.id}'")
+        # Inserted by the stage checkpoint
+        self.unit_of_work.add(area)
+
+    def load_metadata_dict(self) -> dict:
+        """ Reads the manifest into the metadata dictionary, if it was not read by the coordinates stage."""
+        if not self.metadata_dict and self.product_type in PathFinder.has_manifest_prod_types and self.sat_data.manifest:
+            manifest_path = self.sat_data.manifest.url
+            if os.path.exists(manifest_path):
+                self.metadata_dict = FileUtils.xml_to_dict(manifest_path)
+        return self.metadata_dict
 
     def get_start_and_stop_time(self, format, start_time_keyword, stop_time_keyword):
         logger.debug(
@@ -593,7 +618,7 @@ class AttrAdder():
 
         # Get all .jp2 file paths
         # MTD path already contains the `extracted_path`
-        mtd_path = FileUtils.generate_path(MEDIA_ROOT, self.path_dict["mtd"])
+        mtd_path = FileUtils.generate_path(MEDIA_ROOT, self.get_path_dict()["mtd"])
         logger.debug(f"MTD Path: {mtd_path}")
         mtd_dict = FileUtils.xml_to_dict(mtd_path)
         jp2_paths = FileUtils.get_all_dict_values_by_key(
@@ -607,7 +632,6 @@ class AttrAdder():
         # Band sub strings (B01, B02, ..., B8A, B09, ...)
         bands_strings = [f"B{str(i).zfill(2)}" if i != 8 else "B8A" for i in range(
             1, 13)] + ["AOT", "TCI", "WVP", "SCL"]
-        sat_data.save()
 
         # Convert band to raster and import to database
 
@@ -618,16 +642,8 @@ class AttrAdder():
     def convert_and_add_bands(self, sat_data: SatData, band_paths, bands_strings):
         logger.debug(f"Convert and add bands... sat_data.id='{self.id}'")
 
-        sat_data.band_tables = {
-            "unknown": [],
-            "r10m": [],
-            "r20m": [],
-            "r60m": [],
-        }
         logger.debug(
-            f"Set empty 'bands' and 'band_tables' variables. sat_data.id='{self.id}'")
-        sat_data.save()
-        logger.debug(f"Saved SatData object. sat_data.id='{self.id}'")
+            f"Set empty 'bands' variable. sat_data.id='{self.id}'")
 
         # Check input
         if len(band_paths) == 0:
@@ -639,6 +655,8 @@ class AttrAdder():
                 f"Empty 'bands_strings' array passed. sat_data.id='{self.id}'")
             return
 
+        # Collect bands to import
+        bands_to_import = []
         for band_path in band_paths:
             for band_string in bands_strings:
                 if band_string in band_path:
@@ -660,142 +678,170 @@ class AttrAdder():
                     if band_string == ".nc":
                         band_string = band_path_splitted[-1].lower()
 
-                    # Shorten mission name
-                    logger.debug(
-                        f"Shortening mission name... sat_data.id='{self.id}'")
-                    mission = sat_data.mission
-                    if "-" in mission:
-                        mission_split = mission.split("-")
-                        mission = f"{mission_split[0][0]}{mission_split[1]}"
+                    bands_to_import.append(
+                        (band_path, band_string, range_string))
+
+        # All bands are stored in the SatData object's partition of the band raster table
+        partition_name = create_partition(sat_data.id)
+        sat_data.band_tables = {**(sat_data.band_tables or {}), PARTITION_KEY: [partition_name]}
+
+        # Bands of a previous, interrupted attempt are kept
+        # Both import engines insert a band within a single transaction, so an imported band is complete
+        imported_bands = get_imported_bands(sat_data.id)
+        existing_bands = set(sat_data.bands.values_list("type", "range"))
+        imported = {}
+        for band in bands_to_import:
+            _, band_string, range_string = band
+            if (band_string.lower(), self.get_range(range_string)) in imported_bands:
+                logger.info(
+                    f"Band already imported. sat_data.id='{self.id}', band_string='{band_string}', range_string='{range_string}'")
+                imported[band] = True
 
-                    # Create and import table (as raster) to database
-                    logger.debug(
-                        f"Creating and importing table... sat_data.id='{self.id}'")
-                    table_name = self.import_raster_and_create_table(
-                        sat_data=sat_data,
-                        mission=mission,
-                        band_path=band_path,
-                        band_string=band_string,
-                        range_string=range_string,
-                    )
+        # Import bands (as raster) to database
+        # Every band is inserted in its own transaction, so the imports are independent of each other
+        pending_imports = [band for band in bands_to_import if band not in imported]
+        max_workers = max(1, min(BAND_IMPORT_MAX_WORKERS, len(pending_imports)))
+        logger.debug(
+            f"Importing bands... sat_data.id='{self.id}', bands='{len(pending_imports)}', skipped='{len(imported)}', max_workers='{max_workers}'")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                band: executor.submit(
+                    self.import_raster,
+                    sat_data=sat_data,
+                    band_path=band[0],
+                    band_string=band[1],
+                    range_string=band[2],
+                )
+                for band in pending_imports
+            }
+            for band, future in futures.items():
+                imported[band] = future.result()
+
+        # Keep the planner's statistics of the partition up to date
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE "{partition_name}";')
+
+        # Create Band objects
+        failed_bands = []
+        for band in bands_to_import:
+            band_path, band_string, range_string = band
+            if (band_string.lower(), self.get_range(range_string)) in existing_bands:
+                logger.debug(
+                    f"Band object already exists. sat_data.id='{self.id}', band_string='{band_string}', range_string='{range_string}'")
+            else:
+                logger.debug(
+                    f"Creating Band object... sat_data.id='{self.id}', band_path='{band_path}', band_string='{band_string}', range_string='{range_string}'")
+                ok = self.create_band_obj(
+                    band_path=band_path,
+                    band_string=band_string,
+                    range_string=range_string,
+                )
+                if not ok:
+                    logger.error(
+                        f"Could not create Band instance. sat_data.id='{self.id}', band_path='{band_path}'")
+                    failed_bands.append(band_path)
+                    continue
 
-                    # Create Band object
-                    logger.debug(
-                        f"Creating Band object... sat_data.id='{self.id}', band_path='{band_path}', band_string='{band_string}', range_string='{range_string}'")
-                    ok = self.create_band_obj(
-                        band_path=band_path,
-                        band_string=band_string,
-                        range_string=range_string,
-                    )
-                    if not ok:
-                        logger.error(
-                            f"Could not create Band instance. sat_data.id='{self.id}', table_name='{table_name}'")
-
-                    # Append table name to band_tables JSONField
-                    if range_string in sat_data.band_tables:
-                        # Append to existing array
-                        sat_data.band_tables[range_string].append(table_name)
-                        sat_data.save()
-                        logger.debug(
-                            f"Appended table name to existing array '{range_string}' in JSONField 'band_tables'. sat_data.id='{self.id}', table_name='{table_name}'")
-                    else:
-                        logger.info(
-                            f"Range string not found in band_tables. sat_data.id='{self.id}', range_string='{range_string}'")
-
-        # Append table names to SatData object's band_tables array
-        # sat_data.band_tables = band_tables
-        sat_data.processing_done = True
-        sat_data.save()
+            if not imported[band]:
+                logger.error(
+                    f"Band was not imported into the database. sat_data.id='{self.id}', band_path='{band_path}'")
+                failed_bands.append(band_path)
+
+        # Stage is retried, bands which were imported are skipped then
+        if failed_bands:
+            raise Exception(
+                f"Failed to import bands. sat_data.id='{self.id}', failed_bands='{failed_bands}'")
+
+        # band_tables and the new Band objects are written by the stage checkpoint
         logger.debug(
-            f"Appended table names to SatData object's band_tables array. sat_data.id='{self.id}'")
+            f"Imported bands into partition. sat_data.id='{self.id}', partition_name='{partition_name}'")
 
     def create_band_obj(self, band_path, band_string, range_string):
         try:
-            # Ensure self.sat_data is not None and it's saved
+            # Ensure self.sat_data is not None
             if self.sat_data and self.sat_data.pk:
                 logger.debug(
-                    f"SatData instance is valid and saved. sat_data.id='{self.id}'")
+                    f"SatData instance is valid. sat_data.id='{self.id}'")
             else:
                 logger.error(
-                    f"SatData instance is either 'None' or not saved. sat_data.id='{self.id}'")
-                return
+                    f"SatData instance is either 'None' or has no primary key. sat_data.id='{self.id}'")
+                return False
 
             # Create Band object
-            if range_string == "unknown":
-                range = 0  # 0 represents unknown range
-            else:
-                range = int(re.search(r'\d+', range_string).group())
+            range = self.get_range(range_string)
             logger.debug(
                 f"Creating Band object... sat_data.id='{self.id}', range='{range}', band_string='{band_string}'")
-            band: Band = Band.objects.create(
+            band = Band(
                 range=range,
                 type=band_string.lower(),
                 sat_data=self.sat_data,
             )
+
+            # Set band image to Band object
+            self.set_band_file(band, band_path, band_string, range_string)
+
+            # Band objects are inserted with one `bulk_create` by the stage checkpoint
+            self.unit_of_work.add(band)
             logger.debug(
-                f"Successfully created Band object. band.id='{band.id}', range='{range}', type='{band_string}', sat_data.id='{self.sat_data.id}'")
-
-            # Save band image and set to Band object
-            # band_path_full = FileUtils.generate_path(self.sat_data.extracted_path, band_path)
-            save_path = FileUtils.generate_path(
-                "sentinel_hub/uploads", f"{self.sat_data.id}_{band_string}_{range_string}.tif")
-            with open(band_path, "rb") as img_file:
-                band.band_file.save(save_path, img_file)
-
-            # Save Band object
-            band.save()
-            # Ensure self.sat_data is not 'None' and it's saved
-            if self.sat_data and self.sat_data.pk:
-                logger.debug(
-                    f"Band instance is valid and saved. band.id='{band.id}'")
-                if band.sat_data.id != self.sat_data.id:
-                    # Error: no relation between Band and SatData
-                    logger.error(
-                        f"Band instance is not related to SatData instance. band.id='{band.id}', sat_data.id='{self.id}'")
-                    return False
-                # Relation between Band and SatData is valid
-                logger.debug(
-                    f"Band instance is related to SatData instance. band.id='{band.id}', sat_data.id='{self.id}'")
-                return True
-            else:
-                # Error: Band instance is 'None' or not saved
-                logger.error(
-                    f"Band instance is either 'None' or not saved. band.id='{band.id}'")
-                return False
+                f"Successfully created Band object. range='{range}', type='{band_string}', sat_data.id='{self.sat_data.id}'")
+            return True
 
         except Exception as e:
             logger.error(
                 f"Could not create Band object. sat_data.id='{self.id}', error='{e}'")
             return False
 
-    def import_raster_and_create_table(self, mission: str, sat_data: SatData, band_path, band_string, range_string):
-        table_name = f"{mission}_{sat_data.id}_{band_string}".lower()
-        # pgsql options
-        # -I: Create spatial index
-        # -C: Apply raster constraints
-        # -F: Add a column with the filename
-        # -t auto: Automatically chooses a suitable tile size based on the input raster’s dimensions
-        import_cmd = f"raster2pgsql -I -C -F -t auto '{band_path}' public.{table_name} | psql -U {DB_USER} -d {DB_NAME} -h {DB_HOST} -p {DB_PORT}"
-        logger.debug(f"table_name: {table_name}")
-        logger.debug(f"import_cmd: {import_cmd}")
-
-        # Using environment variables for credentials
-        env_vars = {
-            "PGPASSWORD": DB_PASSWORD
-        }
-
-        # Executing the command
-        try:
-            subprocess.check_output(
-                import_cmd, shell=True, env=env_vars)
-        except Exception as e:
-            logger.error(
-                f"Failed to import raster. error='{e}', band_string='{band_string}', range_string='{range_string}', band_path='{band_path}'")
+    def set_band_file(self, band: Band, band_path: str, band_string, range_string):
+        """
+        Sets the band image of the Band object depending on `BAND_FILE_STORAGE_MODE`.
+
+        "reference" uses the extracted file in place, "link" hardlinks it into the upload path and "copy" copies it.
+        Falls back to linking or copying if the file is not inside `MEDIA_ROOT` or cannot be linked.
+        """
+        band_abs_path = os.path.abspath(band_path)
+        if BAND_FILE_STORAGE_MODE == "reference" and band_abs_path.startswith(f"{MEDIA_ROOT}/"):
+            band.band_file.name = remove_media_root(band_abs_path)
+            logger.debug(
+                f"Referenced band file in place. sat_data.id='{self.id}', band_file='{band.band_file.name}'")
             return
 
+        save_path = FileUtils.generate_path(
+            "sentinel_hub/uploads", f"{self.sat_data.id}_{band_string}_{range_string}.tif")
+        if BAND_FILE_STORAGE_MODE in ["reference", "link"]:
+            name = band.band_file.field.generate_filename(band, save_path)
+            if FileUtils.link_file(band_abs_path, band.band_file.storage.path(name)):
+                band.band_file.name = name
+                logger.debug(
+                    f"Linked band file. sat_data.id='{self.id}', band_file='{name}'")
+                return
+
+        # Copy band image
+        with open(band_path, "rb") as img_file:
+            band.band_file.save(save_path, img_file, save=False)
+        logger.debug(
+            f"Copied band file. sat_data.id='{self.id}', band_file='{band.band_file.name}'")
+
+    def get_range(self, range_string: str) -> int:
+        """ Returns the range in meter of a range string like "r10m" (0 represents unknown range)."""
+        if range_string == "unknown":
+            return 0
+        return int(re.search(r'\d+', range_string).group())
+
+    def import_raster(self, sat_data: SatData, band_path, band_string, range_string) -> bool:
+        # Range is stored with the tiles, as the same band can exist in several resolutions (e.g. R10m, R20m)
+        band_range = self.get_range(range_string)
+
+        # Import raster using the configured engine and the storage mode of the mission or product type
+        loader = get_raster_loader(storage_mode=get_storage_mode(sat_data.mission, sat_data.product_type))
+        ok = loader.load(band_path=band_path, sat_data_id=sat_data.id, band=band_string.lower(), band_range=band_range)
+        if not ok:
+            logger.error(
+                f"Failed to import raster. engine='{loader.engine}', band_string='{band_string}', range_string='{range_string}', band_path='{band_path}'")
+            return False
+
         logger.info(
-            f"Successfully imported raster. band_string='{band_string}', table_name='{table_name}', band_path='{band_path}'")
-        return table_name
+            f"Successfully imported raster. engine='{loader.engine}', band_string='{band_string}', range='{band_range}', band_path='{band_path}'")
+        return True
 
     def get_range_string(self, band_path, band_path_splitted):
         range_string = "unknown"
@@ -879,7 +925,7 @@ class AttrAdder():
         """ Sets manifest attribute in SatData object."""
         # Set metadata
         logger.debug(f"Setting manifest path... sat_data.id='{self.id}'")
-        manifest_path = self.path_dict["manifest"]
+        manifest_path = self.get_path_dict()["manifest"]
         self.sat_data.manifest = remove_media_root(manifest_path)
         logger.info(
             f"Set manifest. sat_data.id='{self.id}', sat_data.mission='{self.mission}', manifest_path='{manifest_path}'")
@@ -905,7 +951,7 @@ class AttrAdder():
                 thumbnail_path = response_thumbnail_path
         else:
             # Archive upload
-            thumbnail_path = self.path_dict["thumbnail"]
+            thumbnail_path = self.get_path_dict()["thumbnail"]
 
         # Set thumbnail
         if thumbnail_path:
@@ -920,7 +966,7 @@ class AttrAdder():
     def set_eop_metadata(self):
         """ Sets eop metadata attribte in SatData object."""
         logger.debug(f"Setting eop metadata... sat_data.id='{self.id}'")
-        eop_metadata_path = self.path_dict["eop_metadata"]
+        eop_metadata_path = self.get_path_dict()["eop_metadata"]
 
         if eop_metadata_path == "":
             logger.info(
@@ -933,7 +979,7 @@ class AttrAdder():
     def set_xfdu_manifest(self):
         """ Sets xfdu manifest attribte in SatData object."""
         logger.debug(f"Setting xfdu manifest... sat_data.id='{self.id}'")
-        xfdu_manifest_path = self.path_dict["xfdu_manifest"]
+        xfdu_manifest_path = self.get_path_dict()["xfdu_manifest"]
 
         if xfdu_manifest_path == "":
             logger.info(
@@ -946,7 +992,7 @@ class AttrAdder():
     def set_manifest(self):
         """ Sets manifest attribute in SatData object."""
         logger.debug(f"Setting manifest... sat_data.id='{self.id}'")
-        manifest_path = self.path_dict["manifest"]
+        manifest_path = self.get_path_dict()["manifest"]
 
         if manifest_path == "":
             logger.info(
@@ -959,7 +1005,7 @@ class AttrAdder():
     def set_inspire(self):
         """ Sets inspire attribte in SatData object."""
         logger.debug(f"Setting inspire... sat_data.id='{self.id}'")
-        inspire_path = self.path_dict["inspire"]
+        inspire_path = self.get_path_dict()["inspire"]
 
         if inspire_path == "":
             logger.info(
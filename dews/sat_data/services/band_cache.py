@@ -0,0 +1,166 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from dews.settings import BAND_CACHE_MEMORY_BUDGET
+
+
+logger = logging.getLogger("django")
+
+
+class CachedBand:
+    """
+    Band held in memory in its native data type.
+
+    Offers the part of the rasterio dataset interface used by `BlockProcessor`, so cached bands and band files
+    can be processed alike.
+    """
+    data: np.ndarray = None
+    nodata = None
+    block_shapes: list = []
+    crs = None
+    transform = None
+
+    def __init__(self, data: np.ndarray, nodata=None, block_shape: tuple = None, crs=None, transform=None) -> None:
+        self.data = data
+        self.nodata = nodata
+        self.block_shapes = [block_shape or data.shape]
+        self.crs = crs
+        self.transform = transform
+
+    @property
+    def height(self) -> int:
+        return self.data.shape[0]
+
+    @property
+    def width(self) -> int:
+        return self.data.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    def read(self, indexes=1, window=None, out_dtype=None, out_shape=None, resampling=None) -> np.ndarray:
+        if out_shape is None:
+            data = self.data if window is None else self.data[window.toslices()]
+        else:
+            # Nearest neighbour resampling of the (fractional) window, like rasterio's decimated reads
+            window = window or Window(0, 0, self.width, self.height)
+            out_height, out_width = out_shape[-2:]
+            rows = window.row_off + (np.arange(out_height) + 0.5) * (window.height / out_height)
+            cols = window.col_off + (np.arange(out_width) + 0.5) * (window.width / out_width)
+            rows = np.clip(rows.astype("int64"), 0, self.height - 1)
+            cols = np.clip(cols.astype("int64"), 0, self.width - 1)
+            data = self.data.take(rows, axis=0).take(cols, axis=1)
+        return data.astype(out_dtype) if out_dtype else data
+
+    def close(self):
+        # Nothing to close, the data stays cached
+        pass
+
+
+def open_band(source):
+    """ Opens a band file with rasterio, cached bands are returned as they are."""
+    if isinstance(source, CachedBand):
+        return source
+    return rasterio.open(source)
+
+
+def get_preview_shape(height: int, width: int, max_size: int) -> tuple:
+    """ Returns the shape (height, width) downscaled so its longest side is at most `max_size` pixels."""
+    scale = min(1.0, max_size / max(height, width))
+    return (max(1, round(height * scale)), max(1, round(width * scale)))
+
+
+def read_preview(sources: list, max_size: int) -> list:
+    """
+    Reads bands decimated to the preview shape of the first band, so bands of different resolutions match.
+
+    Decimated reads use the overviews (or JPEG2000 resolution levels) of band files, which is much faster than
+    reading the full resolution.
+
+    :param sources: File paths or `CachedBand` objects
+    :param max_size: Maximum width and height of the preview in pixels
+    :return: float32 arrays, no data pixels are NaN
+    """
+    previews = []
+    out_shape = None
+    for source in sources:
+        dataset = open_band(source)
+        try:
+            if out_shape is None:
+                out_shape = get_preview_shape(dataset.height, dataset.width, max_size)
+            preview = dataset.read(1, out_shape=out_shape, out_dtype="float32")
+            if dataset.nodata is not None:
+                preview[preview == dataset.nodata] = np.nan
+            previews.append(preview)
+        finally:
+            dataset.close()
+    return previews
+
+
+class BandCache:
+    """
+    Per run cache of bands, so a band used by several metrics is read from disk once.
+
+    The cache holds at most `memory_budget` bytes and evicts the least recently used band when a new band does
+    not fit. Bands bigger than the budget are not cached, their file path is returned and they are read
+    window by window instead.
+    """
+    band_paths: dict = {}
+    memory_budget: int = BAND_CACHE_MEMORY_BUDGET
+
+    def __init__(self, band_paths: dict, memory_budget: int = BAND_CACHE_MEMORY_BUDGET) -> None:
+        """
+        :param band_paths: File paths by band name (e.g. {"b04": "/dews/media/.../B04.jp2"})
+        :param memory_budget: Maximum bytes of cached band data
+        """
+        self.band_paths = band_paths
+        self.memory_budget = memory_budget
+        self.bands = OrderedDict()  # least recently used first
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, band: str):
+        """ Returns the cached band; the file path if the band is bigger than the memory budget."""
+        if band in self.bands:
+            self.hits += 1
+            self.bands.move_to_end(band)
+            return self.bands[band]
+
+        self.misses += 1
+        band_path = self.band_paths[band]
+        with rasterio.open(band_path) as dataset:
+            nbytes = dataset.height * dataset.width * np.dtype(dataset.dtypes[0]).itemsize
+            if nbytes > self.memory_budget:
+                logger.debug(
+                    f"Band exceeds memory budget, reading it from disk. band='{band}', nbytes='{nbytes}', memory_budget='{self.memory_budget}'")
+                return band_path
+
+            # Evict least recently used bands
+            while self.used_bytes + nbytes > self.memory_budget:
+                self.release(next(iter(self.bands)))
+
+            cached_band = CachedBand(dataset.read(1), dataset.nodata, dataset.block_shapes[0],
+                                     dataset.crs, dataset.transform)
+
+        self.bands[band] = cached_band
+        self.used_bytes += cached_band.nbytes
+        logger.debug(
+            f"Cached band. band='{band}', nbytes='{cached_band.nbytes}', used_bytes='{self.used_bytes}'")
+        return cached_band
+
+    def release(self, band: str):
+        """ Removes the band from the cache."""
+        cached_band = self.bands.pop(band, None)
+        if cached_band is not None:
+            self.used_bytes -= cached_band.nbytes
+            logger.debug(f"Released band. band='{band}', used_bytes='{self.used_bytes}'")
+
+    def clear(self):
+        for band in list(self.bands):
+            self.release(band)
@@ -0,0 +1,180 @@
+import ast
+import logging
+
+import numpy as np
+
+from sat_data.enums.sat_band import SatBand
+
+
+logger = logging.getLogger("django")
+
+# Register of the instruction writing the result
+OUT = -1
+
+OPERATORS = {
+    ast.Add: "add",
+    ast.Sub: "sub",
+    ast.Mult: "mul",
+    ast.Div: "div",
+}
+SQL_OPERATORS = {
+    ast.Add: "+",
+    ast.Sub: "-",
+    ast.Mult: "*",
+}
+UFUNCS = {
+    "add": np.add,
+    "sub": np.subtract,
+    "mul": np.multiply,
+}
+
+
+class BandExpression:
+    """
+    Band math formula (e.g. "(B08 - B04) / (B08 + B04)") compiled into a vectorized evaluation plan.
+
+    Formulas consist of band names (see `SatBand`), numbers, `+`, `-`, `*`, `/` and parentheses.
+    The plan is a list of numpy operations writing into a small set of float32 buffers, which are allocated once
+    and reused for every window. Pixels with a division by zero are NaN.
+
+    An instance keeps its buffers between calls, use one instance per thread.
+    """
+    formula: str = ""
+    bands: list = []
+    plan: list = []
+    buffers: list = []
+
+    def __init__(self, formula: str) -> None:
+        self.formula = formula
+        self.bands = []
+        self.plan = []
+        self.buffers = []
+        self.registers = 0
+        self.free_registers = []
+
+        try:
+            tree = ast.parse(formula, mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Invalid band math formula. formula='{formula}', error='{e}'")
+        root = self.__compile(tree.body)
+
+        # The last instruction writes the result
+        if root[0] == "reg":
+            op, _, a, b = self.plan[-1]
+            self.plan[-1] = (op, OUT, a, b)
+        else:
+            self.plan.append(("copy", OUT, root, None))
+        logger.debug(
+            f"Compiled band math formula. formula='{formula}', bands='{self.bands}', instructions='{len(self.plan)}', buffers='{self.registers}'")
+
+    def __compile(self, node) -> tuple:
+        """ Appends the instructions of the node to the plan and returns the operand holding its value."""
+        if isinstance(node, ast.Name):
+            band = node.id.lower()
+            if band not in SatBand.get_all():
+                raise ValueError(f"Unknown band in band math formula. formula='{self.formula}', band='{node.id}'")
+            if band not in self.bands:
+                self.bands.append(band)
+            return ("band", self.bands.index(band))
+        elif isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return ("const", float(node.value))
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = self.__compile(node.operand)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            self.__free(operand)
+            register = self.__allocate()
+            self.plan.append(("neg", register, operand, None))
+            return ("reg", register)
+        elif isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            left = self.__compile(node.left)
+            right = self.__compile(node.right)
+            # Operand buffers are reused for the result
+            self.__free(left)
+            self.__free(right)
+            register = self.__allocate()
+            self.plan.append((OPERATORS[type(node.op)], register, left, right))
+            return ("reg", register)
+
+        raise ValueError(
+            f"Unsupported expression in band math formula. formula='{self.formula}', expression='{ast.unparse(node)}'")
+
+    def __allocate(self) -> int:
+        if self.free_registers:
+            return self.free_registers.pop()
+        self.registers += 1
+        return self.registers - 1
+
+    def __free(self, operand: tuple):
+        if operand[0] == "reg":
+            self.free_registers.append(operand[1])
+
+    def to_sql(self, band_values: list) -> str:
+        """
+        Returns the formula as SQL expression (e.g. for `ST_MapAlgebra` callbacks), divisions by zero are NULL.
+
+        :param band_values: SQL expressions of the bands' values in the order of `self.bands` (e.g. ["value[1][1][1]"])
+        """
+        def translate(node) -> str:
+            # The formula was validated by the compilation
+            if isinstance(node, ast.Name):
+                return band_values[self.bands.index(node.id.lower())]
+            elif isinstance(node, ast.Constant):
+                return repr(float(node.value))
+            elif isinstance(node, ast.UnaryOp):
+                operand = translate(node.operand)
+                return f"(-{operand})" if isinstance(node.op, ast.USub) else operand
+            elif isinstance(node.op, ast.Div):
+                return f"({translate(node.left)} / NULLIF({translate(node.right)}, 0))"
+            return f"({translate(node.left)} {SQL_OPERATORS[type(node.op)]} {translate(node.right)})"
+
+        return translate(ast.parse(self.formula, mode="eval").body)
+
+    def get_buffer(self, i: int, shape: tuple, dtype="float32") -> np.ndarray:
+        """ Returns a view with the shape into the i-th buffer, which grows if needed."""
+        size = int(np.prod(shape))
+        while len(self.buffers) <= i:
+            self.buffers.append(None)
+        buffer = self.buffers[i]
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = np.empty(size, dtype=dtype)
+            self.buffers[i] = buffer
+        return buffer[:size].reshape(shape)
+
+    def evaluate(self, bands: list, out: np.ndarray):
+        """
+        Evaluates the formula and writes the result to `out`. Matches the block function of `BlockProcessor.run`.
+
+        :param bands: Pixel values of the bands in the order of `self.bands`
+        :param out: float32 array receiving the result
+        """
+        shape = out.shape
+        # Buffer 0 and 1 are the division masks, the registers follow
+        invalid = self.get_buffer(0, shape, dtype="bool")
+        zero = self.get_buffer(1, shape, dtype="bool")
+        invalid[...] = False
+        registers = [self.get_buffer(i + 2, shape) for i in range(self.registers)]
+
+        def value(operand):
+            kind, i = operand
+            if kind == "band":
+                return bands[i]
+            elif kind == "reg":
+                return registers[i]
+            return i  # constant
+
+        for op, dest, a, b in self.plan:
+            target = out if dest == OUT else registers[dest]
+            if op == "copy":
+                np.copyto(target, value(a))
+            elif op == "neg":
+                np.negative(value(a), out=target)
+            elif op == "div":
+                divisor = value(b)
+                np.equal(divisor, 0, out=zero)
+                invalid |= zero
+                np.divide(value(a), divisor, out=target, where=~zero)
+            else:
+                UFUNCS[op](value(a), value(b), out=target)
+
+        out[invalid] = np.nan
@@ -0,0 +1,96 @@
+import logging
+import os
+import shutil
+import uuid
+
+from django.db import connection
+
+from dews.settings import BAND_COG_FILES_PATH
+
+
+logger = logging.getLogger("django")
+
+# Raster tiles of all bands, partitioned by SatData object (see migration "0007_band_raster")
+BAND_RASTER_TABLE = "band_raster"
+# Key of the partition in `SatData.band_tables`
+PARTITION_KEY = "partition"
+# Decimation factors of the overview tables "o_<factor>_band_raster", same layout and partitions as the band raster
+# table and registered in `raster_overviews` (see migration "0008_band_raster_overviews")
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32]
+
+
+def get_table_name(factor: int = 1) -> str:
+    """ Returns the name of the band raster table (factor 1) or of its overview table with the factor."""
+    if factor == 1:
+        return BAND_RASTER_TABLE
+    return f"o_{factor}_{BAND_RASTER_TABLE}"
+
+
+def get_overview_factor(band_range: int, scale: float) -> int:
+    """
+    Returns the factor of the coarsest overview whose pixels are not bigger than the scale.
+
+    :param band_range: Resolution of the band in meters (0 if unknown)
+    :param scale: Requested meters per pixel, e.g. of a zoomed-out map; 0 for the full resolution
+    :return: Overview factor; 1 for the full resolution band raster table
+    """
+    if not band_range or not scale:
+        return 1
+    return max([1] + [factor for factor in OVERVIEW_FACTORS if band_range * factor <= scale])
+
+
+def get_partition_name(sat_data_id, factor: int = 1) -> str:
+    """ Returns the name of the SatData object's partition of the band raster table or of an overview table."""
+    return f"{get_table_name(factor)}_{uuid.UUID(str(sat_data_id)).hex}"
+
+
+def create_partition(sat_data_id) -> str:
+    """
+    Creates the SatData object's partitions of the band raster table and of its overview tables if they do not exist.
+
+    The partitions inherit the spatial index and the band index of their tables.
+
+    :return: Partition name of the band raster table
+    """
+    with connection.cursor() as cursor:
+        for factor in [1] + OVERVIEW_FACTORS:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS "{get_partition_name(sat_data_id, factor)}" '
+                f'PARTITION OF {get_table_name(factor)} FOR VALUES IN (%s);',
+                (str(sat_data_id),))
+    partition_name = get_partition_name(sat_data_id)
+    logger.debug(f"Created band raster partitions. partition_name='{partition_name}', sat_data_id='{sat_data_id}'")
+    return partition_name
+
+
+def drop_partition(sat_data_id):
+    """ Drops the SatData object's partitions with all its band tiles, a catalog operation instead of a delete."""
+    with connection.cursor() as cursor:
+        for factor in [1] + OVERVIEW_FACTORS:
+            cursor.execute(f'DROP TABLE IF EXISTS "{get_partition_name(sat_data_id, factor)}";')
+    logger.debug(
+        f"Dropped band raster partitions. partition_name='{get_partition_name(sat_data_id)}', sat_data_id='{sat_data_id}'")
+
+
+def get_imported_bands(sat_data_id) -> set:
+    """ Returns the imported bands of the SatData object as (band, range) tuples, e.g. {("b04", 10)}."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT band, range FROM {BAND_RASTER_TABLE} WHERE sat_data_id = %s;", (str(sat_data_id),))
+        return set(cursor.fetchall())
+
+
+def get_band_cog_dir(sat_data_id) -> str:
+    """ Returns the directory of the SatData object's band COGs (out-db rasters)."""
+    return os.path.join(BAND_COG_FILES_PATH, str(sat_data_id))
+
+
+def get_band_cog_path(sat_data_id, band: str, band_range: int) -> str:
+    """ Returns the path of the band's COG (out-db raster), e.g. ".../band_cogs/<id>/b04_r10m.tif"."""
+    file_name = f"{band}_r{band_range}m.tif" if band_range else f"{band}.tif"
+    return os.path.join(get_band_cog_dir(sat_data_id), file_name)
+
+
+def remove_band_cogs(sat_data_id):
+    """ Removes the SatData object's band COGs, the out-db rasters are unreadable after dropping the partition."""
+    shutil.rmtree(get_band_cog_dir(sat_data_id), ignore_errors=True)
@@ -0,0 +1,130 @@
+import logging
+
+import numpy as np
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from sat_data.services.band_cache import open_band
+from dews.settings import INDEX_MAX_BLOCKS
+
+
+logger = logging.getLogger("django")
+
+# Resampling of bands read on the grid of a band with another resolution, same as `CachedBand`
+BAND_RESAMPLING = Resampling.nearest
+
+
+class BlockProcessor:
+    """
+    Computes per-pixel functions of bands (e.g. spectral indices) window by window.
+
+    The output grid is the one of the band with the highest resolution (e.g. 10 m), bands with a lower
+    resolution (e.g. 20 m) are resampled window by window while reading, without full size copies.
+    The windows are aligned to the internal blocks (tiles or strips) of that band and contain at most
+    `max_blocks` blocks, so only that many blocks per band are in memory at once.
+    The result is written into a preallocated float32 array, its georeference is the one of that band.
+    """
+    sources: list = []
+    max_blocks: int = INDEX_MAX_BLOCKS
+    mask = None
+    crs = None
+    transform = None
+
+    def __init__(self, sources: list, max_blocks: int = INDEX_MAX_BLOCKS, mask=None) -> None:
+        """
+        :param sources: File paths or `CachedBand` objects of the bands, all bands must cover the same extent
+        :param max_blocks: Maximum number of blocks per band read at once
+        :param mask: Optional `CloudMask`, masked pixels are NaN in the output
+        """
+        self.sources = sources
+        self.max_blocks = max(1, max_blocks)
+        self.mask = mask
+
+    def run(self, func, on_window=None) -> np.ndarray:
+        """
+        Calls `func(bands, out)` for every window.
+
+        `bands` are the window's pixel values as float32 arrays (in the order of `sources`),
+        `out` is the window's view into the output array which `func` has to fill.
+        Pixels which are no data in any band or masked are NaN in the output.
+
+        :param on_window: Optional function called with every finished window of the output (e.g. to collect
+            statistics while the window is still in the CPU cache)
+
+        :return: float32 array with the height and width of the highest resolution band, georeferenced by
+            `self.crs` and `self.transform`
+        """
+        datasets = [open_band(source) for source in self.sources]
+        try:
+            reference = max(datasets, key=lambda dataset: dataset.height * dataset.width)
+            for dataset in datasets:
+                # Same extent: all bands have the aspect ratio of the reference (up to a pixel)
+                aspect_difference = abs(dataset.height * reference.width - dataset.width * reference.height)
+                if aspect_difference > max(reference.height, reference.width):
+                    raise ValueError(
+                        f"Bands must cover the same extent. sources='{self.sources}', shapes='{[(dataset.height, dataset.width) for dataset in datasets]}'")
+            self.crs = reference.crs
+            self.transform = reference.transform
+            block_height, block_width = reference.block_shapes[0]
+            output = np.empty((reference.height, reference.width), dtype="float32")
+            windows = self.get_windows(
+                reference.height, reference.width, block_height, block_width, self.max_blocks)
+            logger.debug(
+                f"Processing bands block-wise. sources='{self.sources}', block_shape='{(block_height, block_width)}', windows='{len(windows)}'")
+
+            for window in windows:
+                bands = [self.read_window(dataset, window, reference.height, reference.width) for dataset in datasets]
+                out = output[window.toslices()]
+                func(bands, out)
+
+                # Mask no data pixels
+                for dataset, band in zip(datasets, bands):
+                    if dataset.nodata is not None:
+                        out[band == dataset.nodata] = np.nan
+                if self.mask is not None:
+                    out[self.mask.get(window, reference.height, reference.width)] = np.nan
+
+                if on_window is not None:
+                    on_window(out)
+            return output
+        finally:
+            for dataset in datasets:
+                dataset.close()
+
+    @staticmethod
+    def read_window(dataset, window: Window, height: int, width: int) -> np.ndarray:
+        """ Reads a window of a grid with the height and width from the band, resampled if the band's grid differs."""
+        if (dataset.height, dataset.width) == (height, width):
+            return dataset.read(1, window=window, out_dtype="float32")
+        # Same area in the band's grid, may be fractional
+        scale_y = dataset.height / height
+        scale_x = dataset.width / width
+        band_window = Window(window.col_off * scale_x, window.row_off * scale_y,
+                             window.width * scale_x, window.height * scale_y)
+        return dataset.read(1, window=band_window, out_shape=(int(window.height), int(window.width)),
+                            out_dtype="float32", resampling=BAND_RESAMPLING)
+
+    @staticmethod
+    def get_windows(height: int, width: int, block_height: int, block_width: int, max_blocks: int) -> list:
+        """
+        Returns windows covering the raster, each one made of at most `max_blocks` adjacent blocks.
+
+        Whole block rows are merged if a block row fits, otherwise a block row is split into several windows.
+        """
+        max_blocks = max(1, max_blocks)
+        blocks_per_row = -(-width // block_width)  # ceil
+        windows = []
+        if max_blocks >= blocks_per_row:
+            # Several block rows per window
+            window_height = block_height * (max_blocks // blocks_per_row)
+            for row_off in range(0, height, window_height):
+                windows.append(Window(0, row_off, width, min(window_height, height - row_off)))
+        else:
+            # Parts of a block row per window
+            window_width = block_width * max_blocks
+            for row_off in range(0, height, block_height):
+                for col_off in range(0, width, window_width):
+                    windows.append(Window(col_off, row_off,
+                                          min(window_width, width - col_off),
+                                          min(block_height, height - row_off)))
+        return windows
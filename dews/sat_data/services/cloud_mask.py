@@ -0,0 +1,66 @@
+import logging
+
+import numpy as np
+from rasterio.windows import Window
+
+from sat_data.services.band_cache import open_band
+from dews.settings import SCL_MASK_CLASSES
+
+
+logger = logging.getLogger("django")
+
+
+class CloudMask:
+    """
+    Mask of clouds, cloud shadows and no data pixels from the scene classification (SCL) band of L2A products.
+
+    The mask is built once per SatData object at the SCL band's resolution and kept as bits (1/8 of a boolean
+    array), so every metric can reuse it. `get()` resamples it to the window of the index' grid on the fly
+    (nearest neighbour), bands of the same product cover the same extent at every resolution.
+    """
+    bits: np.ndarray = None
+    height: int = 0
+    width: int = 0
+
+    def __init__(self, scl_source, classes: list = SCL_MASK_CLASSES) -> None:
+        """
+        :param scl_source: File path or `CachedBand` object of the SCL band
+        :param classes: Masked scene classes (see `SCL_MASK_CLASSES`)
+        """
+        dataset = open_band(scl_source)
+        try:
+            scl = dataset.read(1)
+        finally:
+            dataset.close()
+        # Lookup table from scene class to masked
+        masked_classes = np.zeros(max(256, int(scl.max()) + 1), dtype="bool")
+        masked_classes[classes] = True
+        masked = masked_classes[scl]
+
+        self.height, self.width = masked.shape
+        self.masked_count = int(np.count_nonzero(masked))
+        self.bits = np.packbits(masked, axis=1)
+        logger.debug(
+            f"Built cloud mask. scl_source='{scl_source}', classes='{classes}', coverage='{self.coverage:.3f}'")
+
+    @property
+    def coverage(self) -> float:
+        """ Masked fraction of the scene."""
+        return self.masked_count / (self.height * self.width)
+
+    def get(self, window: Window, height: int, width: int) -> np.ndarray:
+        """
+        Returns the mask (True is masked) of a window of a grid with another resolution.
+
+        :param window: Window of the grid
+        :param height: Height of the whole grid
+        :param width: Width of the whole grid
+        """
+        window_height, window_width = int(window.height), int(window.width)
+        rows = (np.arange(window_height) + int(window.row_off)) * self.height // height
+        cols = (np.arange(window_width) + int(window.col_off)) * self.width // width
+        # Unpack only the rows of the window
+        first_row = rows[0]
+        masked = np.unpackbits(self.bits[first_row:rows[-1] + 1], axis=1, count=self.width).view("bool")
+        # Two takes are faster than one fancy index with np.ix_
+        return masked.take(rows - first_row, axis=0).take(cols, axis=1)
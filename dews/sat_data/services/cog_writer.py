@@ -0,0 +1,152 @@
+import logging
+import os
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as copy_dataset
+from rasterio.windows import Window
+
+from dews.settings import INDEX_COG_BLOCK_SIZE, INDEX_COG_COMPRESSION, RASTER_TILE_SIZE, BAND_COG_COMPRESSION
+
+
+logger = logging.getLogger("django")
+
+OVERVIEW_RESAMPLING = "AVERAGE"
+# Resampling of band overviews, same as `raster2pgsql -l` (keeps classes of e.g. the SCL band)
+BAND_OVERVIEW_RESAMPLING = Resampling.nearest
+
+
+def write_cog(values: np.ndarray, save_loc: str, crs=None, transform=None,
+              block_size: int = INDEX_COG_BLOCK_SIZE, compression: str = INDEX_COG_COMPRESSION) -> bool:
+    """
+    Saves float32 values as tiled and compressed Cloud Optimized GeoTIFF with internal overviews.
+
+    NaN is the no data value. The overviews are averaged and halve the size per level until the raster fits
+    into one tile, so readers can fetch single tiles of any zoom level.
+
+    :param crs: Coordinate reference system of the values (e.g. of the bands they were calculated from)
+    :param transform: Affine transform of the values
+    :param block_size: Tile width and height in pixels
+    :param compression: GDAL compression (e.g. "DEFLATE")
+    """
+    height, width = values.shape
+    tmp_loc = f"{save_loc}.tmp.tif"
+    try:
+        # The COG driver only copies datasets: write a plain GeoTIFF first, on disk to not double the memory
+        with rasterio.open(tmp_loc, "w", driver="GTiff", height=height, width=width, count=1, dtype="float32",
+                           crs=crs, transform=transform, nodata=np.nan,
+                           tiled=True, blockxsize=block_size, blockysize=block_size) as dataset:
+            dataset.write(values.astype("float32", copy=False), 1)
+
+        copy_dataset(tmp_loc, save_loc, driver="COG",
+                     BLOCKSIZE=block_size,
+                     COMPRESS=compression,
+                     PREDICTOR="FLOATING_POINT",
+                     OVERVIEWS="AUTO",
+                     OVERVIEW_RESAMPLING=OVERVIEW_RESAMPLING,
+                     NUM_THREADS="ALL_CPUS")
+    except Exception as e:
+        logger.error(
+            f"Failed to save COG. save_location='{save_loc}', error='{e}'")
+        return False
+    finally:
+        if os.path.exists(tmp_loc):
+            os.remove(tmp_loc)
+
+    logger.info(
+        f"Successfully saved COG. save_location='{save_loc}', size='{(width, height)}'")
+    return True
+
+
+def convert_to_cog(source_path: str, save_loc: str, block_size: int = RASTER_TILE_SIZE,
+                   compression: str = BAND_COG_COMPRESSION) -> bool:
+    """
+    Converts a band file (e.g. a JPEG 2000 band) into a tiled and compressed Cloud Optimized GeoTIFF.
+
+    The band is streamed by GDAL without loading it into memory. The COG has no overviews, it is read at full
+    resolution by PostGIS as out-db raster.
+
+    :param block_size: Tile width and height in pixels
+    :param compression: GDAL compression (e.g. "DEFLATE")
+    """
+    tmp_loc = f"{save_loc}.tmp.tif"
+    try:
+        # Written next to the final file and renamed, so an interrupted conversion leaves no partial COG
+        copy_dataset(source_path, tmp_loc, driver="COG",
+                     BLOCKSIZE=block_size,
+                     COMPRESS=compression,
+                     PREDICTOR="YES",
+                     OVERVIEWS="NONE",
+                     NUM_THREADS="ALL_CPUS")
+        os.replace(tmp_loc, save_loc)
+    except Exception as e:
+        logger.error(
+            f"Failed to convert band into COG. source_path='{source_path}', save_location='{save_loc}', error='{e}'")
+        if os.path.exists(tmp_loc):
+            os.remove(tmp_loc)
+        return False
+
+    logger.info(
+        f"Successfully converted band into COG. source_path='{source_path}', save_location='{save_loc}'")
+    return True
+
+
+def get_decimated_shape(height: int, width: int, factor: int) -> tuple:
+    """ Returns the height and width of a raster decimated by the factor (partial pixels at the edges are kept)."""
+    return -(-height // factor), -(-width // factor)
+
+
+def read_decimated(dataset, window: Window, factor: int) -> tuple:
+    """
+    Reads a window of the dataset decimated by the factor.
+
+    :param window: Window in the grid of the decimated dataset
+    :return: Pixel values with the shape (bands, height, width) and the affine transform of the window
+    """
+    height, width = int(window.height), int(window.width)
+    source_window = Window(window.col_off * factor, window.row_off * factor, width * factor, height * factor)
+    # Edge windows reach beyond the dataset, the missing pixels are no data
+    boundless = (source_window.col_off + source_window.width > dataset.width or
+                 source_window.row_off + source_window.height > dataset.height)
+    data = dataset.read(window=source_window, out_shape=(dataset.count, height, width),
+                        resampling=BAND_OVERVIEW_RESAMPLING, boundless=boundless,
+                        fill_value=dataset.nodata if dataset.nodata is not None else 0)
+    return data, dataset.window_transform(source_window) * Affine.scale(factor)
+
+
+def write_overview(source_path: str, save_loc: str, factor: int, block_size: int = RASTER_TILE_SIZE,
+                   compression: str = BAND_COG_COMPRESSION) -> bool:
+    """
+    Saves a band decimated by the factor as tiled and compressed GeoTIFF, e.g. as out-db raster of an overview.
+
+    The band is read block by block of the output, so only one block is in memory at once.
+
+    :param block_size: Tile width and height in pixels
+    :param compression: GDAL compression (e.g. "DEFLATE")
+    """
+    tmp_loc = f"{save_loc}.tmp.tif"
+    try:
+        with rasterio.open(source_path) as source:
+            height, width = get_decimated_shape(source.height, source.width, factor)
+            predictor = 3 if np.dtype(source.dtypes[0]).kind == "f" else 2
+            with rasterio.open(tmp_loc, "w", driver="GTiff", height=height, width=width, count=source.count,
+                               dtype=source.dtypes[0], crs=source.crs,
+                               transform=source.transform * Affine.scale(factor), nodata=source.nodata,
+                               tiled=True, blockxsize=block_size, blockysize=block_size,
+                               compress=compression, predictor=predictor) as overview:
+                for _, window in overview.block_windows(1):
+                    data, _ = read_decimated(source, window, factor)
+                    overview.write(data, window=window)
+        os.replace(tmp_loc, save_loc)
+    except Exception as e:
+        logger.error(
+            f"Failed to save overview. source_path='{source_path}', save_location='{save_loc}', factor='{factor}', error='{e}'")
+        if os.path.exists(tmp_loc):
+            os.remove(tmp_loc)
+        return False
+
+    logger.info(
+        f"Successfully saved overview. source_path='{source_path}', save_location='{save_loc}', factor='{factor}'")
+    return True
@@ -0,0 +1,99 @@
+"""
+256-entry RGB lookup tables of the colormaps used for index images.
+
+Generated from matplotlib (`matplotlib.colormaps[name](np.arange(256), bytes=True)`), so images have the same
+colour ramps as before without depending on matplotlib at runtime.
+"""
+
+COLORMAP_LUTS = {
+    "viridis": (
+        "44015444025544035745055845065a45085b46095c460b5e460c5f460e61470f62471163471265471466471567471669"
+        "47186a48196b481a6c481c6e481d6f481e70482071482172482273482374472575472676472777472878472a79472b7a"
+        "472c7b462d7c462f7c46307d46317e45327f45347f453580453681443781443982433a83433b83433c84423d84423e85"
+        "4240854141864142864043874044873f45873f47883e48883e49893d4a893d4b893d4c893c4d8a3c4e8a3b508a3b518a"
+        "3a528b3a538b39548b39558b38568b38578c37588c37598c365a8c365b8c355c8c355d8c345e8d345f8d33608d33618d"
+        "32628d32638d31648d31658d31668d30678d30688d2f698d2f6a8d2e6b8e2e6c8e2e6d8e2d6e8e2d6f8e2c708e2c718e"
+        "2c728e2b738e2b748e2a758e2a768e2a778e29788e29798e287a8e287a8e287b8e277c8e277d8e277e8e267f8e26808e"
+        "26818e25828e25838d24848d24858d24868d23878d23888d23898d22898d228a8d228b8d218c8d218d8c218e8c208f8c"
+        "20908c20918c1f928c1f938b1f948b1f958b1f968b1e978a1e988a1e998a1e998a1e9a891e9b891e9c891e9d881e9e88"
+        "1e9f881ea0871fa1871fa2861fa38620a48520a58521a68521a78422a78423a88323a98224aa8225ab8126ac8127ad80"
+        "28ae7f29af7f2ab07e2bb17d2cb17d2eb27c2fb37b30b47a32b57a33b67935b77836b87738b97639b9763bba753dbb74"
+        "3ebc7340bd7242be7144be7045bf6f47c06e49c16d4bc26c4dc26b4fc36951c46853c56755c66657c66559c7645bc862"
+        "5ec96160c96062ca5f64cb5d67cc5c69cc5b6bcd596dce5870ce5672cf5574d05477d05279d1517cd24f7ed24e81d34c"
+        "83d34b86d44988d5478bd5468dd64490d64392d74195d73f97d83e9ad83c9dd93a9fd938a2da37a5da35a7db33aadb32"
+        "addc30afdc2eb2dd2cb5dd2bb7dd29bade27bdde26bfdf24c2df22c5df21c7e01fcae01ecde01dcfe11cd2e11bd4e11a"
+        "d7e219dae218dce218dfe318e1e318e4e318e7e419e9e419ece41aeee51bf1e51cf3e51ef6e61ff8e621fae622fde724"
+    ),
+    "RdYlGn": (
+        "a50026a60126a80326aa0526ac0726ae0926b00b26b20d26b40f26b61026b81226ba1426bc1626be1826c01a26c21c26"
+        "c41e26c62026c82126ca2326cc2526ce2726d02926d22b26d42d26d62f26d73127d83328d93529da382adc3a2bdd3d2d"
+        "de3f2edf412fe04430e14631e24932e44b33e54d34e65035e75236e85538e95739ea593aec5c3bed5e3cee613def633e"
+        "f0653ff16840f26a41f46d43f46f44f47245f57446f57747f57948f67c4af67e4bf6814cf7834df7864ef7894ff88b51"
+        "f88e52f89053f99354f99555fa9856fa9a58fa9d59fb9f5afba25bfba55cfca75efcaa5ffcac60fdae61fdb063fdb265"
+        "fdb466fdb668fdb86afdba6bfdbc6dfdbe6efdc070fdc272fdc473fdc675fdc877fdca78fdcc7afdce7cfdd07dfdd27f"
+        "fdd481fdd682fdd884fdda86fddc87fdde89fee08bfee18dfee28ffee391fee493fee695fee797fee899fee99bfeea9d"
+        "feec9ffeeda1feeea3feefa5fef1a7fef2a9fef3abfef4adfef5affef7b1fef8b3fef9b5fefab7fefbb9fefdbbfefebd"
+        "fefebdfcfebbfbfdb9f9fcb7f8fcb5f6fbb3f5fab1f3faaff2f9adf0f9abeff8a9edf7a7ecf7a5eaf6a3e9f5a1e7f59f"
+        "e6f49de4f49be3f399e1f297e0f295def193ddf091dbf08fdaef8dd9ef8bd7ee89d5ed88d3ec87d1eb85cfea84cde983"
+        "cbe881c9e880c7e77fc5e67ec3e57cc1e47bbfe37abde278bbe277b9e176b7e075b5df73b3de72b1dd71afdc6faddc6e"
+        "abdb6da9da6ba7d96aa4d869a2d7699fd6699dd5699ad46898d26895d16893d06790cf678ece678bcd6789cc6686cb66"
+        "84ca6681c9667fc7657cc6657ac56577c46475c36472c26470c1646dc0636bbf6368be6366bd6363bb6260ba615db860"
+        "5ab76057b55f54b45e51b25d4eb15d4baf5c48ae5b45ad5a42ab5a3faa593ca85839a75736a55733a45630a2552da154"
+        "2a9f54279e53249d52219b511e9a511b985019974f18954e17934d16914c158f4b148d4a138b49128948118847108646"
+        "0f84450e82440d80430c7e420b7c410a7a4009783f08773e07753d06733c05713b046f3a036d39026b38016937006837"
+    ),
+    "RdYlBu": (
+        "a50026a60126a80326aa0526ac0726ae0926b00b26b20d26b40f26b61026b81226ba1426bc1626be1826c01a26c21c26"
+        "c41e26c62026c82126ca2326cc2526ce2726d02926d22b26d42d26d62f26d73127d83328d93529da382adc3a2bdd3d2d"
+        "de3f2edf412fe04430e14631e24932e44b33e54d34e65035e75236e85538e95739ea593aec5c3bed5e3cee613def633e"
+        "f0653ff16840f26a41f46d43f46f44f47245f57446f57747f57948f67c4af67e4bf6814cf7834df7864ef7894ff88b51"
+        "f88e52f89053f99354f99555fa9856fa9a58fa9d59fb9f5afba25bfba55cfca75efcaa5ffcac60fdae61fdb063fdb265"
+        "fdb467fdb669fdb86bfdba6cfdbc6efdbe70fdc072fdc274fdc476fdc678fdc879fdca7bfdcc7dfdce7ffdd081fdd283"
+        "fdd484fdd686fdd888fdda8afddc8cfdde8efee090fee191fee293fee395fee497fee699fee79bfee89cfee99efeeaa0"
+        "feeca2feeda4feeea6feefa7fef1a9fef2abfef3adfef4affef5b1fef7b3fef8b4fef9b6fefab8fefbbafefdbcfefebe"
+        "fefec0fdfec2fbfdc4fafdc6f9fcc9f8fccbf7fbcdf5fbcff4fbd2f3fad4f2fad6f1f9d8eff9daeef8ddedf8dfecf7e1"
+        "eaf7e3e9f6e6e8f6e8e7f5eae6f5ece4f4efe3f4f1e2f3f3e1f3f5e0f3f7ddf1f7dbf0f6d9eff6d7eef5d5edf5d3ecf4"
+        "d1ebf3cfeaf3cde9f2cbe8f2c9e7f1c7e6f0c4e5f0c2e4efc0e3efbee2eebce1eebae0edb8dfecb6deecb4ddebb2dceb"
+        "b0dbeaaedae9acd9e9a9d8e8a7d6e7a5d4e6a3d2e5a1d1e49fcfe39ccde29acce198cae196c8e094c6df92c5de90c3dd"
+        "8dc1dc8bbfdb89beda87bcd985bad883b9d780b7d67eb5d57cb3d47ab2d378b0d276aed174add172aacf70a8ce6ea6cd"
+        "6ca4cc6aa2cb689fca679dc9659bc76399c66197c55f94c45d92c35c90c25a8ec1588cbf5689be5487bd5285bc5083bb"
+        "4f81ba4d7eb94b7cb7497ab64778b54576b44473b34371b2436eb0426caf4169ae4067ad3f64ac3f62aa3e60a93d5da8"
+        "3c5ba73b58a63b56a43a53a33951a2384ea1384c9f37499e36479d35449c34429b343f99333d98323a97313896313695"
+    ),
+    "Blues": (
+        "f7fbfff6fafef5f9fef4f9fef3f8fdf3f8fdf2f7fdf1f7fdf0f6fceff6fceff5fceef5fcedf4fbecf4fbecf3fbebf3fb"
+        "eaf2fae9f2fae8f1fae8f1fae7f0f9e6f0f9e5eff9e4eff9e4eef8e3eef8e2edf8e1edf8e1ecf7e0ecf7dfebf7deebf7"
+        "ddeaf6ddeaf6dce9f6dbe9f6dae8f5dae8f5d9e7f5d8e7f5d7e6f4d7e6f4d6e5f4d5e5f4d4e4f3d4e4f3d3e3f3d2e3f3"
+        "d1e2f2d1e2f2d0e1f2cfe1f2cee0f1cee0f1cddff1ccdff1cbdef0cbdef0caddf0c9ddf0c8dcefc8dcefc7dbefc6dbef"
+        "c5daeec4daeec3d9eec1d9edc0d8edbfd8ecbed7ecbcd7ebbbd6ebbad6eab9d5eab7d4eab6d4e9b5d3e9b4d3e8b2d2e8"
+        "b1d2e7b0d1e7afd1e6add0e6acd0e6abcfe5aacfe5a8cee4a7cee4a6cde3a5cde3a3cce3a2cbe2a1cbe2a0cae19ecae1"
+        "9dc9e09bc8e09ac7e098c7df97c6df95c5df93c4de92c3de90c2de8fc1dd8dc0dd8bc0dd8abfdc88bedc87bddc85bcdb"
+        "83bbdb82badb80b9da7fb8da7db8d97bb7d97ab6d978b5d877b4d875b3d873b2d772b1d770b1d76fb0d66dafd66baed6"
+        "6aadd569acd567abd466aad465aad363a9d362a8d261a7d260a6d15ea5d15da4d05ca3d05aa3cf59a2cf58a1ce57a0ce"
+        "559fcd549ecd539dcc519ccc509bcb4f9bcb4e9aca4c99ca4b98c94a97c94896c84795c84694c74594c74393c64292c6"
+        "4191c54090c53f8fc43e8ec43d8dc33c8cc33b8bc23a8ac13989c13888c03787c03585bf3484bf3383be3282be3181bd"
+        "3080bd2f7fbc2e7ebc2d7dbb2c7cbb2b7bba2a7ab92979b92878b82777b82676b72575b72474b62373b62272b52171b5"
+        "2070b41f6fb31e6eb21e6db21d6cb11c6bb01b6aaf1a69ae1a68ae1967ad1866ac1765ab1764ab1663aa1562a91461a8"
+        "1360a7135fa7125ea6115da5105ca40f5ba30f5aa30e59a20d58a10c57a00c56a00b559f0a549e09539d08529c08519c"
+        "08509a084f99084e97084c96084b94084a9208499108488f08478e08468c08458b084489084388084286084185084083"
+        "083f82083e80083d7e083c7d083b7b083a7a08397808387708377508367408357208347108336f08326e08316c08306b"
+    ),
+    "winter": (
+        "0000ff0001fe0002fe0003fd0004fd0005fc0006fc0007fb0008fb0009fa000afa000bf9000cf9000df8000ef8000ff7"
+        "0010f70011f60012f60013f50014f50015f40016f40017f30018f30019f2001af2001bf1001cf1001df0001ef0001fef"
+        "0020ef0020ee0022ee0023ed0024ed0024ec0026ec0027eb0028eb0028ea002aea002be9002ce9002ce8002ee8002fe7"
+        "0030e70030e60032e60033e50034e50034e40036e40037e30038e30038e2003ae2003be1003ce1003ce0003ee0003fdf"
+        "0040df0041de0041de0043dd0044dd0045dc0046dc0047db0048db0049da0049da004bd9004cd9004dd8004ed8004fd7"
+        "0050d70051d60051d60053d50054d50055d40056d30057d30058d30059d20059d2005bd1005cd1005dd0005ed0005fcf"
+        "0060cf0061ce0061ce0063cd0064cd0065cc0066cc0067cb0068cb0069ca0069ca006bc9006cc9006dc8006ec8006fc7"
+        "0070c70071c60071c60073c50074c50075c40076c30077c30078c30079c20079c2007bc1007cc1007dc0007ec0007fbf"
+        "0080bf0081be0082be0083bd0083bd0085bc0086bc0087bb0088bb0089ba008aba008bb9008cb9008db8008eb8008fb7"
+        "0090b70091b60092b60093b50093b50095b40096b30097b30098b30099b2009ab2009bb1009cb1009db0009eb0009faf"
+        "00a0af00a1ae00a2ae00a3ad00a3ad00a5ac00a6ac00a7ab00a8ab00a9aa00aaaa00aba900aca900ada800aea800afa7"
+        "00b0a700b1a600b2a600b3a500b3a500b5a400b6a300b7a300b8a300b9a200baa200bba100bca100bda000bea000bf9f"
+        "00c09f00c19e00c29e00c39d00c39d00c59c00c69c00c79b00c89b00c99a00ca9a00cb9900cc9900cd9800ce9800cf97"
+        "00d09700d19600d29600d39500d39500d59400d69300d79300d89300d99200da9200db9100dc9100dd9000de9000df8f"
+        "00e08f00e18e00e28e00e38d00e38d00e58c00e68c00e78b00e88b00e98a00ea8a00eb8900ec8900ed8800ee8800ef87"
+        "00f08700f18600f28600f38500f38500f58400f68300f78300f88300f98200fa8200fb8100fc8100fd8000fe8000ff7f"
+    ),
+}
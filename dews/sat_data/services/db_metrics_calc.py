@@ -0,0 +1,195 @@
+import hashlib
+import logging
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection, transaction
+
+from sat_data.services.band_math import BandExpression
+from sat_data.services.band_raster import get_overview_factor, get_table_name as get_band_table_name
+from sat_data.services.metrics_calc import SPECTRAL_INDICES, SpectralIndex
+from sat_data.models import SatData
+
+
+logger = logging.getLogger("django")
+
+# Key of the index tables in `SatData.band_tables`, so they are dropped with the band tables
+INDEX_TABLES_KEY = "index"
+
+
+class DbMetricsCalculator:
+    """
+    Calculates spectral indices inside PostGIS with `ST_MapAlgebra` over the imported band tiles.
+
+    Every tile of the highest resolution band is combined with the matching tiles of the other bands and written
+    into an index table (`rid`, `rast` 32BF). Bands of the same resolution share the tile grid and are joined
+    by their tile extent (spatial index), bands of a lower resolution are resampled onto the tile.
+    With an area of interest (AOI) only the intersecting tiles are read and they are clipped to the AOI.
+    With a scale the bands are read from their coarsest overview tables not exceeding the scale.
+
+    The statement is a single `CREATE TABLE AS`, which PostgreSQL may run with parallel workers.
+    """
+    sat_data: SatData = None
+    metrics_to_calc: list = []
+    aoi: GEOSGeometry = None
+    resolution: int = None
+    scale: float = 0
+
+    def __init__(self, sat_data: SatData, metrics_to_calc: list, aoi: GEOSGeometry = None, resolution: int = None,
+                 scale: float = 0) -> None:
+        """
+        :param sat_data: SatData instance with imported band tables
+        :param metrics_to_calc: Spectral indices to calculate (e.g. ["ndvi", "smi"]), see `SPECTRAL_INDICES`
+        :param aoi: Optional area of interest, needs a SRID
+        :param resolution: Resolution of the bands in meters, see `SatData.get_bands`
+        :param scale: Meters per pixel of the index (e.g. of a zoomed-out map); 0 for the bands' full resolution
+        """
+        self.sat_data = sat_data
+        self.metrics_to_calc = metrics_to_calc
+        self.aoi = aoi
+        self.resolution = resolution
+        self.scale = scale
+
+    def start(self) -> dict:
+        """
+        Start the calculation of the desired metrics.
+
+        :return: Index table name by metric; empty string if the metric failed
+        """
+        results = {}
+        for metric in dict.fromkeys(self.metrics_to_calc):
+            if metric not in SPECTRAL_INDICES:
+                logger.error(
+                    f"Metric is not supported by the database engine. metric='{metric}', sat_data.id='{self.sat_data.id}'")
+                results[metric] = ""
+                continue
+            results[metric] = self.calculate_index(SPECTRAL_INDICES[metric])
+
+        # Index tables are dropped with the band tables
+        self.sat_data.save(update_fields=["band_tables"])
+        logger.info(
+            f"Finished calculating metrics in database. results='{results}', sat_data.id='{self.sat_data.id}'")
+        return results
+
+    def get_band_tables(self, bands: list) -> list:
+        """
+        Returns (band, range, table name, pixel size) of the bands in the same order; None if a band is missing.
+
+        The table is the band raster table or the overview table of the scale, the pixel size in meters is the
+        band's range multiplied by the overview factor.
+        """
+        band_objs = self.sat_data.get_bands(*bands, resolution=self.resolution) or {}
+        if any(band not in band_objs for band in bands):
+            return None
+        tables = []
+        for band in bands:
+            band_range = band_objs[band].range
+            factor = get_overview_factor(band_range, self.scale)
+            tables.append((band, band_range, get_band_table_name(factor), band_range * factor))
+        return tables
+
+    def get_table_name(self, idx_type: str) -> str:
+        table_name = f"{self.sat_data.id}_{idx_type}"
+        if self.scale:
+            table_name = f"{table_name}_s{self.scale:g}"
+        if self.aoi is not None:
+            # Several AOIs of the same product are kept apart
+            table_name = f"{table_name}_aoi_{hashlib.md5(self.aoi.ewkt.encode()).hexdigest()[:8]}"
+        return table_name.lower()
+
+    def calculate_index(self, spectral_index: SpectralIndex) -> str:
+        """
+        Calculates the index into its table.
+
+        :return: Table name; empty string on failure
+        """
+        idx_type = spectral_index.idx_type
+        expression = BandExpression(spectral_index.formula)
+        tables = self.get_band_tables(expression.bands)
+        if tables is None:
+            logger.error(
+                f"Missing bands for index. idx_type='{idx_type}', bands='{expression.bands}', sat_data.id='{self.sat_data.id}'")
+            return ""
+
+        # Highest resolution band is the reference, its tiles are the output tiles
+        reference = min(range(len(tables)), key=lambda i: tables[i][3] or float("inf"))
+        table_name = self.get_table_name(idx_type)
+        callback = f"dews_index_{idx_type}"
+        band_values = [f"value[{i + 1}][1][1]" for i in range(len(tables))]
+
+        # Only the partition of the SatData object is scanned
+        band_filter = "{alias}.sat_data_id = %s AND {alias}.band = %s AND {alias}.range = %s"
+
+        # Tiles of the other bands
+        joins = []
+        join_params = []
+        for i, (band, band_range, band_table, pixel_size) in enumerate(tables):
+            if i == reference:
+                continue
+            if pixel_size == tables[reference][3]:
+                # Same tile grid
+                joins.append(
+                    f'JOIN {band_table} b{i} ON {band_filter.format(alias=f"b{i}")} '
+                    f'AND ST_ConvexHull(b{i}.rast) ~= ST_ConvexHull(ref.rast)')
+            else:
+                # Intersecting tiles resampled onto the reference tile
+                joins.append(
+                    f'CROSS JOIN LATERAL (SELECT ST_Resample(ST_Union(t.rast), ref.rast) AS rast FROM {band_table} t '
+                    f'WHERE {band_filter.format(alias="t")} '
+                    f'AND ST_Intersects(ST_ConvexHull(t.rast), ST_ConvexHull(ref.rast))) b{i}')
+            join_params += [str(self.sat_data.id), band, band_range]
+        rastbandargs = ", ".join(
+            "ROW(ref.clipped, 1)" if i == reference else f"ROW(b{i}.rast, 1)" for i in range(len(tables)))
+
+        clipped = "ref.rast"
+        where = f"WHERE {band_filter.format(alias='ref')}"
+        ref_params = [str(self.sat_data.id), tables[reference][0], tables[reference][1]]
+        params = ref_params
+        if self.aoi is not None:
+            # AOI in the raster's SRID, only intersecting tiles are read
+            # The joins match the unclipped tiles, the map algebra uses the extent of the clipped one
+            aoi = "ST_Transform(ST_GeomFromEWKT(%s), ST_SRID(ref.rast))"
+            clipped = f"ST_Clip(ref.rast, {aoi}, true)"
+            where = f"{where} AND ST_Intersects(ST_ConvexHull(ref.rast), {aoi})"
+            params = [self.aoi.ewkt] + ref_params + [self.aoi.ewkt]
+        params = params + join_params
+
+        sql = f'''
+            CREATE TABLE "{table_name}" AS
+            SELECT ref.rid, ST_MapAlgebra(
+                ARRAY[{rastbandargs}]::rastbandarg[],
+                '{callback}(double precision[], integer[], text[])'::regprocedure,
+                '32BF', 'FIRST'
+            ) AS rast
+            FROM (SELECT rid, rast, {clipped} AS clipped FROM {tables[reference][2]} ref {where}) ref
+            {" ".join(joins)};
+        '''
+        logger.debug(f"Index SQL. idx_type='{idx_type}', sql='{sql}'")
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Pixel callback of the formula, NULL (no data) for divisions by zero
+                cursor.execute(f'''
+                    CREATE OR REPLACE FUNCTION {callback}(value double precision[][][], pos integer[][], VARIADIC userargs text[])
+                    RETURNS double precision AS $$ SELECT {expression.to_sql(band_values)} $$
+                    LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+                ''')
+                cursor.execute(f'DROP TABLE IF EXISTS "{table_name}";')
+                cursor.execute(sql, params)
+                cursor.execute(f'ALTER TABLE "{table_name}" ADD PRIMARY KEY (rid);')
+                cursor.execute(f'CREATE INDEX ON "{table_name}" USING gist (ST_ConvexHull(rast));')
+                cursor.execute(f'ANALYZE "{table_name}";')
+                cursor.execute(
+                    "SELECT AddRasterConstraints('public'::name, %s::name, 'rast'::name);", (table_name,))
+        except Exception as e:
+            logger.error(
+                f"Failed to calculate index in database. idx_type='{idx_type}', table_name='{table_name}', error='{e}', sat_data.id='{self.sat_data.id}'")
+            return ""
+
+        if self.sat_data.band_tables is None:
+            self.sat_data.band_tables = {}
+        index_tables = self.sat_data.band_tables.setdefault(INDEX_TABLES_KEY, [])
+        if table_name not in index_tables:
+            index_tables.append(table_name)
+        logger.info(
+            f"Calculated index in database. idx_type='{idx_type}', table_name='{table_name}', aoi='{self.aoi is not None}', scale='{self.scale}', sat_data.id='{self.sat_data.id}'")
+        return table_name
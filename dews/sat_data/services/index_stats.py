@@ -0,0 +1,106 @@
+import logging
+
+import numpy as np
+
+from dews.settings import INDEX_HISTOGRAM_BINS, INDEX_STATS_PERCENTILES
+
+
+logger = logging.getLogger("django")
+
+
+class StatsAccumulator:
+    """
+    Collects statistics of index values window by window, so they are computed in the pass calculating the index.
+
+    Count, mean and standard deviation are exact (windows are merged with Chan's parallel algorithm in float64),
+    percentiles are interpolated from the fixed-bin histogram. NaN values are ignored.
+    """
+    hist_min: float = -1.0
+    hist_max: float = 1.0
+    bins: int = INDEX_HISTOGRAM_BINS
+
+    def __init__(self, hist_min: float = -1.0, hist_max: float = 1.0, bins: int = INDEX_HISTOGRAM_BINS) -> None:
+        """
+        :param hist_min: Lower edge of the first histogram bin
+        :param hist_max: Upper edge of the last histogram bin, values outside are counted in the first or last bin
+        :param bins: Number of equal width histogram bins
+        """
+        self.hist_min = hist_min
+        self.hist_max = hist_max
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype="int64")
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+        self.min = np.inf
+        self.max = -np.inf
+        self.buffer = np.empty(0, dtype="float32")
+
+    def update(self, values: np.ndarray):
+        """ Adds the values of a window. Matches `on_window` of `BlockProcessor.run`."""
+        valid = values[~np.isnan(values)]
+        count = valid.size
+        if count == 0:
+            return
+
+        # float32 temporaries, float64 sums
+        mean = valid.mean(dtype="float64")
+        diff = self.get_buffer(count)
+        np.subtract(valid, np.float32(mean), out=diff)
+        np.square(diff, out=diff)
+        m2 = diff.sum(dtype="float64")
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, float(valid.min()))
+        self.max = max(self.max, float(valid.max()))
+
+        # Bin indexes like np.histogram, but outliers are clipped instead of dropped
+        bin_idx = diff
+        np.subtract(valid, np.float32(self.hist_min), out=bin_idx)
+        np.multiply(bin_idx, np.float32(self.bins / (self.hist_max - self.hist_min)), out=bin_idx)
+        np.clip(bin_idx, 0, self.bins - 1, out=bin_idx)
+        self.counts += np.bincount(bin_idx.astype(np.intp), minlength=self.bins)
+
+    def get_buffer(self, size: int) -> np.ndarray:
+        """ Returns a float32 buffer of the size, reused by the windows."""
+        if self.buffer.size < size:
+            self.buffer = np.empty(size, dtype="float32")
+        return self.buffer[:size]
+
+    def percentile(self, q: float):
+        """ Returns the q-th percentile (0 to 100) interpolated linearly within its histogram bin; None without values."""
+        if self.count == 0:
+            return None
+        target = q / 100 * self.count
+        cumulative = np.cumsum(self.counts)
+        i = min(int(np.searchsorted(cumulative, target)), self.bins - 1)
+        before = cumulative[i - 1] if i > 0 else 0
+        fraction = (target - before) / self.counts[i] if self.counts[i] else 0.0
+        bin_width = (self.hist_max - self.hist_min) / self.bins
+        lower = self.hist_min + i * bin_width
+        upper = lower + bin_width
+        # Outliers are counted in the edge bins, which therefore reach to the exact extremes
+        if i == 0:
+            lower = min(lower, self.min)
+        if i == self.bins - 1:
+            upper = max(upper, self.max)
+        value = lower + fraction * (upper - lower)
+        return float(min(max(value, self.min), self.max))
+
+    def result(self, percentiles: list = INDEX_STATS_PERCENTILES) -> dict:
+        """ Returns the statistics as keyword arguments of `IndexStats`."""
+        valid = self.count > 0
+        return {
+            "valid_count": self.count,
+            "mean": float(self.mean) if valid else None,
+            "std": float(np.sqrt(self.m2 / self.count)) if valid else None,
+            "min": float(self.min) if valid else None,
+            "max": float(self.max) if valid else None,
+            "percentiles": {str(q): self.percentile(q) for q in percentiles} if valid else {},
+            "hist_min": self.hist_min,
+            "hist_max": self.hist_max,
+            "hist_counts": self.counts.tolist(),
+        }
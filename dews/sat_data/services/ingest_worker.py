@@ -0,0 +1,223 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.db import IntegrityError, connection
+
+from sat_data.enums.sat_mission import SatMission
+from sat_data.enums.status import Status
+from sat_data.models import IngestJob, SatData, remove_media_root
+from sat_data.services.attr_adder import AttrAdder
+from sat_data.services.job_queue import ArchiveLockedError, JobQueue
+from sat_data.services.metrics_runner import calculate_metrics
+from sat_data.services.path_finder import PathFinder
+from sat_data.services.utils.file_utils import FileUtils
+from dews.settings import MEDIA_ROOT, ARCHIVE_EXTRACTION_MODE, INGEST_JOB_HEARTBEAT_INTERVAL, INGEST_JOB_REQUEUE_INTERVAL, \
+    INGEST_WORKER_POLL_INTERVAL
+
+
+logger = logging.getLogger("django")
+
+
+class IngestWorker:
+    """
+    Claims ingest jobs from the `JobQueue` and runs extraction, attribute adding and metrics calculation.
+
+    Started as separate processes by `python manage.py runworker`.
+    """
+    name: str = ""
+    stopped = False
+
+    def __init__(self, name: str = "") -> None:
+        if not name:
+            name = f"{socket.gethostname()}-{os.getpid()}"
+        self.name = name
+        self.stopped = False
+        logger.debug(f"IngestWorker object created. worker='{self.name}'")
+
+    def run(self, once: bool = False):
+        """
+        Processes jobs until stopped.
+
+        :param once: Stop as soon as the queue is empty
+        """
+        logger.info(f"Starting ingest worker. worker='{self.name}'")
+        JobQueue.requeue_stale()
+        last_requeue = time.monotonic()
+        while not self.stopped:
+            job = JobQueue.claim(self.name)
+            if job is None:
+                if once:
+                    break
+                # Jobs of killed workers only become stale some time after a restart
+                if time.monotonic() - last_requeue >= INGEST_JOB_REQUEUE_INTERVAL:
+                    JobQueue.requeue_stale()
+                    last_requeue = time.monotonic()
+                time.sleep(INGEST_WORKER_POLL_INTERVAL)
+                continue
+
+            self.process(job)
+
+        logger.info(f"Stopped ingest worker. worker='{self.name}'")
+
+    def stop(self):
+        self.stopped = True
+
+    def process(self, job: IngestJob):
+        """ Runs a claimed job and reports the outcome to the queue."""
+        heartbeat_stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self.__send_heartbeats, args=(job, heartbeat_stop), daemon=True)
+        heartbeat.start()
+        try:
+            if job.archive_path:
+                sat_data = self.ingest(
+                    user=job.user,
+                    archive_path=job.archive_path,
+                    archive_hash=job.archive_hash,
+                    mission=job.mission,
+                    metrics_to_calc=job.metrics_to_calc,
+                )
+            else:
+                # Objects created without archive (e.g. Sentinel Hub requests) only need their metrics
+                sat_data = self.finish(job.sat_data, job.metrics_to_calc)
+            JobQueue.complete(job, sat_data)
+        except ArchiveLockedError as e:
+            # Retried after the other ingestion, which finds the ingested SatData object then
+            JobQueue.postpone(job, e)
+        except Exception as e:
+            logger.error(
+                f"Failed ingest job. job.id='{job.id}', archive_path='{job.archive_path}', worker='{self.name}', error='{e}'")
+            JobQueue.fail(job, e)
+        finally:
+            heartbeat_stop.set()
+            heartbeat.join()
+
+    def __send_heartbeats(self, job: IngestJob, stop_event: threading.Event):
+        try:
+            while not stop_event.wait(INGEST_JOB_HEARTBEAT_INTERVAL):
+                JobQueue.heartbeat(job)
+        finally:
+            # Heartbeat thread owns its own database connection
+            connection.close()
+
+    @staticmethod
+    def ingest(user, archive_path: str, mission: str = "", metrics_to_calc: list = None, archive_hash: str = "") -> SatData:
+        """
+        Extracts the archive, creates the SatData object and calculates the metrics (see `finish`).
+
+        Identical archives are ingested once: if a SatData object with the same archive hash exists, it is returned.
+        If its ingestion was interrupted, it is resumed from the first incomplete stage. An archive is ingested by
+        one process at a time, `ArchiveLockedError` is raised if another process ingests it right now.
+
+        :return: Created or existing SatData object; raises an exception on failure
+        """
+        archive_path = str(archive_path)
+        if not mission:
+            mission = SatMission.get_mission_by_filename(archive_path)
+
+        # Check for an identical archive
+        if not archive_hash:
+            logger.debug(f"Hashing archive. archive_path='{archive_path}'")
+            archive_hash = FileUtils.hash_file(archive_path)
+        with JobQueue.ingestion_lock(archive_hash):
+            return IngestWorker.__ingest(user, archive_path, mission, metrics_to_calc, archive_hash)
+
+    @staticmethod
+    def __ingest(user, archive_path: str, mission: str, metrics_to_calc: list, archive_hash: str) -> SatData:
+        """ Runs the ingestion, the caller holds the archive's ingestion lock."""
+        sat_data = SatData.objects.filter(archive_hash=archive_hash).first()
+        if sat_data is not None and sat_data.processing_done:
+            logger.info(
+                f"Archive was already ingested. archive_path='{archive_path}', archive_hash='{archive_hash}', sat_data.id='{sat_data.id}'")
+            return sat_data
+        elif sat_data is not None:
+            logger.info(
+                f"Resuming interrupted ingestion. archive_path='{archive_path}', sat_data.id='{sat_data.id}', ingest_stages='{sat_data.ingest_stages}'")
+        else:
+            # Create SatData object
+            logger.info(
+                f"Creating SatData object. username='{user.username}', archive_path='{archive_path}'")
+            sat_data = SatData(id=uuid.uuid4(), user=user, archive_hash=archive_hash)
+            sat_data.archive = remove_media_root(archive_path)
+            try:
+                sat_data.save()
+            except IntegrityError:
+                # Created by a process which does not hold the lock
+                raise ArchiveLockedError(
+                    f"SatData object of the archive was created by another process. archive_hash='{archive_hash}'")
+            logger.debug(f"Created SatData object. id='{sat_data.id}'")
+
+        # Extract archive
+        extracted_path = FileUtils.generate_path(MEDIA_ROOT, sat_data.extracted_path)
+        if sat_data.is_stage_done("extract") and os.path.isdir(extracted_path):
+            logger.info(
+                f"Skipping extraction, archive is already extracted. sat_data.id='{sat_data.id}', extracted_path='{extracted_path}'")
+        else:
+            logger.info(f"Extracting archive. archive_path='{archive_path}'")
+            patterns = None
+            if ARCHIVE_EXTRACTION_MODE == "selective":
+                patterns = PathFinder.get_extraction_patterns(mission)
+            extracted_path = FileUtils.extract_archive(archive_path, mission, patterns)
+            logger.debug(f"Extracted path='{extracted_path}'")
+            if extracted_path is None or extracted_path == "":
+                error = f"Extracting archive failed. archive_path='{archive_path}', extracted_path='{extracted_path}'"
+                sat_data.set_stage_status("extract", Status.FAILED.value, error)
+                raise Exception(error)
+            sat_data.extracted_path = remove_media_root(extracted_path)
+            logger.debug(f"Added extracted path. sat_data.id='{sat_data.id}'")
+            sat_data.set_stage_status("extract", Status.DONE.value)
+
+        # Add attributes (like mission, product type, band img paths, ...)
+        logger.debug(
+            f"Calling AttrAdder. sat_data.id='{sat_data.id}', extracted_path='{extracted_path}', mission='{mission}'")
+        attr_adder = AttrAdder(
+            sat_data=sat_data,
+            extracted_path=extracted_path,
+            mission=mission)
+        attr_adder.start()
+        logger.info(
+            f"Created SatData with several attributes. id='{sat_data.id}', extracted_path='{extracted_path}'")
+
+        return IngestWorker.finish(sat_data, metrics_to_calc)
+
+    @staticmethod
+    def finish(sat_data: SatData, metrics_to_calc: list = None) -> SatData:
+        """
+        Runs the "metrics" ingest stage and marks the SatData object as processed.
+
+        The object counts as ingested only after its metrics were calculated, a failed calculation fails the job,
+        so it is retried.
+
+        :return: Processed SatData object; raises an exception on failure
+        """
+        if sat_data is None:
+            raise Exception("SatData object does not exist anymore.")
+
+        # Calculate metrics
+        if sat_data.is_stage_done("metrics"):
+            logger.info(
+                f"Skipping metrics calculation, metrics are already calculated. sat_data.id='{sat_data.id}'")
+        elif metrics_to_calc:
+            logger.debug(
+                f"Calling MetricsCalculator. sat_data.id='{sat_data.id}', mission='{sat_data.mission}', product_type='{sat_data.product_type}'")
+            try:
+                calculate_metrics(sat_data, metrics_to_calc)
+            except Exception as e:
+                sat_data.set_stage_status("metrics", Status.FAILED.value, e)
+                raise
+            sat_data.set_stage_status("metrics", Status.DONE.value, save=False)
+            logger.info(
+                f"Calculated metrics. metrics_to_calc='{metrics_to_calc}', sat_data.id='{sat_data.id}'")
+        else:
+            logger.info(
+                f"No metrics to calculate. sat_data.id='{sat_data.id}'")
+
+        sat_data.processing_done = True
+        sat_data.save()
+        logger.debug(
+            f"Set processing status to '{sat_data.processing_done}'. sat_data.id='{sat_data.id}'")
+        return sat_data
@@ -0,0 +1,226 @@
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from sat_data.enums.sat_mission import SatMission
+from sat_data.enums.status import Status
+from sat_data.models import IngestJob, SatData
+from dews.settings import DEFAULT_METRICS_TO_CALC, INGEST_JOB_RETRY_DELAY, INGEST_JOB_STALE_TIMEOUT
+
+
+logger = logging.getLogger("django")
+
+# Namespaces of the advisory locks keyed on an archive hash (first key of `pg_advisory_lock(int, int)`)
+INGEST_LOCK = 1
+ENQUEUE_LOCK = 2
+
+
+class ArchiveLockedError(Exception):
+    """ Raised if the archive is ingested by another process right now."""
+
+
+def get_lock_key(archive_hash: str) -> int:
+    """ Returns the advisory lock key (signed 32 bit integer) of the archive hash."""
+    return int(archive_hash[:8], 16) - 2 ** 31
+
+
+class JobQueue:
+    """
+    Database backed queue of archive ingestions.
+
+    The web tier only enqueues jobs. Ingest workers claim them with `SELECT ... FOR UPDATE SKIP LOCKED`,
+    so several worker processes can poll the same table without handing out a job twice.
+    """
+
+    @staticmethod
+    def enqueue(user, archive_path, mission: str = "", metrics_to_calc: list = None, archive_hash: str = "") -> IngestJob:
+        """
+        Creates a queued ingest job for an archive on the file system.
+
+        :param user: User who owns the resulting SatData object
+        :param archive_path: Path of the archive on the file system
+        :param mission: Satellite mission, identified by the archive's file name if empty
+        :param metrics_to_calc: Metrics to calculate after ingestion (e.g. ["ndvi", "rgb"])
+        :param archive_hash: SHA-256 of the archive; computed by the worker if empty
+        :return: Queued IngestJob object
+        """
+        if not mission:
+            mission = SatMission.get_mission_by_filename(archive_path)
+        if metrics_to_calc is None:
+            metrics_to_calc = DEFAULT_METRICS_TO_CALC
+
+        job = IngestJob.objects.create(
+            user=user,
+            archive_path=str(archive_path),
+            archive_hash=archive_hash,
+            mission=mission,
+            metrics_to_calc=list(metrics_to_calc),
+        )
+        logger.info(
+            f"Enqueued ingest job. job.id='{job.id}', archive_path='{archive_path}', mission='{mission}', user='{user}'")
+        return job
+
+    @staticmethod
+    def enqueue_metrics(sat_data: SatData, metrics_to_calc: list = None) -> IngestJob:
+        """
+        Creates a queued job calculating the metrics of a SatData object which was created without archive
+        (e.g. by a Sentinel Hub request).
+
+        :return: Queued IngestJob object
+        """
+        if metrics_to_calc is None:
+            metrics_to_calc = DEFAULT_METRICS_TO_CALC
+
+        job = IngestJob.objects.create(
+            user=sat_data.user,
+            archive_path="",
+            mission=sat_data.mission,
+            metrics_to_calc=list(metrics_to_calc),
+            sat_data=sat_data,
+        )
+        logger.info(
+            f"Enqueued metrics job. job.id='{job.id}', sat_data.id='{sat_data.id}', metrics_to_calc='{metrics_to_calc}'")
+        return job
+
+    @staticmethod
+    def lock_archive(archive_hash: str):
+        """
+        Locks the archive hash until the end of the current transaction, so the duplicate check (see
+        `find_duplicate`) and the enqueueing of identical archives do not interleave.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, %s);", (ENQUEUE_LOCK, get_lock_key(archive_hash)))
+
+    @staticmethod
+    def find_duplicate(archive_hash: str) -> tuple:
+        """
+        Looks up an identical archive which was already ingested or is about to be.
+
+        Interrupted ingestions without pending job do not count, a new job resumes them.
+
+        :return: Tuple of the existing SatData object and the pending IngestJob object (both may be None)
+        """
+        sat_data = SatData.objects.filter(archive_hash=archive_hash, processing_done=True).first()
+        if sat_data is not None:
+            return sat_data, None
+        job = IngestJob.objects.filter(
+            archive_hash=archive_hash,
+            status__in=[Status.QUEUED.value, Status.IN_PROGRESS.value],
+        ).first()
+        return None, job
+
+    @staticmethod
+    def claim(worker: str) -> IngestJob | None:
+        """
+        Claims the oldest queued job which is due and marks it as in progress.
+
+        :param worker: Name of the claiming worker
+        :return: Claimed IngestJob object; None if the queue is empty
+        """
+        with transaction.atomic():
+            job = IngestJob.objects.select_for_update(skip_locked=True) \
+                .filter(status=Status.QUEUED.value, run_after__lte=timezone.now()) \
+                .order_by("creation_time") \
+                .first()
+            if job is None:
+                return None
+
+            job.status = Status.IN_PROGRESS.value
+            job.attempts += 1
+            job.worker = worker
+            job.start_time = timezone.now()
+            job.save()
+
+        logger.info(
+            f"Claimed ingest job. job.id='{job.id}', worker='{worker}', attempt='{job.attempts}/{job.max_attempts}'")
+        return job
+
+    @staticmethod
+    def heartbeat(job: IngestJob):
+        """ Signals that the job's worker is still alive."""
+        IngestJob.objects.filter(id=job.id).update(update_time=timezone.now())
+
+    @staticmethod
+    def complete(job: IngestJob, sat_data=None):
+        """ Marks the job as done and links the created SatData object."""
+        job.status = Status.DONE.value
+        job.sat_data = sat_data
+        job.error = ""
+        job.finish_time = timezone.now()
+        job.save()
+        logger.info(
+            f"Ingest job done. job.id='{job.id}', sat_data.id='{sat_data.id if sat_data else None}'")
+
+    @staticmethod
+    def fail(job: IngestJob, error: str):
+        """ Requeues the job with a delay or marks it as failed when no attempts are left."""
+        job.error = str(error)
+        if job.attempts < job.max_attempts:
+            job.status = Status.QUEUED.value
+            job.run_after = timezone.now() + \
+                timedelta(seconds=INGEST_JOB_RETRY_DELAY * job.attempts)
+            logger.warning(
+                f"Ingest job failed, will be retried. job.id='{job.id}', attempt='{job.attempts}/{job.max_attempts}', run_after='{job.run_after}', error='{error}'")
+        else:
+            job.status = Status.FAILED.value
+            job.finish_time = timezone.now()
+            logger.error(
+                f"Ingest job failed, no attempts left. job.id='{job.id}', attempts='{job.attempts}', error='{error}'")
+        job.save()
+
+    @staticmethod
+    def postpone(job: IngestJob, reason: str):
+        """ Requeues the job with a delay without counting the attempt (e.g. its archive is ingested by another job)."""
+        job.status = Status.QUEUED.value
+        job.attempts = max(0, job.attempts - 1)
+        job.error = str(reason)
+        job.run_after = timezone.now() + timedelta(seconds=INGEST_JOB_RETRY_DELAY)
+        job.save()
+        logger.info(
+            f"Postponed ingest job. job.id='{job.id}', run_after='{job.run_after}', reason='{reason}'")
+
+    @staticmethod
+    @contextmanager
+    def ingestion_lock(archive_hash: str):
+        """
+        Holds a session level advisory lock on the archive hash during the ingestion, so an archive is ingested by
+        one process at a time (workers and `importdata` alike). The lock is released if the process dies.
+
+        Raises `ArchiveLockedError` if another process holds the lock.
+        """
+        key = get_lock_key(archive_hash)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s);", (INGEST_LOCK, key))
+            locked = cursor.fetchone()[0]
+        if not locked:
+            raise ArchiveLockedError(
+                f"Archive is ingested by another process. archive_hash='{archive_hash}'")
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s);", (INGEST_LOCK, key))
+
+    @staticmethod
+    def requeue_stale(timeout: int = INGEST_JOB_STALE_TIMEOUT) -> int:
+        """
+        Hands jobs of crashed or killed workers back to the queue.
+
+        :param timeout: Seconds without heartbeat until a running job counts as stale
+        :return: Number of requeued jobs
+        """
+        count = 0
+        deadline = timezone.now() - timedelta(seconds=timeout)
+        with transaction.atomic():
+            stale_jobs = IngestJob.objects.select_for_update(skip_locked=True) \
+                .filter(status=Status.IN_PROGRESS.value, update_time__lt=deadline)
+            for job in stale_jobs:
+                JobQueue.fail(job, f"Worker '{job.worker}' stopped sending heartbeats.")
+                count += 1
+
+        if count:
+            logger.warning(f"Requeued stale ingest jobs. count='{count}'")
+        return count
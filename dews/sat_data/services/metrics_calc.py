@@ -1,445 +1,347 @@
 import datetime
 import logging
-import matplotlib as mpl
-import matplotlib.pyplot as plt
+import os
 import numpy as np
+from rasterio.windows import Window
 
-from dews.settings import MEDIA_ROOT
+from dews.settings import MEDIA_ROOT, INDEX_IMAGE_FORMAT, INDEX_PREVIEW_SIZE, SCL_MASK_CLASSES
 from sat_data.services.utils.file_utils import FileUtils
-from sat_data.services.utils.dataset_utils import get_dataset
-from sat_data.models import Index, SatData, Band, remove_media_root
-from sat_data.enums.sat_band import SatBand
+from sat_data.services.band_cache import BandCache, open_band, read_preview
+from sat_data.services.band_math import BandExpression
+from sat_data.services.block_processor import BlockProcessor
+from sat_data.services.cloud_mask import CloudMask
+from sat_data.services.renderer import render_index_img, render_rgb_img
+from sat_data.services.cog_writer import write_cog
+from sat_data.services.index_stats import StatsAccumulator
+from sat_data.models import Index, IndexStats, SatData, remove_media_root
 from sat_data.enums.idx_img_type import IdxImgType
 
 logger = logging.getLogger("django")
 
+RGB_BANDS = ["b02", "b03", "b04"]
+SCL_BAND = "scl"
+PREVIEW_SUFFIX = "_preview"  # file name suffix of preview images
+
 class MetricsCalculator:
     sat_data = None
     metrics_to_calc = []
+    preview_size: int = INDEX_PREVIEW_SIZE
+    resolution: int = None
 
-    def __init__(self, sat_data: SatData, metrics_to_calc: list) -> None:
+    def __init__(self, sat_data: SatData, metrics_to_calc: list, preview_size: int = INDEX_PREVIEW_SIZE,
+                 resolution: int = None) -> None:
         """
         Initialize the MetricsCalculator instance.
 
         :param sat_data: SatData instance
-        :param metrics_to_calc: List of metrics to calculate (e.g. ["ndvi", "smi"]).
+        :param metrics_to_calc: List of metrics to calculate (e.g. ["ndvi", "smi"]), see `SPECTRAL_INDICES` and "rgb".
+        :param preview_size: Longest side of the preview images in pixels, which are published before the full
+            resolution images replace them; 0 disables previews
+        :param resolution: Resolution of the bands in meters (e.g. 20), bands without it are taken in their highest
+            resolution and aligned; None takes the highest resolution of every band
         """
         logger.debug(f"Initalizing MetricsCalculator instance. sat_data.id='{sat_data.id}', metrics_to_calc='{metrics_to_calc}'")
         self.sat_data = sat_data
         logger.debug(f"Set SatData instance. sat_data.id='{self.sat_data.id}'")
         self.metrics_to_calc = metrics_to_calc
         logger.debug(f"Set list with metrics to calculate. metrics_to_calc='{self.metrics_to_calc}'")
+        self.preview_size = preview_size
+        self.resolution = resolution
+        self.cloud_mask = None
         
-    def start(self):
+    def plan(self) -> list:
         """
-        Start the calculation of the desired metrics.
+        Returns the metrics with their bands (e.g. [("ndvi", ["b08", "b04"]), ("rgb", ["b02", "b03", "b04"])]).
+
+        Metrics sharing bands are ordered next to each other, so the bands can be released from the cache early.
         """
+        pending = []
+        for metric in dict.fromkeys(self.metrics_to_calc):  # unique, keeps order
+            if metric in SPECTRAL_INDICES:
+                pending.append((metric, SPECTRAL_INDICES[metric].bands))
+            elif metric == "rgb":
+                pending.append((metric, RGB_BANDS))
+            else:
+                logger.error(
+                    f"Invalid metric. metric='{metric}', sat_data.-id='{self.sat_data.id}'")
+
+        # Greedy: next metric is the one sharing the most bands with the previous one
+        plan = []
+        previous_bands = set()
+        while pending:
+            metric = max(pending, key=lambda item: len(previous_bands.intersection(item[1])))
+            pending.remove(metric)
+            plan.append(metric)
+            previous_bands = set(metric[1])
+        return plan
+
+    def get_band_paths(self, plan: list) -> dict:
+        """ Returns the file paths of all bands of the plan and of the SCL band with one query (see `SatData.get_bands`)."""
+        required_bands = {band for _, bands in plan for band in bands}
+        if SCL_MASK_CLASSES:
+            required_bands.add(SCL_BAND)
+        bands = self.sat_data.get_bands(*sorted(required_bands), resolution=self.resolution) or {}
+        ranges = {band_type: band.range for band_type, band in bands.items()}
+        logger.debug(
+            f"Resolved bands. resolution='{self.resolution}', ranges='{ranges}', sat_data.id='{self.sat_data.id}'")
+        return {band_type: band.band_file.path for band_type, band in bands.items()}
+
+    def get_cloud_mask(self, band_paths: dict):
+        """ Returns the cloud mask of the SatData object, built on first use; None without SCL band (e.g. L1C) or masking disabled."""
+        if self.cloud_mask is None and SCL_MASK_CLASSES and SCL_BAND in band_paths:
+            self.cloud_mask = CloudMask(band_paths[SCL_BAND])
+            logger.info(
+                f"Built cloud mask. coverage='{self.cloud_mask.coverage:.3f}', sat_data.id='{self.sat_data.id}'")
+        return self.cloud_mask
+
+    def create_previews(self, plan: list, band_paths: dict) -> dict:
+        """
+        Publishes a preview image of every metric, calculated from decimated band reads within seconds.
 
+        :return: Index instances showing the previews by metric
+        """
+        indexes = {}
+        save_location = FileUtils.generate_path(MEDIA_ROOT, self.sat_data.extracted_path)
+        for metric, bands in plan:
+            if any(band not in band_paths for band in bands):
+                continue
+            sources = {band: band_paths[band] for band in bands}
+            if metric in SPECTRAL_INDICES:
+                index = calculate_index(sat_data=self.sat_data,
+                                        spectral_index=SPECTRAL_INDICES[metric],
+                                        bands=sources,
+                                        save_location=save_location,
+                                        preview_size=self.preview_size,
+                                        mask=self.get_cloud_mask(band_paths))
+            else:
+                index = create_rgb_img(sat_data=self.sat_data,
+                                       blue_band_02=sources["b02"],
+                                       green_band_03=sources["b03"],
+                                       red_band_04=sources["b04"],
+                                       save_location=save_location,
+                                       preview_size=self.preview_size)
+            if index is not None:
+                indexes[metric] = index
+        logger.info(
+            f"Published metric previews. metrics='{list(indexes)}', preview_size='{self.preview_size}', sat_data.id='{self.sat_data.id}'")
+        return indexes
+
+    def start(self) -> dict:
+        """
+        Start the calculation of the desired metrics.
+
+        Preview images are published first (see `create_previews`), the full resolution images replace them.
+
+        :return: Saved image path by metric (e.g. {"ndvi": "/dews/media/.../..._ndvi_20231231_235959.png"}),
+            empty string if the metric failed
+        """
+        results = {}
         if self.sat_data is None:
             logger.error("SatData instance is 'None'.")
-            return
+            return results
+
+        # Plan metrics, so every band is read once
+        plan = self.plan()
+        band_paths = self.get_band_paths(plan)
+        band_cache = BandCache(band_paths)
+        last_use = {band: i for i, (_, bands) in enumerate(plan) for band in bands}
+        logger.debug(
+            f"Planned metrics calculation. plan='{plan}', sat_data.id='{self.sat_data.id}'")
+        previews = {}
+        if self.preview_size:
+            try:
+                previews = self.create_previews(plan, band_paths)
+            except Exception as e:
+                # Full resolution images are calculated anyway
+                logger.error(
+                    f"Failed to create metric previews. error='{e}', sat_data.id='{self.sat_data.id}'")
 
         # Calculate metrics
         try:
-            for metric in self.metrics_to_calc:
-                if metric == "ndvi":
-                    # NDVI
-                    logger.debug(f"Calculating NDVI... sat_data.id='{self.sat_data.id}'")
-                    calculate_ndvi(sat_data=self.sat_data,
-                                image_path_04=self.sat_data.bands.filter(type="b04").first().band_file.path,
-                                image_path_08=self.sat_data.bands.filter(type="b08").first().band_file.path,
-                                save_location=FileUtils.generate_path(MEDIA_ROOT, self.sat_data.extracted_path))
-                elif metric == "smi":
-                    # SMI
-                    logger.debug(f"Calculating SMI... sat_data.id='{self.sat_data.id}'")
-                    calculate_smi(sat_data=self.sat_data,
-                                image_path_8a=self.sat_data.bands.filter(type="b8a").first().band_file.path,
-                                image_path_11=self.sat_data.bands.filter(type="b11").first().band_file.path,
-                                save_location=FileUtils.generate_path(MEDIA_ROOT, self.sat_data.extracted_path))
-                elif metric == "ndwi":
-                    # NDWI
-                    logger.debug(f"Calculating NDWI... sat_data.id='{self.sat_data.id}'")
-                    calculate_ndwi(sat_data=self.sat_data)
-                elif metric == "evi":
-                    # EVI
-                    logger.debug(f"Calculating EVI... sat_data.id='{self.sat_data.id}'")
-                    calculate_evi(sat_data=self.sat_data)
-                elif metric == "ndsi":
-                    # NDSI
-                    logger.debug(f"Calculating NDSI... sat_data.id='{self.sat_data.id}'")
-                    calculate_ndsi(sat_data=self.sat_data,
-                                image_path_03=self.sat_data.bands.filter(type="b03").first().band_file.path,
-                                image_path_11=self.sat_data.bands.filter(type="b11").first().band_file.path,
-                                save_location=FileUtils.generate_path(MEDIA_ROOT, self.sat_data.extracted_path))
+            for i, (metric, bands) in enumerate(plan):
+                missing_bands = [band for band in bands if band not in band_paths]
+                if missing_bands:
+                    logger.error(
+                        f"Missing bands for metric. metric='{metric}', missing_bands='{missing_bands}', sat_data.id='{self.sat_data.id}'")
+                    results[metric] = ""
+                    continue
+
+                sources = {band: band_cache.get(band) for band in bands}
+                if metric in SPECTRAL_INDICES:
+                    # Spectral index (e.g. NDVI)
+                    logger.debug(f"Calculating {metric.upper()}... sat_data.id='{self.sat_data.id}'")
+                    index = calculate_index(sat_data=self.sat_data,
+                                            spectral_index=SPECTRAL_INDICES[metric],
+                                            bands=sources,
+                                            save_location=FileUtils.generate_path(MEDIA_ROOT, self.sat_data.extracted_path),
+                                            index=previews.get(metric),
+                                            mask=self.get_cloud_mask(band_paths))
                 elif metric == "rgb":
                     # RGB
                     logger.debug(f"Calculating RGB... sat_data.id='{self.sat_data.id}'")
-                    create_rgb_img(sat_data=self.sat_data,
-                                blue_band_02=self.sat_data.bands.filter(type="b02").first().band_file.path,
-                                green_band_03=self.sat_data.bands.filter(type="b03").first().band_file.path,
-                                red_band_04=self.sat_data.bands.filter(type="b04").first().band_file.path,
-                                save_location=FileUtils.generate_path(MEDIA_ROOT, self.sat_data.extracted_path))
-                else:
-                    logger.error(
-                        f"Invalid metric. metric='{metric}', sat_data.-id='{self.sat_data.id}'")
+                    index = create_rgb_img(sat_data=self.sat_data,
+                                           blue_band_02=sources["b02"],
+                                           green_band_03=sources["b03"],
+                                           red_band_04=sources["b04"],
+                                           save_location=FileUtils.generate_path(MEDIA_ROOT, self.sat_data.extracted_path),
+                                           index=previews.get(metric))
+                results[metric] = index.img.path if index is not None else ""
+
+                # Free bands which are not needed anymore
+                for band in bands:
+                    if last_use[band] == i:
+                        band_cache.release(band)
         except Exception as e:
             logger.error(
                 f"Failed to calculate metrics. error='{e}', metrics_to_calc='{self.metrics_to_calc}', sat_data.id='{self.sat_data.id}'")
-            return
+            return results
+        finally:
+            logger.debug(
+                f"Band cache statistics. hits='{band_cache.hits}', misses='{band_cache.misses}', sat_data.id='{self.sat_data.id}'")
+            band_cache.clear()
 
         logger.info(
             f"Finished calculating metrics. metrics_to_calc='{self.metrics_to_calc}', sat_data.id='{self.sat_data.id}'")
+        return results
 
 
 
-def create_plot_img(nested_array, save_loc, cmap="", interpolation=""):
-    """
-    Creates an image with MatPlotLib and saves it to desired save location.
+class SpectralIndex:
     """
-    logger.info(
-        f"Creating plot image. save_location='{save_loc}', cmap='{cmap}', interpolation='{interpolation}'")
-    try:
-        mpl.use("agg")
-        if cmap != "" and interpolation != "":
-            plt.imshow(nested_array, cmap=cmap, interpolation=interpolation)
-        elif cmap != "" and interpolation == "":
-            plt.imshow(nested_array, cmap=cmap)
-        elif cmap == "" and interpolation != "":
-            plt.imshow(nested_array, interpolation=interpolation)
-        elif cmap == "" and interpolation == "":
-            plt.imshow(nested_array)
-
-        # plt.colorbar()
-        plt.axis('off')
-        plt.savefig(save_loc, dpi=200,
-                    bbox_inches='tight', pad_inches=0.0)
-        plt.close('all')
-    except Exception as e:
-        logger.error(
-            f"Failed to save image. save_location='{save_loc}', cmap='{cmap}', interpolation='{interpolation}'")
-        return False
-
-    logger.info(
-        f"Successfully saved image. save_location='{save_loc}', cmap='{cmap}', interpolation='{interpolation}'")
-    return True
+    Declaration of a spectral index as band math formula and its image style.
 
-
-def calculate_evi(sat_data: SatData, g: int = 1, c1: int = 2.5,
-                  c2: int = 2.5, l: int = 1):
+    `value_range` is the range of the histogram bins of the index statistics.
     """
-    Calculates the EVI (Enhanced Vegetation Index) which is similar to the NDVI but more sensitive in high biomass regions.
-
-    For the Sentinel-2 image data we are using G=1, C1=2.5, C2=2.5 and L=1.
+    idx_type: str = ""
+    formula: str = ""
+    cmap: str = ""
+    interpolation: str = ""
+    value_range: tuple = (-1.0, 1.0)
+
+    def __init__(self, idx_type: str, formula: str, cmap: str = "", interpolation: str = "",
+                 value_range: tuple = (-1.0, 1.0)) -> None:
+        self.idx_type = idx_type
+        self.formula = formula
+        self.cmap = cmap
+        self.interpolation = interpolation
+        self.value_range = value_range
+        # Fails early on invalid formulas
+        self.bands = BandExpression(formula).bands
+
+
+# Spectral indices by name (e.g. "ndvi"), new indices only need a declaration
+SPECTRAL_INDICES = {spectral_index.idx_type: spectral_index for spectral_index in [
+    # Normalized Difference Vegetation Index, greenness of the biomes
+    SpectralIndex(IdxImgType.NDVI.value, "(B08 - B04) / (B08 + B04)", cmap="RdYlGn"),
+    # Soil Moisture Index, wetness of the soil
+    SpectralIndex(IdxImgType.SMI.value, "(B8A - B11) / (B8A + B11)", cmap="Blues"),
+    # Normalized Difference Water Index, water content of vegetation's leaves
+    SpectralIndex(IdxImgType.NDWI.value, "(B03 - B08) / (B03 + B08)", cmap="winter"),
+    # Enhanced Vegetation Index with G=1, C1=2.5, C2=2.5 and L=1, more sensitive in high biomass regions
+    SpectralIndex(IdxImgType.EVI.value, "1 * (B8A - B04) / (B8A + 2.5 * B04 - 2.5 * B02 + 1)", cmap="RdYlGn"),
+    # Normalized Difference Snow Index, separates snow from vegetation, soils and lithology endmembers
+    SpectralIndex(IdxImgType.NDSI.value, "(B03 - B11) / (B03 + B11)", interpolation="lanczos"),
+    # Normalized Multi-band Drought Index, soil and vegetation moisture
+    SpectralIndex(IdxImgType.NMDI.value, "(B8A - (B11 - B12)) / (B8A + (B11 - B12))", cmap="RdYlBu"),
+]}
+
+
+def calculate_index(sat_data: SatData, spectral_index: SpectralIndex, bands: dict, save_location="",
+                    index: Index = None, preview_size: int = 0, mask: CloudMask = None):
+    """
+    Calculates a spectral index block by block, saves its image and values (COG) and creates the Index instance.
+    The statistics of the values are collected in the same pass and saved as IndexStats instance.
 
     :param sat_data:
-    :param image_path_02:
-    :param image_path_04:
-    :param image_path_8a:
+    :param spectral_index: Declaration of the index (see `SPECTRAL_INDICES`)
+    :param bands: Band file paths or `CachedBand` objects by band name (e.g. {"b04": "/dews/media/.../B04.jp2"})
     :param save_location:
-    :param g: G is a gain factor.
-    :param c1: C1, C2 are the coefficients of the aerosol resistance term, which uses the blue band to correct for aerosol influences in the red band.
-    :param c2: Same as C1.
-    :param l: L is the canopy background adjustment that addresses non-linear, differential NIR and red radiant transfer through a canopy.
+    :param index: Index instance whose (preview) image is replaced; None creates a new one
+    :param preview_size: Calculates a preview image of at most this size from decimated reads only,
+        without COG and statistics; 0 calculates the full resolution
+    :param mask: Optional cloud mask, masked pixels are NaN and excluded from the statistics
+    :return: Index instance; None on failure
     """
-    # Get band info and image save location
-    band_info: Band = sat_data.get_band(
-        SatBand.B02.value,
-        SatBand.B04.value,
-        SatBand.B8A.value
-    )
-    save_loc = sat_data.img_save_loc(IdxImgType.EVI.value)
-
-    # Read datasets
-    dataset_b02 = get_dataset(band_info.b02_path)  # BLUE
-    dataset_b04 = get_dataset(band_info.b04_path)  # RED
-    dataset_b8a = get_dataset(band_info.b8a_path)  # NIR
-
-    blue_band_b02 = dataset_b02.read(1).astype(float)
-    red_band_b04 = dataset_b04.read(1).astype(float)
-    nir_band_b8a = dataset_b8a.read(1).astype(float)
-
-    logger.debug(
-        f"Read blue (BLUE), red (RED) and near-infrared (NIR) from dataset for EVI calculation. sat_data_id='{sat_data.id}'")
-    logger.debug(
-        f"Using the variables G='{g}', C1='{c1}', C2='{c2}', L='{l}' for EVI calculation. sat_data_id='{sat_data.id}'")
-
-    # Calculation
-    evi = [0]
+    idx_type = spectral_index.idx_type
     try:
-        evi = g * ((nir_band_b8a - red_band_b04) / (nir_band_b8a +
-                                                    c1 * red_band_b04 - c2 * blue_band_b02 + l))
-    except RuntimeWarning:
-        logger.warning(
-            f"Invalid value found during division of the enhanced vegetation index (EVI). sat_data_id='{sat_data.id}'")
-        logger.info(
-            f"EVI Calculation will be continued... sat_data_id='{sat_data.id}'")
-
-    logger.info(f"Calculated EVI. sat_data_id='{sat_data.id}'")
-
-    # Create and save image
-    cmap = "RdYlGn"
-    datetime_formatted = datetime.datetime.now() \
-        .strftime("%Y%m%d_%H%M%S")  # "20231231_235959"
-    save_loc = f"{save_loc}/{sat_data.id}_evi_{datetime_formatted}.png"
-
-    ok = create_plot_img(
-        nested_array=evi,
-        cmap=cmap,
-        save_loc=save_loc
-    )
-    if not ok:
+        expression = BandExpression(spectral_index.formula)
+        sources = [bands[band] for band in expression.bands]
+        if preview_size:
+            previews = read_preview(sources, preview_size)
+            values = np.empty(previews[0].shape, dtype="float32")
+            expression.evaluate(previews, values)
+            if mask is not None:
+                values[mask.get(Window(0, 0, values.shape[1], values.shape[0]), *values.shape)] = np.nan
+        else:
+            block_processor = BlockProcessor(sources, mask=mask)
+            stats = StatsAccumulator(*spectral_index.value_range)
+            values = block_processor.run(expression.evaluate, on_window=stats.update)
+    except Exception as e:
         logger.error(
-            f"Failed to save EVI image. sat_data_id='{sat_data.id}', save_loc='{save_loc}'")
-        return ""
-
-    logger.debug(
-        f"Saved EVI image '{save_loc} with cmap '{cmap}'. save_loc='{save_loc}', sat_data_id='{sat_data.id}'")
-    return save_loc
-
-
-def calculate_ndwi(sat_data: SatData) -> str:
-    """
-    Calculates the NDWI (Normalized Difference Water Index) which is used to monitor changes in water content of vegetation's leaves.
-
-    :param sat_data:
-    :param image_path_03:
-    :param image_path_08:
-    """
-    # Get band info and image save location
-    band_info: Band = sat_data.get_band(
-        SatBand.B03.value,
-        SatBand.B08.value,
-    )
-    save_loc = sat_data.img_save_loc(IdxImgType.NDWI.value)
-
-    # Read datasets
-    dataset_b03 = get_dataset(band_info.b03_path)  # GREEN
-    dataset_b08 = get_dataset(band_info.b08_path)  # VNIR
+            f"Failed to calculate index. idx_type='{idx_type}', formula='{spectral_index.formula}', preview_size='{preview_size}', error='{e}', sat_data_id='{sat_data.id}'")
+        return None
 
-    vnir_band_b08 = dataset_b08.read(1).astype(float)
-    green_band_b03 = dataset_b03.read(1).astype(float)
-    logger.debug(
-        f"Read near-infrared (VNIR) and green (GREEN) from dataset. sat_data_id='{sat_data.id}'")
-
-    # Calculation
-    ndwi = [0]
-    try:
-        ndwi = (green_band_b03 - vnir_band_b08) / \
-            (green_band_b03 + vnir_band_b08)
-    except RuntimeWarning as e:
-        logger.warning(
-            f"Invalid value found during division of the enhanced vegetation index (EVI). error='{e}', sat_data_id='{sat_data.id}'")
-
-    logger.info(f"Calculated NDWI. sat_data_id='{sat_data.id}'")
+    logger.info(f"Calculated index. idx_type='{idx_type}', preview_size='{preview_size}', sat_data_id='{sat_data.id}'")
 
     # Create and save image
-    cmap = "winter"
-    datetime_formatted = datetime.datetime.now() \
-        .strftime("%Y%m%d_%H%M%S")  # "20231231_235959"
-    save_loc = f"{save_loc}/{sat_data.id}_ndwi_{datetime_formatted}.png"
-
-    ok = create_plot_img(
-        nested_array=ndwi,
-        cmap=cmap,
-        save_loc=save_loc
+    file_name = get_file_name(sat_data, idx_type, save_location, preview_size)
+    save_location = f"{file_name}.{INDEX_IMAGE_FORMAT}"
+    ok = render_index_img(
+        values=values,
+        cmap=spectral_index.cmap,
+        interpolation=spectral_index.interpolation,
+        save_loc=save_location
     )
     if not ok:
         logger.error(
-            f"Failed to save NDWI image. sat_data_id='{sat_data.id}', save_loc='{save_loc}'")
-        return ""
-
-    logger.info(
-        f"Saved NDWI image '{save_loc} with cmap '{cmap}' under location '{save_loc}'. sat_data_id='{sat_data.id}'")
-    return save_loc
-
-
-def calculate_ndvi(sat_data: SatData, image_path_04, image_path_08, save_location="") -> str:
-    """
-    Calculates the Normalized Difference Vegetation Index (NDVI).
-    The NDVI is an indicator of the greenness of the biomes.
-
-    :param sat_data:
-    :param save_location:
-    :param image_path_08:
-    :param image_path_04:
-    """
-    # TODO: get average float ndvi and return it
-    # Load dataset from band 04 + 8
-    try:
-        dataset_04 = get_dataset(image_path_04)
-    except Exception as e:
-        logger.error(
-            f"Failed to read dataset band 'b04'. image_path_04='{image_path_04}' sat_data_id='{sat_data.id}'")
-        return ""
-    
-    try:
-        dataset_08 = get_dataset(image_path_08)
-    except Exception as e:
+            f"Failed to save index image. idx_type='{idx_type}', sat_data_id='{sat_data.id}', save_location='{save_location}'")
+        return None
+    if preview_size:
+        return save_index(sat_data, idx_type, save_location, index)
+
+    # Save values for window and overview reads
+    cog_location = f"{file_name}.tif"
+    if not write_cog(values, cog_location, block_processor.crs, block_processor.transform):
         logger.error(
-            f"Failed to read dataset band 'b08'. image_path_08='{image_path_08}' sat_data_id='{sat_data.id}'")
-        return ""
-
-
-    # Calculate NIR and RED bands
-    vnir_band_08 = dataset_08.read(1).astype(float)
-    red_band_04 = dataset_04.read(1).astype(float)
-    logger.debug(
-        f"Read near-infrared (VNIR/band 08) and red (RED/band 04) from dataset. sat_data_id='{sat_data.id}'")
+            f"Failed to save index COG. idx_type='{idx_type}', sat_data_id='{sat_data.id}', save_location='{cog_location}'")
+        cog_location = ""
+    index = save_index(sat_data, idx_type, save_location, index, cog_location)
 
-    # Calculate NDVI
-    ndvi = [0]
-    try:
-        ndvi = (vnir_band_08 - red_band_04) / (vnir_band_08 + red_band_04)
-    except RuntimeWarning as e:
-        logger.warning(
-            f"Invalid value found during division of the normalized difference vegetation index (NDVI). error='{e}', sat_data_id='{sat_data.id}'")
-
-    logger.info(f"Calculated NDVI. sat_data_id='{sat_data.id}'")
-
-    # Saving/displaying NDVI map
-    cmap = "RdYlGn"
-    datetime_formatted = datetime.datetime.now().strftime(
-        "%Y%m%d_%H%M%S")  # "20231231_235959"
-    save_location = f"{save_location}/{sat_data.id}_ndvi_{datetime_formatted}.png"
-    create_plot_img(
-        nested_array=ndvi,
-        cmap=cmap,
-        save_loc=save_location
-    )
+    # Create IndexStats instance
+    index_stats = IndexStats(index=index, **stats.result())
+    index_stats.save()
     logger.info(
-        f"Saved NDVI image '{save_location} with cmap '{cmap}' under location '{save_location}'. sat_data_id='{sat_data.id}'")
-    
-    # Create Index instance
-    index = Index(
-        idx_type=IdxImgType.NDVI.value,
-        img=remove_media_root(save_location),
-        sat_data=sat_data
-    )
-    index.save()
-    logger.info(f"Saved NDVI Index instance. index.id='{index.id}', sat_data.id='{sat_data.id}'")
+        f"Saved IndexStats instance. idx_type='{idx_type}', index.id='{index.id}', valid_count='{index_stats.valid_count}', mean='{index_stats.mean}'")
 
-    return save_location
+    return index
 
 
-def calculate_smi(sat_data: SatData, image_path_8a, image_path_11, save_location="") -> str:
-    """
-    The soil moisture index shows how wet the soil is.
-
-    :param sat_data:
-    :param image_path_8a:
-    :param image_path_11:
-    :param save_location:
-    :return:
-    """
-    # Load dataset from band 8a + 12
-    dataset_8a = get_dataset(image_path_8a)
-    dataset_11 = get_dataset(image_path_11)
-
-    # Calculate SWIR and RED bands
-    vnir_band_8a = dataset_8a.read(1).astype(float)
-    swir_band_11 = dataset_11.read(1).astype(float)
-    logger.debug(
-        f"Read visible and near infrared (VNIR/band 8a) and short-wave infrared (SWIR/band 11). id='{sat_data.id}'")
-
-    # Calculate moisture index
-    moisture_index = [0]
-    try:
-        moisture_index = (vnir_band_8a - swir_band_11) / \
-            (vnir_band_8a + swir_band_11)
-    except RuntimeWarning as e:
-        logger.warning(
-            f"Invalid value found during division of the moisture index. error='{e}', sat_data_id='{sat_data.id}'")
-
-    logger.info(
-        f"Calculated moisture index. sat_data_id='{sat_data.id}'")
-
-    # Saving/displaying moisture index map
-    cmap = "Blues"
-    datetime_formatted = datetime.datetime.now().strftime(
-        "%Y%m%d_%H%M%S")  # "20231231_235959"
-    save_location = f"{save_location}/{sat_data.id}_moisture_index_{datetime_formatted}.png"
-    create_plot_img(
-        nested_array=moisture_index,
-        cmap=cmap,
-        save_loc=save_location
-    )
-    logger.info(
-        f"Saved moisture index image '{save_location} with cmap '{cmap}' under location '{save_location}'. sat_data_id='{sat_data.id}'")
-    
-    # Create Index instance
-    index = Index(
-        idx_type=IdxImgType.SMI.value,
-        img=remove_media_root(save_location),
-        sat_data=sat_data
-    )
-    index.save()
-    logger.info(f"Saved SMI Index instance. index.id='{index.id}', sat_data.id='{sat_data.id}'")
-    
-    return save_location
-
-
-def calculate_ndsi(sat_data: SatData, image_path_03, image_path_11, save_location="") -> str:
-    """
-    Calculates the NSDI (Normalized Difference Snow Index) which is used to seperate snow from vegetation, soils and lthology endmembers.
-
-    :param sat_data:
-    :param image_path_03:
-    :param image_path_11:
-    :param save_location:
-    """
-    dataset_03 = get_dataset(image_path_03)  # GREEN
-    dataset_11 = get_dataset(image_path_11)  # SWIR
-
-    green_band_03 = dataset_03.read(1).astype(float)
-    swir_band_11 = dataset_11.read(1).astype(float)
-    logger.debug(
-        f"Read green (GREEN/band 03) and near-infrared (SWIR/band 11) from dataset. sat_data_id='{sat_data.id}'")
-
-    ndsi = [0]
-    try:
-        ndsi = (green_band_03 - swir_band_11) / \
-            (green_band_03 + swir_band_11)
-    except RuntimeWarning as e:
-        logger.warning(
-            f"Invalid value found during division of the normalized difference snow index index (NDSI). error='{e}', sat_data_id='{sat_data.id}'")
-
-    logger.info(f"Calculated NDSI. sat_data_id='{sat_data.id}'")
-
-    interpolation = "lanczos"
-    datetime_formatted = datetime.datetime.now().strftime(
-        "%Y%m%d_%H%M%S")  # "20231231_235959"
-    save_location = f"{save_location}/{sat_data.id}_ndsi_{datetime_formatted}.png"
-
-    create_plot_img(
-        nested_array=ndsi,
-        save_loc=save_location,
-        interpolation=interpolation,
-    )
-    logger.info(
-        f"Saved NDSI image '{save_location} with interpolation '{interpolation}' under location '{save_location}'. sat_data_id='{sat_data.id}'")
-    return save_location
-
-
-def create_rgb_img(sat_data: SatData, blue_band_02, green_band_03, red_band_04, save_location=""):
+def create_rgb_img(sat_data: SatData, blue_band_02, green_band_03, red_band_04, save_location="",
+                   index: Index = None, preview_size: int = 0):
     """
     Creates a RGB image from the satellite bands blue (band 02), green (band 03) and red (band 04).
 
     :param sat_data:
-    :param blue_band_02:
-    :param green_band_03:
-    :param red_band_04:
+    :param blue_band_02: File path or `CachedBand` object
+    :param green_band_03: File path or `CachedBand` object
+    :param red_band_04: File path or `CachedBand` object
     :param save_location:
-    :return:
+    :param index: Index instance whose (preview) image is replaced; None creates a new one
+    :param preview_size: Creates a preview image of at most this size from decimated reads; 0 is full resolution
+    :return: Index instance; None on failure
     """
-    # Read image and create dataset
-    band_02 = get_dataset(blue_band_02)
-    band_03 = get_dataset(green_band_03)
-    band_04 = get_dataset(red_band_04)
-
-    # Read band from dataset
-    red = band_04.read(1)
-    green = band_03.read(1)
-    blue = band_02.read(1)
+    if preview_size:
+        blue, green, red = read_preview([blue_band_02, green_band_03, red_band_04], preview_size)
+    else:
+        # Read image and create dataset
+        band_02 = open_band(blue_band_02)
+        band_03 = open_band(green_band_03)
+        band_04 = open_band(red_band_04)
+
+        # Read band from dataset
+        red = band_04.read(1, out_dtype="float32")
+        green = band_03.read(1, out_dtype="float32")
+        blue = band_02.read(1, out_dtype="float32")
 
     # Brighten
     red_b = __brighten(red)
@@ -460,40 +362,70 @@ def create_rgb_img(sat_data: SatData, blue_band_02, green_band_03, red_band_04,
     rgb_composite = np.dstack((red_bn, green_bn, blue_bn))
 
     # Save location path
-    datetime_formatted = datetime.datetime.now().strftime(
-        "%Y%m%d_%H%M%S")  # "20231231_235959"
-    save_location = f"{save_location}/{sat_data.id}_rgb_{datetime_formatted}.png"
+    save_location = f"{get_file_name(sat_data, IdxImgType.RGB.value, save_location, preview_size)}.{INDEX_IMAGE_FORMAT}"
 
-    # Save as .png
+    # Save as image
     interpolation = 'lanczos'
-    create_plot_img(
-        nested_array=rgb_composite,
+    ok = render_rgb_img(
+        rgb=rgb_composite,
         interpolation=interpolation,
         save_loc=save_location)
-    # plt.imshow(rgb_composite)
-    # plt.axis('off'),
-    # plt.savefig(save_location, dpi=200, bbox_inches='tight', pad_inches=0.0)
-    # plt.close('all')
-
-    # Create Index instance
-    index = Index(
-        idx_type=IdxImgType.RGB.value,
-        img=remove_media_root(save_location),
-        sat_data=sat_data
-    )
-    index.save()
-    logger.info(f"Saved RGB Index instance. index.id='{index.id}', sat_data.id='{sat_data.id}'")
+    if not ok:
+        logger.error(
+            f"Failed to save RGB image. sat_data_id='{sat_data.id}', save_location='{save_location}'")
+        return None
 
     # # Set RGB image as thumbnail
     # sat_data.thumbnail = remove_media_root(save_location)
     # sat_data.save()
     # logger.info(f"Set RGB Index image as thumbnail. sat_data.id='{sat_data.id}'")
 
-    return save_location
+    return save_index(sat_data, IdxImgType.RGB.value, save_location, index)
+
+
+def get_file_name(sat_data: SatData, idx_type: str, save_location: str, preview_size: int = 0) -> str:
+    """ Returns the path of an index' files without extension (e.g. ".../<sat_data.id>_ndvi_20231231_235959")."""
+    datetime_formatted = datetime.datetime.now().strftime(
+        "%Y%m%d_%H%M%S")  # "20231231_235959"
+    file_name = f"{save_location}/{sat_data.id}_{idx_type}_{datetime_formatted}"
+    return f"{file_name}{PREVIEW_SUFFIX}" if preview_size else file_name
+
+
+def save_index(sat_data: SatData, idx_type: str, img_path: str, index: Index = None, cog_path: str = "") -> Index:
+    """
+    Creates the Index instance or replaces the image of an existing one (e.g. a preview).
+
+    Without `index` the SatData object's Index instance of the type is replaced if there is one, so a metric
+    calculated again (e.g. by a retried ingestion) does not get a second one. The replaced files are removed.
+    """
+    if index is None:
+        index = Index.objects.filter(sat_data=sat_data, idx_type=idx_type).first() or \
+            Index(idx_type=idx_type, sat_data=sat_data)
+    replaced_img = index.img.path if index.img else ""
+    replaced_cog = index.cog.path if index.cog else ""
+    index.img = remove_media_root(img_path)
+    index.cog = remove_media_root(cog_path) if cog_path else None
+    index.save()
+    logger.info(f"Saved Index instance. idx_type='{idx_type}', index.id='{index.id}', img='{index.img}', sat_data.id='{sat_data.id}'")
+
+    if replaced_img and replaced_img != img_path and os.path.exists(replaced_img):
+        os.remove(replaced_img)
+        logger.debug(f"Removed replaced index image. index.id='{index.id}', path='{replaced_img}'")
+    if replaced_cog and replaced_cog != cog_path and os.path.exists(replaced_cog):
+        os.remove(replaced_cog)
+        logger.debug(f"Removed replaced index COG. index.id='{index.id}', path='{replaced_cog}'")
+    return index
+
+
+def get_calculated_metrics(sat_data: SatData) -> set:
+    """ Returns the metrics of the SatData object which have an Index instance with a full resolution image."""
+    return {idx_type for idx_type, img in sat_data.index.values_list("idx_type", "img")
+            if img and PREVIEW_SUFFIX not in os.path.basename(img)}
 
 
 def __normalize(band):
-    band_min, band_max = (band.min(), band.max())
+    # Previews mark no data as NaN
+    band_min, band_max = (np.nanmin(band), np.nanmax(band))
     return (band - band_min) / (band_max - band_min)
 
 
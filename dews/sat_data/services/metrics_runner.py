@@ -0,0 +1,61 @@
+import logging
+
+from sat_data.models import SatData
+from sat_data.services.metrics_calc import MetricsCalculator, RGB_BANDS, SPECTRAL_INDICES, get_calculated_metrics
+from sat_data.services.db_metrics_calc import DbMetricsCalculator
+from dews.settings import METRICS_ENGINE
+
+
+logger = logging.getLogger("django")
+
+
+def calculate_metrics(sat_data: SatData, metrics_to_calc: list, engine: str = METRICS_ENGINE) -> dict:
+    """
+    Calculates the metrics of a SatData object and raises an exception if one of them failed.
+
+    Runs as the "metrics" ingest stage in the ingest worker processes, so at most `INGEST_WORKER_CONCURRENCY`
+    calculations run at the same time and the web workers never calculate metrics.
+
+    A retried stage calculates the metrics which failed before only. Metrics which cannot be calculated for the
+    product (unsupported by the engine or missing bands, e.g. SMI without B8A) would fail on every attempt,
+    they are logged and skipped.
+
+    :param engine: "numpy" (`MetricsCalculator`) or "postgis" (`DbMetricsCalculator`)
+    :return: Result by calculated metric, see `MetricsCalculator.start` and `DbMetricsCalculator.start`
+    """
+    metrics_to_calc = list(dict.fromkeys(metrics_to_calc))
+    supported = list(SPECTRAL_INDICES) if engine == "postgis" else list(SPECTRAL_INDICES) + ["rgb"]
+    unsupported = [metric for metric in metrics_to_calc if metric not in supported]
+    if unsupported:
+        logger.error(
+            f"Skipping metrics which are not supported. metrics='{unsupported}', engine='{engine}', sat_data.id='{sat_data.id}'")
+
+    metric_bands = {metric: SPECTRAL_INDICES[metric].bands if metric in SPECTRAL_INDICES else RGB_BANDS
+                    for metric in metrics_to_calc if metric in supported}
+    existing_bands = set(sat_data.get_bands(*{band for bands in metric_bands.values() for band in bands}) or {})
+    missing = [metric for metric, bands in metric_bands.items() if not existing_bands.issuperset(bands)]
+    if missing:
+        logger.error(
+            f"Skipping metrics with missing bands. metrics='{missing}', existing_bands='{sorted(existing_bands)}', sat_data.id='{sat_data.id}'")
+
+    # Index tables are replaced by the database engine, Index instances of the numpy engine are kept
+    calculated = get_calculated_metrics(sat_data).intersection(metric_bands) if engine != "postgis" else set()
+    metrics_to_calc = [metric for metric in metric_bands if metric not in missing and metric not in calculated]
+    if calculated:
+        logger.info(
+            f"Skipping metrics which are already calculated. metrics='{sorted(calculated)}', sat_data.id='{sat_data.id}'")
+    if not metrics_to_calc:
+        return {}
+
+    if engine == "postgis":
+        results = DbMetricsCalculator(sat_data=sat_data, metrics_to_calc=metrics_to_calc).start()
+    else:
+        results = MetricsCalculator(sat_data=sat_data, metrics_to_calc=metrics_to_calc).start()
+
+    failed = [metric for metric in metrics_to_calc if not results.get(metric)]
+    if failed:
+        raise Exception(
+            f"Metrics calculation failed. failed='{failed}', sat_data.id='{sat_data.id}'")
+    logger.info(
+        f"Metrics calculation done. sat_data.id='{sat_data.id}', results='{results}'")
+    return results
@@ -117,6 +117,45 @@ class PathFinder():
         S3AProdType.SL_2_WST.value,
     ]
 
+    # Archive members read by PathFinder and AttrAdder, relative to the product's root directory
+    # Each pattern component is matched against one path component (e.g. "*" does not match "/")
+    s1_extraction_patterns = [
+        "manifest.safe",  # product type, coordinates, start and stop time
+        "measurement/*",  # bands
+        "preview/quick-look*.png",  # thumbnail
+    ]
+    s2_extraction_patterns = [
+        "manifest.safe",  # coordinates, start and stop time
+        "MTD_MSIL*.xml",  # product type, band paths
+        "INSPIRE.xml",
+        "*-ql.jpg",  # thumbnail
+        "GRANULE/*/IMG_DATA/*.jp2",  # bands (L1C)
+        "GRANULE/*/IMG_DATA/R*m/*.jp2",  # bands (L2A)
+    ]
+    s3_extraction_patterns = [
+        "xfdumanifest.xml",  # product type, coordinates, start and stop time
+        "EOPMetadata.xml",
+        "*.nc",  # bands
+        "quicklook.jpg",  # thumbnail
+        "browse.jpg",  # thumbnail
+    ]
+    extraction_patterns = {
+        SatMission.SENTINEL_1A.value: s1_extraction_patterns,
+        SatMission.SENTINEL_1B.value: s1_extraction_patterns,
+        SatMission.SENTINEL_2A.value: s2_extraction_patterns,
+        SatMission.SENTINEL_2B.value: s2_extraction_patterns,
+        SatMission.SENTINEL_3A.value: s3_extraction_patterns,
+        SatMission.SENTINEL_3B.value: s3_extraction_patterns,
+    }
+
+    @staticmethod
+    def get_extraction_patterns(mission: str) -> list | None:
+        """ Returns the patterns of the archive members needed for the mission; None if all members are needed."""
+        patterns = PathFinder.extraction_patterns.get(mission)
+        if patterns is None:
+            logger.debug(f"No extraction patterns for mission '{mission}'. All members are needed.")
+        return patterns
+
     def get_path_dict(self, extracted_path: str, mission: str, product_type: str):
         """ Returns a dictionary containing all paths."""
         # Set attributes
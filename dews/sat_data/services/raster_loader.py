@@ -0,0 +1,377 @@
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import threading
+import uuid
+from abc import ABC, abstractmethod
+
+import numpy as np
+import rasterio
+from psycopg2.pool import ThreadedConnectionPool
+from rasterio.windows import Window
+
+from dews.settings import DB_HOST, DB_NAME, DB_PORT, DB_USER, DB_PASSWORD, \
+    BAND_IMPORT_MAX_WORKERS, RASTER_IMPORT_ENGINE, RASTER_TILE_SIZE, RASTER_STORAGE_MODE, RASTER_STORAGE_MODES
+from sat_data.services.band_raster import BAND_RASTER_TABLE, OVERVIEW_FACTORS, get_band_cog_path, get_table_name
+from sat_data.services.cog_writer import convert_to_cog, get_decimated_shape, read_decimated, write_overview
+
+
+logger = logging.getLogger("django")
+
+# PostGIS raster pixel types by numpy data type
+PIXEL_TYPES = {
+    "int8": (3, "b"),  # 8BSI
+    "uint8": (4, "B"),  # 8BUI
+    "int16": (5, "h"),  # 16BSI
+    "uint16": (6, "H"),  # 16BUI
+    "int32": (7, "i"),  # 32BSI
+    "uint32": (8, "I"),  # 32BUI
+    "float32": (10, "f"),  # 32BF
+    "float64": (11, "d"),  # 64BF
+}
+BAND_FLAG_HAS_NODATA = 0x40
+BAND_FLAG_IS_OFFLINE = 0x80
+IN_DB = "in-db"
+OUT_DB = "out-db"
+
+
+def encode_raster_wkb(data: np.ndarray, transform, srid: int, nodata=None) -> bytes:
+    """
+    Encodes a tile as PostGIS raster WKB (little endian, version 0).
+
+    :param data: Pixel values with the shape (bands, height, width)
+    :param transform: Affine transform of the tile's upper left corner
+    :param srid: Spatial reference id of the raster
+    :param nodata: No data value of all bands; None if the raster has none
+    """
+    count, height, width = data.shape
+    wkb = [encode_header(count, height, width, transform, srid)]
+    for i in range(count):
+        # Band: pixel type with flags, no data value and pixel values
+        wkb.append(encode_band_header(data.dtype, nodata))
+        wkb.append(data[i].astype(data.dtype.newbyteorder("<"), copy=False).tobytes())
+    return b"".join(wkb)
+
+
+def encode_out_db_raster_wkb(shape: tuple, dtype, transform, srid: int, path: str, nodata=None) -> bytes:
+    """
+    Encodes a tile of an out-db raster as PostGIS raster WKB: the bands refer to the bands of a file instead of
+    containing pixel values.
+
+    :param shape: Shape (bands, height, width) of the tile
+    :param dtype: Data type of the file's bands
+    :param path: Absolute path of the file, read by the database server
+    """
+    count, height, width = shape
+    dtype = np.dtype(dtype)
+    wkb = [encode_header(count, height, width, transform, srid)]
+    for i in range(count):
+        # Band: pixel type with flags, no data value, 0-based band number in the file and null-terminated path
+        wkb.append(encode_band_header(dtype, nodata, BAND_FLAG_IS_OFFLINE))
+        wkb.append(struct.pack("<B", i))
+        wkb.append(path.encode() + b"\0")
+    return b"".join(wkb)
+
+
+def encode_header(count: int, height: int, width: int, transform, srid: int) -> bytes:
+    """ Encodes the raster WKB header: endianness, version, band count, georeference, srid and size."""
+    return struct.pack("<BHHddddddiHH", 1, 0, count,
+                       transform.a, transform.e, transform.c, transform.f,
+                       transform.b, transform.d, srid, width, height)
+
+
+def encode_band_header(dtype, nodata=None, flags: int = 0) -> bytes:
+    """ Encodes the pixel type with its flags and the no data value (0 if the band has none) of a band."""
+    pixel_type, nodata_format = PIXEL_TYPES[np.dtype(dtype).name]
+    if nodata is None:
+        return struct.pack(f"<B{nodata_format}", pixel_type | flags, 0)
+    return struct.pack(f"<B{nodata_format}", pixel_type | flags | BAND_FLAG_HAS_NODATA,
+                       np.array(nodata).astype(dtype).item())
+
+
+class RasterLoader(ABC):
+    """
+    Imports a raster file as band of a SatData object into the band raster table and its overviews into the
+    overview tables (the partitions must exist, see `create_partition`).
+    """
+    engine = ""
+
+    @abstractmethod
+    def load(self, band_path: str, sat_data_id, band: str, band_range: int) -> bool:
+        """
+        Imports the band within a single transaction.
+
+        :return: True on success; False on failure
+        """
+
+
+def sql_literal(value) -> str:
+    """ Returns the value as SQL string literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class Raster2PgsqlLoader(RasterLoader):
+    """
+    Imports rasters by piping the output of the PostGIS script `raster2pgsql` to `psql`.
+
+    `raster2pgsql` creates its own tables, so the tiles and overviews are loaded into staging tables and moved into
+    the band raster table and its overview tables within the same transaction.
+    """
+    engine = "raster2pgsql"
+
+    def load(self, band_path: str, sat_data_id, band: str, band_range: int) -> bool:
+        staging_table = f"{BAND_RASTER_TABLE}_staging_{uuid.uuid4().hex}"
+        values = f"{sql_literal(sat_data_id)}, {sql_literal(band)}, {int(band_range)}"
+        move_sql = (
+            f"INSERT INTO {BAND_RASTER_TABLE} (sat_data_id, band, range, rast, filename) "
+            f"SELECT {values}, rast, filename FROM public.{staging_table};\n"
+            f"DROP TABLE public.{staging_table};\n"
+        )
+        for factor in OVERVIEW_FACTORS:
+            # Overview tables of `raster2pgsql -l` are named "o_<factor>_<table>"
+            move_sql += (
+                f"INSERT INTO {get_table_name(factor)} (sat_data_id, band, range, rast) "
+                f"SELECT {values}, rast FROM public.o_{factor}_{staging_table};\n"
+                f"DROP TABLE public.o_{factor}_{staging_table};\n"
+            )
+        # pgsql options
+        # -F: Add a column with the filename
+        # -t auto: Automatically chooses a suitable tile size based on the input raster’s dimensions
+        # -l: Create overviews with the factors
+        # -e: No transaction of its own, psql runs everything in a single transaction
+        raster2pgsql_cmd = ["raster2pgsql", "-F", "-t", "auto", "-l", ",".join(map(str, OVERVIEW_FACTORS)), "-e",
+                            band_path, f"public.{staging_table}"]
+        psql_cmd = ["psql", "-v", "ON_ERROR_STOP=1", "--single-transaction", "-q",
+                    "-U", DB_USER, "-d", DB_NAME, "-h", DB_HOST, "-p", str(DB_PORT)]
+        logger.debug(f"import_cmd: {' '.join(raster2pgsql_cmd)} | {' '.join(psql_cmd)}")
+
+        # Using environment variables for credentials
+        env_vars = {
+            "PGPASSWORD": DB_PASSWORD
+        }
+
+        # Executing the commands, the move statements follow the output of raster2pgsql
+        try:
+            with subprocess.Popen(raster2pgsql_cmd, stdout=subprocess.PIPE) as raster2pgsql, \
+                    subprocess.Popen(psql_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, env=env_vars) as psql:
+                shutil.copyfileobj(raster2pgsql.stdout, psql.stdin)
+                if raster2pgsql.wait() != 0:
+                    # Closing stdin would commit the partial output
+                    psql.kill()
+                    raise Exception(f"raster2pgsql exited with code {raster2pgsql.returncode}")
+                psql.stdin.write(move_sql.encode())
+                psql.stdin.close()
+                if psql.wait() != 0:
+                    raise Exception(f"psql exited with code {psql.returncode}")
+        except Exception as e:
+            logger.error(
+                f"Failed to import raster using raster2pgsql. error='{e}', band_path='{band_path}', sat_data_id='{sat_data_id}', band='{band}', band_range='{band_range}'")
+            return False
+        return True
+
+
+class CopyRasterLoader(RasterLoader):
+    """
+    Imports rasters in-process: the raster is read in windows, every window is encoded as PostGIS raster WKB
+    and streamed with `COPY ... FROM STDIN` over a pooled connection.
+
+    The `raster` type has no binary receive function, so the tiles are sent as hex WKB in the text format.
+    """
+    engine = "copy"
+    tile_size = RASTER_TILE_SIZE
+
+    __pool = None
+    __pool_pid = None
+    __pool_lock = threading.Lock()
+    __pool_slots = None  # the pool raises instead of waiting if all connections are in use
+
+    def __init__(self, tile_size: int = RASTER_TILE_SIZE) -> None:
+        self.tile_size = tile_size
+
+    @staticmethod
+    def get_pool() -> ThreadedConnectionPool:
+        """ Returns the connection pool of the current process, it is shared by all subclasses."""
+        with CopyRasterLoader.__pool_lock:
+            # Connections must not be shared with forked processes
+            if CopyRasterLoader.__pool is None or CopyRasterLoader.__pool_pid != os.getpid():
+                CopyRasterLoader.__pool = ThreadedConnectionPool(
+                    minconn=1,
+                    maxconn=max(1, BAND_IMPORT_MAX_WORKERS),
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                )
+                CopyRasterLoader.__pool_slots = threading.BoundedSemaphore(max(1, BAND_IMPORT_MAX_WORKERS))
+                CopyRasterLoader.__pool_pid = os.getpid()
+                logger.debug(
+                    f"Created raster import connection pool. pid='{CopyRasterLoader.__pool_pid}'")
+            return CopyRasterLoader.__pool
+
+    def load(self, band_path: str, sat_data_id, band: str, band_range: int) -> bool:
+        pool = self.get_pool()
+        with CopyRasterLoader.__pool_slots:
+            conn = None
+            try:
+                conn = pool.getconn()
+                with conn.cursor() as cursor:
+                    # Rows are routed into the SatData object's partitions
+                    prefix = f"{sat_data_id}\t{escape_copy_text(band)}\t{int(band_range)}\t"
+                    for table_name, rows in self.iter_tables(band_path, prefix):
+                        cursor.copy_expert(
+                            f'COPY {table_name} (sat_data_id, band, range, rast, filename) FROM STDIN;',
+                            TileStream(rows),
+                        )
+                conn.commit()
+            except Exception as e:
+                if conn is not None:
+                    conn.rollback()
+                logger.error(
+                    f"Failed to import raster using COPY. error='{e}', band_path='{band_path}', sat_data_id='{sat_data_id}', band='{band}', band_range='{band_range}'")
+                return False
+            finally:
+                if conn is not None:
+                    pool.putconn(conn)
+        return True
+
+    def iter_tables(self, band_path: str, prefix: str):
+        """ Yields the table name and the COPY rows of the band raster table and of every overview table."""
+        for factor in [1] + OVERVIEW_FACTORS:
+            yield get_table_name(factor), self.iter_rows(band_path, prefix, factor)
+
+    def iter_rows(self, band_path: str, prefix: str = "", factor: int = 1):
+        """ Yields one COPY row (prefix, hex WKB and file name) per tile of the raster decimated by the factor."""
+        filename = escape_copy_text(os.path.basename(band_path))
+        with rasterio.open(band_path) as dataset:
+            srid = dataset.crs.to_epsg() if dataset.crs else 0
+            srid = srid or 0
+            height, width = get_decimated_shape(dataset.height, dataset.width, factor)
+            for row_off in range(0, height, self.tile_size):
+                for col_off in range(0, width, self.tile_size):
+                    window = Window(col_off, row_off,
+                                    min(self.tile_size, width - col_off),
+                                    min(self.tile_size, height - row_off))
+                    wkb = self.encode_tile(dataset, window, srid, factor)
+                    yield f"{prefix}{wkb.hex()}\t{filename}\n".encode()
+
+    def encode_tile(self, dataset, window: Window, srid: int, factor: int = 1) -> bytes:
+        """ Returns the raster WKB of the window (in the grid decimated by the factor) with its pixel values."""
+        if factor == 1:
+            data, transform = dataset.read(window=window), dataset.window_transform(window)
+        else:
+            # Decimated reads use the file's overviews or resolution levels (e.g. of JPEG 2000 files) if available
+            data, transform = read_decimated(dataset, window, factor)
+        return encode_raster_wkb(
+            data=data,
+            transform=transform,
+            srid=srid,
+            nodata=dataset.nodata,
+        )
+
+
+class OutDbRasterLoader(CopyRasterLoader):
+    """
+    Registers rasters as out-db rasters: the band is converted into a tiled COG on disk (see `get_band_cog_path`)
+    and only the georeference, the no data value and the COG's path of every tile are stored in the database.
+
+    The tiles match the internal tiles of the COG, so the database server reads one COG tile per raster tile.
+    Every overview is a tiled GeoTIFF of its own next to the COG, registered in the same way.
+    The database server needs read access to the COG at the same path and out-db rasters have to be enabled,
+    see `db.sql`.
+    """
+    engine = "out-db"
+
+    def load(self, band_path: str, sat_data_id, band: str, band_range: int) -> bool:
+        cog_path = get_band_cog_path(sat_data_id, band, band_range)
+        os.makedirs(os.path.dirname(cog_path), exist_ok=True)
+        if not convert_to_cog(band_path, cog_path, block_size=self.tile_size):
+            return False
+        for factor in OVERVIEW_FACTORS:
+            if not write_overview(cog_path, self.get_overview_path(cog_path, factor), factor, block_size=self.tile_size):
+                return False
+        return super().load(cog_path, sat_data_id, band, band_range)
+
+    @staticmethod
+    def get_overview_path(cog_path: str, factor: int) -> str:
+        """ Returns the path of the COG's overview with the factor, e.g. ".../b04_r10m_o2.tif"."""
+        return f"{os.path.splitext(cog_path)[0]}_o{factor}.tif"
+
+    def iter_tables(self, band_path: str, prefix: str):
+        """ Yields the table name and the COPY rows of the band raster table and of every overview table."""
+        yield BAND_RASTER_TABLE, self.iter_rows(band_path, prefix)
+        for factor in OVERVIEW_FACTORS:
+            yield get_table_name(factor), self.iter_rows(self.get_overview_path(band_path, factor), prefix)
+
+    def encode_tile(self, dataset, window: Window, srid: int, factor: int = 1) -> bytes:
+        """ Returns the raster WKB of the window referring to the bands of the file, no pixels are read."""
+        return encode_out_db_raster_wkb(
+            shape=(dataset.count, int(window.height), int(window.width)),
+            dtype=dataset.dtypes[0],
+            transform=dataset.window_transform(window),
+            srid=srid,
+            path=os.path.abspath(dataset.name),
+            nodata=dataset.nodata,
+        )
+
+
+def escape_copy_text(value: str) -> str:
+    """ Escapes a value for the text format of `COPY`."""
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+class TileStream:
+    """ File-like object handing rows of a generator to `copy_expert` without buffering the whole raster."""
+
+    def __init__(self, rows) -> None:
+        self.rows = rows
+        self.row = b""
+        self.offset = 0  # read position in the current row
+
+    def read(self, size=-1):
+        chunks = []
+        length = 0
+        while size < 0 or length < size:
+            if self.offset >= len(self.row):
+                try:
+                    self.row, self.offset = next(self.rows), 0
+                except StopIteration:
+                    break
+            end = len(self.row) if size < 0 else min(len(self.row), self.offset + size - length)
+            # Views are not copied until joined, so every byte is copied once
+            chunks.append(memoryview(self.row)[self.offset:end])
+            length += end - self.offset
+            self.offset = end
+        return b"".join(chunks)
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def get_storage_mode(mission: str = "", product_type: str = "") -> str:
+    """ Returns the raster storage mode ("in-db" or "out-db") of the product type or mission, see `RASTER_STORAGE_MODES`."""
+    for key in [product_type, mission]:
+        if key and key.lower() in RASTER_STORAGE_MODES:
+            return RASTER_STORAGE_MODES[key.lower()]
+    return RASTER_STORAGE_MODE
+
+
+def get_raster_loader(engine: str = RASTER_IMPORT_ENGINE, storage_mode: str = RASTER_STORAGE_MODE) -> RasterLoader:
+    """
+    Returns the raster loader of the storage mode ("in-db" or "out-db") and, for pixel values stored in the
+    database, of the engine ("raster2pgsql" or "copy").
+    """
+    if storage_mode == OUT_DB:
+        return OutDbRasterLoader()
+    elif storage_mode != IN_DB:
+        logger.warning(
+            f"Unknown raster storage mode, using '{IN_DB}'. storage_mode='{storage_mode}'")
+
+    if engine == CopyRasterLoader.engine:
+        return CopyRasterLoader()
+    elif engine != Raster2PgsqlLoader.engine:
+        logger.warning(
+            f"Unknown raster import engine, using '{Raster2PgsqlLoader.engine}'. engine='{engine}'")
+    return Raster2PgsqlLoader()
@@ -0,0 +1,125 @@
+import logging
+
+import numpy as np
+from PIL import Image
+
+from sat_data.services.colormaps import COLORMAP_LUTS
+from dews.settings import INDEX_IMAGE_MAX_SIZE
+
+
+logger = logging.getLogger("django")
+
+DEFAULT_CMAP = "viridis"
+# Resampling filters of downscaled images by interpolation name
+RESAMPLING = {
+    "": Image.Resampling.BOX,
+    "nearest": Image.Resampling.NEAREST,
+    "bilinear": Image.Resampling.BILINEAR,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+}
+CHUNK_ROWS = 1024  # rows colour mapped at once
+PNG_COMPRESS_LEVEL = 1  # fast compression, index images are mostly smooth ramps
+WEBP_QUALITY = 90
+
+__luts = {}
+
+
+def get_lut(cmap: str = "") -> np.ndarray:
+    """ Returns the RGBA lookup table (uint8) of the colormap: 256 colours and a transparent entry for NaN values."""
+    cmap = cmap or DEFAULT_CMAP
+    if cmap not in __luts:
+        if cmap not in COLORMAP_LUTS:
+            raise ValueError(f"Unknown colormap. cmap='{cmap}', available='{list(COLORMAP_LUTS)}'")
+        rgb = np.frombuffer(bytes.fromhex("".join(COLORMAP_LUTS[cmap])), dtype="uint8").reshape((256, 3))
+        lut = np.zeros((257, 4), dtype="uint8")
+        lut[:256, :3] = rgb
+        lut[:256, 3] = 255
+        __luts[cmap] = lut
+    return __luts[cmap]
+
+
+def apply_colormap(values: np.ndarray, cmap: str = "", vmin=None, vmax=None) -> np.ndarray:
+    """
+    Maps values to RGBA colours (uint8) like matplotlib's `imshow` with a linear norm.
+
+    The values are scaled from [vmin, vmax] (default: minimum and maximum value) to the 256 entries of the
+    colormap. NaN values are transparent.
+    """
+    lut = get_lut(cmap)
+    height, width = values.shape
+    rgba = np.empty((height, width, 4), dtype="uint8")
+    if vmin is None:
+        vmin = np.nanmin(values) if not np.isnan(values).all() else 0.0
+    if vmax is None:
+        vmax = np.nanmax(values) if not np.isnan(values).all() else 0.0
+    vmin = values.dtype.type(vmin)
+    span = values.dtype.type(vmax - vmin) if vmax > vmin else values.dtype.type(np.inf)
+
+    # Chunks of rows bound the size of the temporary arrays
+    for row_off in range(0, height, CHUNK_ROWS):
+        chunk = values[row_off:row_off + CHUNK_ROWS]
+        # Same arithmetic and binning as matplotlib: the maximum belongs to the last entry
+        scaled = chunk - vmin
+        scaled /= span
+        scaled *= 256
+        np.clip(scaled, 0, 255, out=scaled)
+        scaled[np.isnan(chunk)] = 256  # transparent entry
+        np.take(lut, scaled.astype("uint16"), axis=0, out=rgba[row_off:row_off + CHUNK_ROWS])
+    return rgba
+
+
+def to_uint8(rgb: np.ndarray) -> np.ndarray:
+    """ Converts float RGB values in [0, 1] to uint8 like matplotlib's `imshow`."""
+    rgb_uint8 = np.empty(rgb.shape, dtype="uint8")
+    for row_off in range(0, rgb.shape[0], CHUNK_ROWS):
+        chunk = np.clip(rgb[row_off:row_off + CHUNK_ROWS], 0, 1) * 255
+        rgb_uint8[row_off:row_off + CHUNK_ROWS] = chunk.astype("uint8")
+    return rgb_uint8
+
+
+def save_img(pixels: np.ndarray, save_loc: str, interpolation: str = "", max_size: int = INDEX_IMAGE_MAX_SIZE) -> bool:
+    """
+    Saves uint8 RGB or RGBA pixels as PNG or WebP (by the file extension) at native resolution.
+
+    :param max_size: Maximum width and height in pixels, bigger images are downscaled; 0 keeps the native size
+    :param interpolation: Resampling filter of the downscale (e.g. "lanczos")
+    """
+    try:
+        img = Image.fromarray(pixels)
+        if max_size and max(img.size) > max_size:
+            img.thumbnail((max_size, max_size), RESAMPLING.get(interpolation, Image.Resampling.BOX))
+
+        if save_loc.lower().endswith(".webp"):
+            img.save(save_loc, format="WEBP", quality=WEBP_QUALITY)
+        else:
+            img.save(save_loc, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    except Exception as e:
+        logger.error(
+            f"Failed to save image. save_location='{save_loc}', error='{e}'")
+        return False
+
+    logger.info(
+        f"Successfully saved image. save_location='{save_loc}', size='{img.size}'")
+    return True
+
+
+def render_index_img(values: np.ndarray, save_loc: str, cmap: str = "", interpolation: str = "",
+                     max_size: int = INDEX_IMAGE_MAX_SIZE) -> bool:
+    """ Colour maps index values and saves them as image."""
+    logger.info(
+        f"Rendering index image. save_location='{save_loc}', cmap='{cmap}', interpolation='{interpolation}'")
+    try:
+        rgba = apply_colormap(values, cmap)
+    except Exception as e:
+        logger.error(
+            f"Failed to colour map index values. save_location='{save_loc}', cmap='{cmap}', error='{e}'")
+        return False
+    return save_img(rgba, save_loc, interpolation, max_size)
+
+
+def render_rgb_img(rgb: np.ndarray, save_loc: str, interpolation: str = "", max_size: int = INDEX_IMAGE_MAX_SIZE) -> bool:
+    """ Saves a composite of float RGB values in [0, 1] with the shape (height, width, 3) as image."""
+    logger.info(
+        f"Rendering RGB image. save_location='{save_loc}', interpolation='{interpolation}'")
+    return save_img(to_uint8(rgb), save_loc, interpolation, max_size)
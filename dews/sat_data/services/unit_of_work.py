@@ -0,0 +1,52 @@
+import logging
+
+from django.db import transaction
+
+from sat_data.models import SatData
+
+
+logger = logging.getLogger("django")
+
+
+class UnitOfWork:
+    """
+    Collects the changes of an ingestion and writes them to the database in one transaction.
+
+    Attributes are set on the SatData object as usual, new objects (e.g. `Band`, `Area`) are added with `add()`.
+    `flush()` saves the SatData object once and inserts the new objects with one `bulk_create` per model,
+    so the number of queries does not grow with the number of bands.
+    """
+    sat_data: SatData = None
+    new_objects: list = []
+
+    def __init__(self, sat_data: SatData) -> None:
+        self.sat_data = sat_data
+        self.new_objects = []
+
+    def add(self, obj):
+        """ Registers a new object, it is inserted by the next flush."""
+        self.new_objects.append(obj)
+
+    def discard(self):
+        """ Drops the new objects which were not flushed yet."""
+        logger.debug(
+            f"Discarding unflushed objects. sat_data.id='{self.sat_data.id}', count='{len(self.new_objects)}'")
+        self.new_objects = []
+
+    def flush(self):
+        """ Saves the SatData object and inserts all new objects in one transaction."""
+        # Group new objects by model, keeping the order in which the models were added
+        objects_by_model = {}
+        for obj in self.new_objects:
+            objects_by_model.setdefault(type(obj), []).append(obj)
+
+        with transaction.atomic():
+            # SatData object first, new objects reference it
+            self.sat_data.save()
+            for model, objects in objects_by_model.items():
+                model.objects.bulk_create(objects)
+                logger.debug(
+                    f"Inserted objects. sat_data.id='{self.sat_data.id}', model='{model.__name__}', count='{len(objects)}'")
+
+        self.new_objects = []
+        logger.debug(f"Flushed unit of work. sat_data.id='{self.sat_data.id}'")
@@ -1,6 +1,11 @@
 import base64
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import hashlib
 import logging
 import os.path
+import shutil
+import threading
 from zipfile import ZipFile
 import zipfile
 import xmltodict
@@ -10,10 +15,12 @@ from rasterio.enums import Resampling
 import os
 
 
-from dews.settings import EXTRACTED_FILES_PATH, MEDIA_ROOT
+from dews.settings import EXTRACTED_FILES_PATH, MEDIA_ROOT, ARCHIVE_EXTRACTION_WORKERS
 
 logger = logging.getLogger("django")
 
+EXTRACTION_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
 
 class FileUtils:
     """
@@ -70,7 +77,16 @@ class FileUtils:
         return extract_path
 
     @staticmethod
-    def extract_archive(source_path: str, mission: str) -> str | None:
+    def extract_archive(source_path: str, mission: str, patterns: list = None) -> str | None:
+        """
+        Extracts the archive to `EXTRACTED_FILES_PATH/<mission>/<archive name>`.
+
+        :param source_path: Path of the ZIP archive
+        :param mission: Satellite mission of the archive
+        :param patterns: Patterns of the members to extract, relative to the product's root directory
+            (e.g. ["manifest.safe", "measurement/*"]); extracts all members if None
+        :return: Extracted path on success; None on failure
+        """
         logging.debug(
             f"Extract archive method called. source_path='{source_path}', mission='{mission}'")
 
@@ -84,16 +100,39 @@ class FileUtils:
                 f"Extracted directory already exists. extracted_path='{extracted_path}'")
             return extracted_path
 
-        # Extract archive
+        # Extract archive into a staging directory, so an interrupted extraction is not mistaken for a finished one
+        staging_path = os.path.join(destination_path, f".{folder_name}.partial")
+        if os.path.exists(staging_path):
+            shutil.rmtree(staging_path)
         try:
             with zipfile.ZipFile(source_path, "r") as archive_ref:
-                logger.debug(
-                    f"Trying to extract archive. source_path='{source_path}', destination_path='{destination_path}', mission='{mission}'")
-                archive_ref.extractall(destination_path)
+                members = None
+                if patterns is not None:
+                    members = FileUtils.select_archive_members(
+                        archive_ref.infolist(), patterns)
+                    if not members:
+                        logger.warning(
+                            f"No archive member matches the extraction patterns. Extracting all members. source_path='{source_path}', patterns='{patterns}'")
+                        members = None
+
+                if members is None:
+                    logger.debug(
+                        f"Trying to extract archive. source_path='{source_path}', destination_path='{destination_path}', mission='{mission}'")
+                    archive_ref.extractall(staging_path)
+                else:
+                    logger.debug(
+                        f"Trying to extract archive members. source_path='{source_path}', destination_path='{destination_path}', mission='{mission}', members='{len(members)}/{len(archive_ref.infolist())}'")
+                    FileUtils.extract_archive_members(
+                        source_path, members, staging_path)
+
+            os.replace(os.path.join(staging_path, folder_name), extracted_path)
         except Exception as e:
             logger.error(
                 f"Failed to extract files from archive. source_path='{source_path}', mission='{mission}', error='{e}'")
             return None
+        finally:
+            if os.path.exists(staging_path):
+                shutil.rmtree(staging_path)
         logger.info(
             f"Extracted archive. source_path='{source_path}', extracted_path='{extracted_path}'.")
 
@@ -109,6 +148,82 @@ class FileUtils:
                 f"Extraction failed. extracted_path='{extracted_path}'")
             return None
 
+    @staticmethod
+    def select_archive_members(members: list, patterns: list) -> list:
+        """
+        Returns the file members matching one of the patterns.
+
+        The first path component (the product's root directory, e.g. "S2B_MSIL2A_[...].SAFE") is not matched.
+        """
+        selected = []
+        for member in members:
+            if member.is_dir():
+                continue
+            parts = member.filename.split("/")[1:]
+            for pattern in patterns:
+                pattern_parts = pattern.split("/")
+                if len(parts) == len(pattern_parts) and \
+                        all(fnmatch.fnmatchcase(part, pattern_part) for part, pattern_part in zip(parts, pattern_parts)):
+                    selected.append(member)
+                    break
+        return selected
+
+    @staticmethod
+    def extract_archive_members(source_path: str, members: list, destination_path: str):
+        """ Streams the members out of the archive, several members in parallel."""
+        destination_path = os.path.realpath(destination_path)
+        local = threading.local()
+        archive_refs = []
+
+        def extract_member(member: zipfile.ZipInfo):
+            # ZipFile objects must not be shared between threads
+            if not hasattr(local, "archive_ref"):
+                local.archive_ref = zipfile.ZipFile(source_path, "r")
+                archive_refs.append(local.archive_ref)
+            target_path = os.path.realpath(
+                os.path.join(destination_path, member.filename))
+            if not target_path.startswith(destination_path + os.sep):
+                raise ValueError(
+                    f"Archive member is outside of the destination path. member='{member.filename}'")
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with local.archive_ref.open(member) as source, open(target_path, "wb") as target:
+                shutil.copyfileobj(source, target, EXTRACTION_CHUNK_SIZE)
+
+        try:
+            with ThreadPoolExecutor(max_workers=ARCHIVE_EXTRACTION_WORKERS) as executor:
+                # Consume results to raise exceptions of failed members
+                list(executor.map(extract_member, members))
+        finally:
+            for archive_ref in archive_refs:
+                archive_ref.close()
+
+    @staticmethod
+    def hash_file(file_path: str) -> str:
+        """ Returns the SHA-256 hex digest of the file, read in chunks."""
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as file_ref:
+            for chunk in iter(lambda: file_ref.read(EXTRACTION_CHUNK_SIZE), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def link_file(source_path: str, destination_path: str) -> bool:
+        """
+        Hardlinks the file to the destination, replacing an existing file.
+
+        Returns False if the file cannot be linked (e.g. different file systems), the caller then has to copy it.
+        """
+        try:
+            os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+            if os.path.lexists(destination_path):
+                os.remove(destination_path)
+            os.link(source_path, destination_path)
+        except OSError as e:
+            logger.debug(
+                f"Could not link file. source_path='{source_path}', destination_path='{destination_path}', error='{e}'")
+            return False
+        return True
+
     @staticmethod
     def generate_path(*args):
         path = "/".join(map(str, args))
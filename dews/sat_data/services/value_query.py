@@ -0,0 +1,142 @@
+import json
+import logging
+import math
+
+import numpy as np
+import rasterio
+from affine import Affine
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import connection
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask
+from rasterio.windows import Window, bounds as window_bounds, from_bounds
+
+from sat_data.enums.sat_band import SatBand
+from sat_data.services.band_math import BandExpression
+from sat_data.services.band_raster import BAND_RASTER_TABLE
+from sat_data.services.block_processor import BAND_RESAMPLING
+from sat_data.services.metrics_calc import SPECTRAL_INDICES
+from sat_data.models import SatData
+from dews.settings import VALUE_QUERY_MAX_PIXELS
+
+
+logger = logging.getLogger("django")
+
+
+def query_point(sat_data: SatData, point: GEOSGeometry) -> dict:
+    """
+    Returns the values of all bands and spectral indices of the SatData object at the point.
+
+    The tiles containing the point are found by the spatial index of the band raster table, so a single statement
+    reads one tile per band. Bands in several resolutions are taken in their highest resolution.
+
+    :param point: Point with a SRID (e.g. 4326 for lon/lat)
+    :return: {"bands": {"b04": {"range": 10, "value": 1234.0}, ...}, "indices": {"ndvi": 0.53, ...}};
+        no data values are None
+    """
+    with connection.cursor() as cursor:
+        # The point is transformed into the SRID of the tiles once, so the spatial index applies
+        cursor.execute(f'''
+            WITH point AS (
+                SELECT ST_Transform(ST_GeomFromEWKT(%s),
+                    (SELECT ST_SRID(rast) FROM {BAND_RASTER_TABLE} WHERE sat_data_id = %s LIMIT 1)) AS geom
+            )
+            SELECT t.band, t.range, ST_Value(t.rast, 1, point.geom)
+            FROM {BAND_RASTER_TABLE} t, point
+            WHERE t.sat_data_id = %s AND ST_Intersects(ST_ConvexHull(t.rast), point.geom);
+        ''', (point.ewkt, str(sat_data.id), str(sat_data.id)))
+        rows = cursor.fetchall()
+
+    bands = {}
+    # Highest resolution first, unknown range (0) last; of tiles sharing the point's edge the one with a value
+    for band, band_range, value in sorted(rows, key=lambda row: (row[1] or math.inf, row[2] is None)):
+        bands.setdefault(band, {"range": band_range, "value": value})
+
+    indices = {}
+    values = {band: np.array([np.nan if item["value"] is None else item["value"]], dtype="float32")
+              for band, item in bands.items()}
+    for idx_type, values_by_index in get_index_values(values).items():
+        value = values_by_index[0]
+        indices[idx_type] = None if np.isnan(value) else float(value)
+    return {"bands": bands, "indices": indices}
+
+
+def query_polygon(sat_data: SatData, polygon: GEOSGeometry, max_pixels: int = VALUE_QUERY_MAX_PIXELS) -> dict:
+    """
+    Returns statistics (count, mean, min, max) of all bands and spectral indices of the SatData object within the
+    polygon.
+
+    The band files are read in the window of the polygon's extent on the grid of the highest resolution band,
+    bands of other resolutions are resampled onto it while reading. Polygons with more than `max_pixels` pixels
+    are read decimated (using the files' overviews), the scale is part of the result.
+
+    :param polygon: Polygon with a SRID (e.g. 4326 for lon/lat)
+    :return: {"scale": 10.0, "bands": {"b04": {"range": 10, "count": ..., "mean": ...}}, "indices": {"ndvi": {...}}}
+    """
+    band_types = [band_type for band_type in set(sat_data.bands.values_list("type", flat=True))
+                  if band_type in SatBand.get_all()]
+    band_objs = sat_data.get_bands(*band_types) or {}
+    if not band_objs:
+        return {"scale": None, "bands": {}, "indices": {}}
+
+    # Highest resolution band is the reference grid
+    reference = min(band_objs.values(), key=lambda band: band.range or math.inf)
+    with rasterio.open(reference.band_file.path) as dataset:
+        geometry = polygon.transform(dataset.crs.to_epsg(), clone=True)
+        window = from_bounds(*geometry.extent, transform=dataset.transform).round_offsets().round_lengths()
+        try:
+            window = window.intersection(Window(0, 0, dataset.width, dataset.height))
+        except WindowError:
+            logger.debug(f"Polygon is outside of the bands. polygon='{polygon.ewkt}', sat_data.id='{sat_data.id}'")
+            return {"scale": None, "bands": {}, "indices": {}}
+        area = window_bounds(window, dataset.transform)
+        factor = max(1, math.ceil(math.sqrt(window.width * window.height / max_pixels)))
+        shape = (math.ceil(window.height / factor), math.ceil(window.width / factor))
+        transform = dataset.window_transform(window) * Affine.scale(window.width / shape[1],
+                                                                    window.height / shape[0])
+    inside = geometry_mask([json.loads(geometry.json)], out_shape=shape, transform=transform, invert=True)
+
+    values = {}
+    for band_type, band in band_objs.items():
+        with rasterio.open(band.band_file.path) as dataset:
+            band_values = dataset.read(1, window=from_bounds(*area, transform=dataset.transform), out_shape=shape,
+                                       out_dtype="float32", resampling=BAND_RESAMPLING)
+            if dataset.nodata is not None:
+                band_values[band_values == dataset.nodata] = np.nan
+        band_values[~inside] = np.nan
+        values[band_type] = band_values
+
+    logger.debug(
+        f"Read band values of polygon. window='{window}', factor='{factor}', shape='{shape}', sat_data.id='{sat_data.id}'")
+    return {
+        "scale": abs(transform.a),
+        "bands": {band_type: {"range": band_objs[band_type].range, **get_stats(band_values)}
+                  for band_type, band_values in values.items()},
+        "indices": {idx_type: get_stats(index_values)
+                    for idx_type, index_values in get_index_values(values).items()},
+    }
+
+
+def get_index_values(values: dict) -> dict:
+    """ Returns the values of every spectral index whose bands are in `values` (float32 arrays by band name)."""
+    indices = {}
+    for idx_type, spectral_index in SPECTRAL_INDICES.items():
+        expression = BandExpression(spectral_index.formula)
+        if any(band not in values for band in expression.bands):
+            continue
+        bands = [values[band] for band in expression.bands]
+        out = np.empty(bands[0].shape, dtype="float32")
+        expression.evaluate(bands, out)
+        # No data in any band is no data in the index
+        out[np.logical_or.reduce([np.isnan(band) for band in bands])] = np.nan
+        indices[idx_type] = out
+    return indices
+
+
+def get_stats(values: np.ndarray) -> dict:
+    """ Returns the number of valid (not NaN) values, their mean, minimum and maximum; None if there are none."""
+    valid = values[~np.isnan(values)]
+    if valid.size == 0:
+        return {"count": 0, "mean": None, "min": None, "max": None}
+    return {"count": int(valid.size), "mean": float(valid.mean(dtype="float64")),
+            "min": float(valid.min()), "max": float(valid.max())}
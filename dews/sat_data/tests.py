@@ -1,11 +1,41 @@
+import hashlib
+import os
+import struct
+import tempfile
 import uuid
+import zipfile
+import numpy as np
+import rasterio
+from PIL import Image
+from affine import Affine
 from django.test import TestCase
 from sat_data.services.utils.file_utils import FileUtils
 from sat_data.services.metrics_calc import MetricsCalculator
 from sat_data.enums.sat_mission import SatMission
 from sat_data.services.attr_adder import AttrAdder
-from sat_data.models import Band, SatData, remove_media_root
+from sat_data.models import Band, IngestJob, SatData, remove_media_root
+from sat_data.services.job_queue import JobQueue, get_lock_key
+from sat_data.services.ingest_worker import IngestWorker
+from sat_data.services.path_finder import PathFinder
+from sat_data.services.raster_loader import CopyRasterLoader, RasterLoader, encode_out_db_raster_wkb, \
+    encode_raster_wkb, escape_copy_text
+from sat_data.services.unit_of_work import UnitOfWork
+from sat_data.services.block_processor import BlockProcessor
+from sat_data.services.band_cache import BandCache, CachedBand, read_preview
+from sat_data.services.band_math import BandExpression
+from sat_data.services.renderer import apply_colormap, get_lut, render_index_img
+from sat_data.services.cog_writer import write_cog, write_overview
+from sat_data.services.index_stats import StatsAccumulator
+from sat_data.services.cloud_mask import CloudMask
+from rasterio.windows import Window
+from sat_data.services.metrics_calc import SPECTRAL_INDICES, get_calculated_metrics, save_index
+from sat_data.services.metrics_runner import calculate_metrics
+from sat_data.services.db_metrics_calc import DbMetricsCalculator
+from sat_data.services.band_raster import get_overview_factor
+from sat_data.services.value_query import get_index_values, get_stats
+from sat_data.enums.status import Status
 from django.contrib.auth.models import User
+from dews.settings import MEDIA_ROOT
 
 
 class FileUtilsTestCase(TestCase):
@@ -20,9 +50,45 @@ class FileUtilsTestCase(TestCase):
     def test_extract_archive(self):
         pass  # TODO: implement
 
+    def test_select_archive_members(self):
+        root = "S2B_MSIL2A_20231213T104339_N0510_R008_T32UNE_20231213T122711.SAFE"
+        members = [zipfile.ZipInfo(f"{root}/{name}") for name in [
+            "manifest.safe",
+            "MTD_MSIL2A.xml",
+            "GRANULE/L2A_T32UNE/IMG_DATA/R10m/T32UNE_B02_10m.jp2",
+            "GRANULE/L2A_T32UNE/QI_DATA/MSK_CLDPRB_20m.jp2",
+            "AUX_DATA/manifest.safe",
+        ]]
+        selected = FileUtils.select_archive_members(
+            members, PathFinder.get_extraction_patterns(SatMission.SENTINEL_2B.value))
+        self.assertEqual(
+            [member.filename.split("/", 1)[1] for member in selected],
+            ["manifest.safe", "MTD_MSIL2A.xml", "GRANULE/L2A_T32UNE/IMG_DATA/R10m/T32UNE_B02_10m.jp2"],
+        )
+
     def test_generate_path(self):
         pass  # TODO: implement
 
+    def test_hash_file(self):
+        with tempfile.NamedTemporaryFile() as file_ref:
+            file_ref.write(b"dews")
+            file_ref.flush()
+            self.assertEqual(
+                FileUtils.hash_file(file_ref.name),
+                hashlib.sha256(b"dews").hexdigest(),
+            )
+
+    def test_link_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            source_path = f"{tmp_dir}/B04.jp2"
+            destination_path = f"{tmp_dir}/uploads/B04.jp2"
+            with open(source_path, "wb") as file_ref:
+                file_ref.write(b"band")
+            self.assertTrue(FileUtils.link_file(source_path, destination_path))
+            # Replaces existing files
+            self.assertTrue(FileUtils.link_file(source_path, destination_path))
+            self.assertTrue(os.path.samefile(source_path, destination_path))
+
     def test_xml_to_dict(self):
         xml_dict = FileUtils.xml_to_dict(self.manifest_path)
 
@@ -117,6 +183,31 @@ class SatDataTestCase(TestCase):
         self.assertIsNotNone(sat_data.time_travels)
         # TODO: check if Band objects were created
 
+    def test_stage_status(self):
+        sat_data = self.sat_data
+        self.assertFalse(sat_data.is_stage_done("bands"))
+        sat_data.set_stage_status("bands", Status.FAILED.value, "error")
+        self.assertFalse(SatData.objects.get(id=sat_data.id).is_stage_done("bands"))
+        sat_data.set_stage_status("bands", Status.DONE.value)
+        sat_data = SatData.objects.get(id=sat_data.id)
+        self.assertTrue(sat_data.is_stage_done("bands"))
+        self.assertEqual(sat_data.ingest_stages["bands"]["error"], "")
+
+    def test_get_bands(self):
+        sat_data = self.sat_data
+        Band.objects.bulk_create([
+            Band(range=10, type="b04", sat_data=sat_data),
+            Band(range=20, type="b04", sat_data=sat_data),
+            Band(range=20, type="b8a", sat_data=sat_data),
+            Band(range=60, type="b8a", sat_data=sat_data),
+        ])
+        bands = sat_data.get_bands("B04", "b8a")
+        self.assertEqual((bands["b04"].range, bands["b8a"].range), (10, 20))  # highest resolution
+        bands = sat_data.get_bands("b04", "b8a", "b02", resolution=60)
+        self.assertEqual((bands["b04"].range, bands["b8a"].range), (10, 60))
+        self.assertNotIn("b02", bands)
+        self.assertIsNone(sat_data.get_bands("b99"))
+
     def test_attr_adder_sh(self):
         """
         Test the class AttrAdder with a SatData object that was created using the Sentinel Hub API.
@@ -193,3 +284,461 @@ class SatDataTestCase(TestCase):
             # RGB Index object should exist
             rgb_idx = sat_data.index.filter(idx_type="rgb").first()
             self.assertIsNotNone(rgb_idx)
+
+
+class JobQueueTestCase(TestCase):
+    archive_path: str = "/dews/media/sat_data/archive/sentinel-2b/S2B_MSIL2A_20231213T104339_N0510_R008_T32UNE_20231213T122711.SAFE.zip"
+
+    def setUp(self) -> None:
+        self.testuser = User.objects.create_user(
+            username='testuser', password='test')
+
+    def test_enqueue(self):
+        job = JobQueue.enqueue(user=self.testuser, archive_path=self.archive_path)
+        self.assertEqual(job.status, Status.QUEUED.value)
+        self.assertEqual(job.mission, SatMission.SENTINEL_2B.value)
+
+    def test_claim(self):
+        job = JobQueue.enqueue(user=self.testuser, archive_path=self.archive_path)
+        claimed = JobQueue.claim("testworker")
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.status, Status.IN_PROGRESS.value)
+        self.assertEqual(claimed.attempts, 1)
+        # Job is not handed out twice
+        self.assertIsNone(JobQueue.claim("testworker"))
+
+    def test_fail_and_retry(self):
+        JobQueue.enqueue(user=self.testuser, archive_path=self.archive_path)
+        job = JobQueue.claim("testworker")
+        job.max_attempts = 2
+        JobQueue.fail(job, "error")
+        self.assertEqual(IngestJob.objects.get(id=job.id).status, Status.QUEUED.value)
+        job.attempts = 2
+        JobQueue.fail(job, "error")
+        self.assertEqual(IngestJob.objects.get(id=job.id).status, Status.FAILED.value)
+
+    def test_find_duplicate(self):
+        archive_hash = hashlib.sha256(b"archive").hexdigest()
+        self.assertEqual(JobQueue.find_duplicate(archive_hash), (None, None))
+        job = JobQueue.enqueue(user=self.testuser, archive_path=self.archive_path, archive_hash=archive_hash)
+        self.assertEqual(JobQueue.find_duplicate(archive_hash), (None, job))
+        sat_data = SatData.objects.create(id=uuid.uuid4(), user=self.testuser, archive_hash=archive_hash)
+        # Interrupted ingestions are resumed by the pending job
+        self.assertEqual(JobQueue.find_duplicate(archive_hash), (None, job))
+        sat_data.processing_done = True
+        sat_data.save()
+        self.assertEqual(JobQueue.find_duplicate(archive_hash), (sat_data, None))
+
+    def test_get_lock_key(self):
+        self.assertEqual(get_lock_key("0" * 64), -2 ** 31)
+        self.assertEqual(get_lock_key("f" * 64), 2 ** 31 - 1)
+
+    def test_finish_without_metrics(self):
+        sat_data = SatData.objects.create(id=uuid.uuid4(), user=self.testuser)
+        job = JobQueue.enqueue_metrics(sat_data, [])
+        self.assertEqual(job.archive_path, "")
+        self.assertEqual(job.sat_data, sat_data)
+        self.assertFalse(sat_data.processing_done)
+        IngestWorker("testworker").process(JobQueue.claim("testworker"))
+        self.assertTrue(SatData.objects.get(id=sat_data.id).processing_done)
+        self.assertEqual(IngestJob.objects.get(id=job.id).status, Status.DONE.value)
+
+
+class UnitOfWorkTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.testuser = User.objects.create_user(
+            username='testuser', password='test')
+
+    def test_flush(self):
+        sat_data = SatData(id=uuid.uuid4(), user=self.testuser)
+        unit_of_work = UnitOfWork(sat_data)
+        sat_data.name = "test"
+        for band_string in ["b02", "b03", "b04"]:
+            unit_of_work.add(Band(range=10, type=band_string, sat_data=sat_data))
+        # Nothing is written before the flush
+        self.assertFalse(SatData.objects.filter(id=sat_data.id).exists())
+
+        unit_of_work.flush()
+        self.assertEqual(SatData.objects.get(id=sat_data.id).name, "test")
+        self.assertEqual(sat_data.bands.count(), 3)
+        self.assertEqual(unit_of_work.new_objects, [])
+
+    def test_discard(self):
+        sat_data = SatData.objects.create(id=uuid.uuid4(), user=self.testuser)
+        unit_of_work = UnitOfWork(sat_data)
+        unit_of_work.add(Band(range=10, type="b02", sat_data=sat_data))
+        unit_of_work.discard()
+        unit_of_work.flush()
+        self.assertEqual(sat_data.bands.count(), 0)
+
+
+class RasterLoaderTestCase(TestCase):
+
+    def test_abstract_loader(self):
+        class IncompleteLoader(RasterLoader):
+            engine = "incomplete"
+
+        # Loaders without `load` fail on instantiation
+        with self.assertRaises(TypeError):
+            IncompleteLoader()
+
+    def test_encode_raster_wkb(self):
+        data = np.arange(6, dtype="uint16").reshape((1, 2, 3))
+        transform = Affine(10.0, 0.0, 500000.0, 0.0, -10.0, 6000000.0)
+        wkb = encode_raster_wkb(data, transform, srid=32632, nodata=0)
+
+        # Header (61 bytes) + pixel type (1 byte) + nodata (2 bytes) + pixels (6 * 2 bytes)
+        self.assertEqual(len(wkb), 61 + 1 + 2 + 12)
+        header = struct.unpack("<BHHddddddiHH", wkb[:61])
+        self.assertEqual(header[2], 1)  # band count
+        self.assertEqual(header[3:7], (10.0, -10.0, 500000.0, 6000000.0))
+        self.assertEqual(header[9:], (32632, 3, 2))
+        self.assertEqual(wkb[61], 6 | 0x40)  # 16BUI with nodata
+        self.assertEqual(wkb[64:], data.tobytes())
+
+    def test_iter_rows(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            band_path = os.path.join(tmp_dir, "T32_B04_10m.tif")
+            with rasterio.open(band_path, "w", driver="GTiff", height=4, width=4, count=1, dtype="uint16",
+                               crs="EPSG:32632", transform=Affine(10.0, 0.0, 500000.0, 0.0, -10.0, 6000000.0)) as dataset:
+                dataset.write(np.ones((1, 4, 4), dtype="uint16"))
+            rows = list(CopyRasterLoader().iter_rows(band_path, "id\tb04\t10\t"))
+
+        # One tile with the columns sat_data_id, band, range, rast and filename
+        self.assertEqual(len(rows), 1)
+        columns = rows[0].decode().rstrip("\n").split("\t")
+        self.assertEqual(columns[:3], ["id", "b04", "10"])
+        self.assertEqual(columns[4], "T32_B04_10m.tif")
+        self.assertEqual(escape_copy_text("a\tb"), "a\\tb")
+
+    def test_encode_out_db_raster_wkb(self):
+        transform = Affine(10.0, 0.0, 500000.0, 0.0, -10.0, 6000000.0)
+        wkb = encode_out_db_raster_wkb((1, 2, 3), "uint16", transform, srid=32632, path="/bands/b04.tif", nodata=0)
+
+        # Same header as in-db rasters, the band refers to the file instead of containing pixels
+        self.assertEqual(wkb[:61], encode_raster_wkb(np.zeros((1, 2, 3), dtype="uint16"), transform, 32632)[:61])
+        self.assertEqual(wkb[61], 6 | 0x40 | 0x80)  # 16BUI with nodata, offline
+        self.assertEqual(wkb[64], 0)  # first band of the file
+        self.assertEqual(wkb[65:], b"/bands/b04.tif\0")
+
+
+class BlockProcessorTestCase(TestCase):
+
+    def test_get_windows(self):
+        # 5 x 3 blocks of 100 x 100 pixels, last block row and column are partial
+        height, width = 450, 250
+        for max_blocks in [1, 2, 3, 7]:
+            windows = BlockProcessor.get_windows(height, width, 100, 100, max_blocks)
+            covered = np.zeros((height, width), dtype="uint8")
+            for window in windows:
+                covered[window.toslices()] += 1
+                self.assertLessEqual(-(-window.height // 100) * -(-window.width // 100), max_blocks)
+            # Every pixel is covered exactly once
+            self.assertTrue((covered == 1).all())
+
+
+class BlockProcessorMixedResolutionTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_run(self):
+        # 10 m band and 20 m band of the same extent
+        b04 = np.arange(8 * 8, dtype="uint16").reshape((8, 8)) + 1
+        b8a = np.arange(4 * 4, dtype="uint16").reshape((4, 4)) + 1
+        b8a_path = f"{self.tmp_dir.name}/b8a.tif"
+        with rasterio.open(b8a_path, "w", driver="GTiff", height=4, width=4, count=1, dtype="uint16",
+                           transform=Affine(20, 0, 0, 0, -20, 0)) as dataset:
+            dataset.write(b8a, 1)
+        expected = np.repeat(np.repeat(b8a, 2, axis=0), 2, axis=1).astype("float32") - b04
+
+        for source in [b8a_path, CachedBand(b8a)]:
+            block_processor = BlockProcessor([source, CachedBand(b04, block_shape=(2, 8))], max_blocks=1)
+            values = block_processor.run(lambda bands, out: np.subtract(bands[0], bands[1], out=out))
+            self.assertEqual(values.shape, (8, 8))  # grid of the highest resolution
+            self.assertTrue(np.array_equal(values, expected))
+
+    def test_different_extent(self):
+        with self.assertRaises(ValueError):
+            BlockProcessor([CachedBand(np.ones((8, 8))), CachedBand(np.ones((4, 8)))]).run(lambda bands, out: None)
+
+
+class BandExpressionTestCase(TestCase):
+
+    def test_normalized_difference(self):
+        expression = BandExpression("(B08 - B04) / (B08 + B04)")
+        self.assertEqual(expression.bands, ["b08", "b04"])
+        b08 = np.array([[3, 0], [1, 2]], dtype="float32")
+        b04 = np.array([[1, 0], [1, 0]], dtype="float32")
+        out = np.empty_like(b08)
+        expression.evaluate([b08, b04], out)
+        self.assertEqual(out[0, 0], 0.5)
+        self.assertTrue(np.isnan(out[0, 1]))  # division by zero
+        self.assertEqual(out[1, 0], 0.0)
+        self.assertEqual(out[1, 1], 1.0)
+
+    def test_evaluate(self):
+        expression = BandExpression("-B02 + 2 * (B03 - 1.5) / B04")
+        b02, b03, b04 = (np.random.rand(4, 5).astype("float32") + 1 for _ in range(3))
+        out = np.empty_like(b02)
+        # Buffers are reused for windows of different shapes
+        for rows in [4, 2]:
+            expression.evaluate([b02[:rows], b03[:rows], b04[:rows]], out[:rows])
+            np.testing.assert_allclose(out[:rows], -b02[:rows] + 2 * (b03[:rows] - 1.5) / b04[:rows], rtol=1e-6)
+
+    def test_invalid_formula(self):
+        for formula in ["B99 + B04", "B04 ** 2", "__import__('os')", "(B04"]:
+            with self.assertRaises(ValueError):
+                BandExpression(formula)
+
+    def test_to_sql(self):
+        expression = BandExpression("(B08 - B04) / (B08 + -B04 * 2)")
+        self.assertEqual(expression.to_sql(["nir", "red"]), "((nir - red) / NULLIF((nir + ((-red) * 2.0)), 0))")
+
+    def test_spectral_indices(self):
+        for idx_type, spectral_index in SPECTRAL_INDICES.items():
+            self.assertEqual(idx_type, spectral_index.idx_type)
+            self.assertTrue(spectral_index.bands)
+
+
+class BandCacheTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.band_paths = {}
+        for band in ["b02", "b03", "b04"]:
+            band_path = f"{self.tmp_dir.name}/{band}.tif"
+            with rasterio.open(band_path, "w", driver="GTiff", height=10, width=10, count=1, dtype="uint16") as dataset:
+                dataset.write(np.full((10, 10), 1, dtype="uint16"), 1)
+            self.band_paths[band] = band_path
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_lru_eviction(self):
+        # Budget of two bands (10 x 10 x 2 bytes each)
+        band_cache = BandCache(self.band_paths, memory_budget=400)
+        self.assertIsInstance(band_cache.get("b02"), CachedBand)
+        band_cache.get("b03")
+        band_cache.get("b02")  # b03 is least recently used now
+        band_cache.get("b04")
+        self.assertEqual(list(band_cache.bands), ["b02", "b04"])
+        self.assertEqual((band_cache.hits, band_cache.misses), (1, 3))
+        self.assertEqual(band_cache.used_bytes, 400)
+
+    def test_exceeds_memory_budget(self):
+        band_cache = BandCache(self.band_paths, memory_budget=100)
+        self.assertEqual(band_cache.get("b02"), self.band_paths["b02"])
+        self.assertEqual(band_cache.used_bytes, 0)
+
+    def test_read_preview(self):
+        # 20 m band with half the size of the 10 m bands
+        b8a_path = f"{self.tmp_dir.name}/b8a.tif"
+        with rasterio.open(b8a_path, "w", driver="GTiff", height=5, width=5, count=1, dtype="uint16", nodata=0) as dataset:
+            dataset.write(np.arange(25, dtype="uint16").reshape((5, 5)), 1)
+
+        cached_band = BandCache(self.band_paths).get("b02")
+        b02, b8a = read_preview([cached_band, b8a_path], max_size=4)
+        self.assertEqual(b02.shape, (4, 4))
+        self.assertEqual(b8a.shape, (4, 4))  # shape of the first band
+        self.assertEqual(b02.dtype, "float32")
+        self.assertTrue(np.isnan(b8a[0, 0]))  # no data
+
+    def test_plan(self):
+        mc = MetricsCalculator(sat_data=SatData(id=uuid.uuid4()), metrics_to_calc=["ndvi", "smi", "rgb", "ndvi"])
+        plan = mc.plan()
+        # NDVI and RGB share band b04
+        self.assertEqual([metric for metric, _ in plan], ["ndvi", "rgb", "smi"])
+
+    def test_start_missing_bands(self):
+        user = User.objects.create_user(username="testuser", password="test")
+        sat_data = SatData.objects.create(id=uuid.uuid4(), user=user)
+        results = MetricsCalculator(sat_data=sat_data, metrics_to_calc=["ndvi", "rgb"]).start()
+        self.assertEqual(results, {"ndvi": "", "rgb": ""})
+
+    def test_calculate_metrics_missing_bands(self):
+        user = User.objects.create_user(username="testuser", password="test")
+        sat_data = SatData.objects.create(id=uuid.uuid4(), user=user)
+        # Missing bands do not fail the metrics stage, a retry would not find them either
+        self.assertEqual(calculate_metrics(sat_data, ["ndvi", "rgb"], engine="numpy"), {})
+
+    def test_save_index_replaces_index(self):
+        user = User.objects.create_user(username="testuser", password="test")
+        sat_data = SatData.objects.create(id=uuid.uuid4(), user=user)
+        # Files do not exist, only the Index instances are checked
+        preview = save_index(sat_data, "ndvi", f"{MEDIA_ROOT}/other/{sat_data.id}_ndvi_20231231_235959_preview.png")
+        self.assertEqual(get_calculated_metrics(sat_data), set())
+        index = save_index(sat_data, "ndvi", f"{MEDIA_ROOT}/other/{sat_data.id}_ndvi_20231231_235959.png")
+        self.assertEqual(index.id, preview.id)
+        self.assertEqual(sat_data.index.filter(idx_type="ndvi").count(), 1)
+        self.assertEqual(get_calculated_metrics(sat_data), {"ndvi"})
+
+
+class RendererTestCase(TestCase):
+
+    def test_apply_colormap(self):
+        values = np.array([[-1.0, 0.0, 1.0, np.nan]], dtype="float32")
+        rgba = apply_colormap(values, "RdYlGn")
+        lut = get_lut("RdYlGn")
+        self.assertTrue((rgba[0, 0] == lut[0]).all())  # minimum
+        self.assertTrue((rgba[0, 1] == lut[128]).all())
+        self.assertTrue((rgba[0, 2] == lut[255]).all())  # maximum
+        self.assertEqual(rgba[0, 3, 3], 0)  # NaN is transparent
+
+    def test_render_index_img(self):
+        values = np.linspace(0, 1, 200 * 100, dtype="float32").reshape((200, 100))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.assertTrue(render_index_img(values, f"{tmp_dir}/native.png", cmap="Blues", max_size=0))
+            self.assertEqual(Image.open(f"{tmp_dir}/native.png").size, (100, 200))
+            self.assertTrue(render_index_img(values, f"{tmp_dir}/small.webp", cmap="Blues", max_size=50))
+            self.assertEqual(Image.open(f"{tmp_dir}/small.webp").size, (25, 50))
+
+
+class CogWriterTestCase(TestCase):
+
+    def test_write_cog(self):
+        values = np.linspace(-1, 1, 1200 * 1000, dtype="float32").reshape((1200, 1000))
+        values[0, 0] = np.nan
+        transform = Affine(10, 0, 300000, 0, -10, 5000000)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            save_loc = f"{tmp_dir}/ndvi.tif"
+            self.assertTrue(write_cog(values, save_loc, "EPSG:32632", transform, block_size=256))
+            self.assertEqual(os.listdir(tmp_dir), ["ndvi.tif"])  # temporary file is removed
+            with rasterio.open(save_loc) as dataset:
+                self.assertEqual(dataset.dtypes[0], "float32")
+                self.assertEqual(dataset.block_shapes[0], (256, 256))
+                self.assertEqual(dataset.overviews(1), [2, 4, 8])  # until 1200 x 1000 fits into a tile
+                self.assertEqual(dataset.transform, transform)
+                self.assertTrue(np.isnan(dataset.nodata))
+                self.assertTrue(np.array_equal(dataset.read(1), values, equal_nan=True))
+
+    def test_write_overview(self):
+        values = np.arange(100 * 70, dtype="uint16").reshape((100, 70))
+        transform = Affine(10, 0, 300000, 0, -10, 5000000)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            band_path = f"{tmp_dir}/b04.tif"
+            with rasterio.open(band_path, "w", driver="GTiff", height=100, width=70, count=1, dtype="uint16",
+                               crs="EPSG:32632", transform=transform, nodata=0) as dataset:
+                dataset.write(values, 1)
+            self.assertTrue(write_overview(band_path, f"{tmp_dir}/b04_o4.tif", 4, block_size=16))
+            with rasterio.open(f"{tmp_dir}/b04_o4.tif") as dataset:
+                # Partial pixels at the edges are kept, every pixel is the nearest source pixel (like `raster2pgsql -l`)
+                self.assertEqual((dataset.height, dataset.width), (25, 18))
+                self.assertEqual(dataset.transform, Affine(40, 0, 300000, 0, -40, 5000000))
+                self.assertEqual(dataset.block_shapes[0], (16, 16))
+                self.assertTrue(np.array_equal(dataset.read(1)[:, :17], values[2::4, 2::4][:, :17]))
+
+
+class StatsAccumulatorTestCase(TestCase):
+
+    def test_update(self):
+        values = np.random.default_rng(0).uniform(-1, 1, (300, 200)).astype("float32")
+        values[:10] = np.nan
+        stats = StatsAccumulator(-1.0, 1.0, bins=200)
+        # Windows like BlockProcessor
+        for row_off in range(0, 300, 64):
+            stats.update(values[row_off:row_off + 64])
+
+        result = stats.result(percentiles=[5, 50, 95])
+        valid = values[~np.isnan(values)].astype("float64")
+        self.assertEqual(result["valid_count"], valid.size)
+        self.assertAlmostEqual(result["mean"], valid.mean())
+        self.assertAlmostEqual(result["std"], valid.std())
+        self.assertEqual(result["min"], valid.min())
+        self.assertEqual(result["max"], valid.max())
+        self.assertEqual(sum(result["hist_counts"]), valid.size)
+        for q in [5, 50, 95]:
+            # Within one bin width of the exact percentile
+            self.assertAlmostEqual(result["percentiles"][str(q)], np.percentile(valid, q), delta=0.01)
+
+    def test_outliers_and_empty(self):
+        stats = StatsAccumulator(-1.0, 1.0, bins=4)
+        stats.update(np.array([[np.nan, np.nan]], dtype="float32"))
+        self.assertIsNone(stats.result()["mean"])
+
+        stats.update(np.array([[-5.0, 0.1, 3.0]], dtype="float32"))
+        self.assertEqual(stats.counts.tolist(), [1, 0, 1, 1])  # outliers in the edge bins
+        self.assertEqual(stats.percentile(100), 3.0)
+
+
+class CloudMaskTestCase(TestCase):
+
+    def test_get(self):
+        # 20 m SCL band: cloud (9) in the upper left, vegetation (4) elsewhere
+        scl = np.full((5, 5), 4, dtype="uint8")
+        scl[:2, :2] = 9
+        cloud_mask = CloudMask(CachedBand(scl), classes=[3, 8, 9, 10])
+        self.assertAlmostEqual(cloud_mask.coverage, 4 / 25)
+
+        # Window of a 10 m grid
+        mask = cloud_mask.get(Window(2, 2, 4, 3), 10, 10)
+        self.assertEqual(mask.shape, (3, 4))
+        self.assertTrue(mask[:2, :2].all())
+        self.assertFalse(mask[2:].any())
+        self.assertFalse(mask[:, 2:].any())
+
+    def test_block_processor(self):
+        band = CachedBand(np.ones((10, 10), dtype="uint16"), block_shape=(2, 10))
+        scl = np.full((5, 5), 4, dtype="uint8")
+        scl[4, 4] = 8
+        values = BlockProcessor([band], max_blocks=1, mask=CloudMask(CachedBand(scl))).run(
+            lambda bands, out: np.copyto(out, bands[0]))
+        self.assertTrue(np.isnan(values[8:, 8:]).all())
+        self.assertEqual(np.count_nonzero(np.isnan(values)), 4)
+
+
+class DbMetricsCalculatorTestCase(TestCase):
+
+    def test_get_band_tables(self):
+        user = User.objects.create_user(username="testuser", password="test")
+        sat_data = SatData.objects.create(id=uuid.uuid4(), user=user)
+        Band.objects.bulk_create([
+            Band(range=10, type="b04", sat_data=sat_data),
+            Band(range=10, type="b08", sat_data=sat_data),
+            Band(range=20, type="b04", sat_data=sat_data),
+            Band(range=20, type="b8a", sat_data=sat_data),
+        ])
+        db_metrics_calculator = DbMetricsCalculator(sat_data=sat_data, metrics_to_calc=["evi"])
+        self.assertEqual(db_metrics_calculator.get_band_tables(["b8a", "b04"]),
+                         [("b8a", 20, "band_raster", 20), ("b04", 10, "band_raster", 10)])
+        self.assertIsNone(db_metrics_calculator.get_band_tables(["b8a", "b02"]))
+        self.assertEqual(db_metrics_calculator.get_table_name("ndvi"), f"{sat_data.id}_ndvi")
+
+        # Overviews with the same pixel size share the tile grid
+        db_metrics_calculator = DbMetricsCalculator(sat_data=sat_data, metrics_to_calc=["evi"], scale=100)
+        self.assertEqual(db_metrics_calculator.get_band_tables(["b8a", "b04"]),
+                         [("b8a", 20, "o_4_band_raster", 80), ("b04", 10, "o_8_band_raster", 80)])
+        self.assertEqual(db_metrics_calculator.get_table_name("ndvi"), f"{sat_data.id}_ndvi_s100")
+
+    def test_get_overview_factor(self):
+        self.assertEqual(get_overview_factor(10, 0), 1)
+        self.assertEqual(get_overview_factor(10, 15), 1)
+        self.assertEqual(get_overview_factor(10, 20), 2)
+        self.assertEqual(get_overview_factor(10, 75), 4)
+        self.assertEqual(get_overview_factor(10, 10000), 32)
+        self.assertEqual(get_overview_factor(0, 100), 1)
+
+
+class ValueQueryTestCase(TestCase):
+
+    def test_get_index_values(self):
+        values = {
+            "b04": np.array([1000, 0, np.nan], dtype="float32"),
+            "b08": np.array([3000, 0, 2000], dtype="float32"),
+        }
+        indices = get_index_values(values)
+
+        # Only indices whose bands are available, no data and divisions by zero are NaN
+        self.assertEqual(list(indices), ["ndvi"])
+        self.assertAlmostEqual(float(indices["ndvi"][0]), 0.5)
+        self.assertTrue(np.isnan(indices["ndvi"][1:]).all())
+
+    def test_get_stats(self):
+        self.assertEqual(get_stats(np.array([1, 2, np.nan, 6], dtype="float32")),
+                         {"count": 3, "mean": 3.0, "min": 1.0, "max": 6.0})
+        self.assertEqual(get_stats(np.array([np.nan], dtype="float32")),
+                         {"count": 0, "mean": None, "min": None, "max": None})
@@ -6,6 +6,7 @@ urlpatterns = [
     path("overview/", views.overview_view, name="overview_view"),
     path("details/<uuid:sat_data_id>/", views.sat_data_details_view, name="sat_data_details_view"),
     path("delete/<uuid:sat_data_id>/", views.sat_data_delete_view, name="sat_data_delete_view"),
+    path("values/<uuid:sat_data_id>/", views.sat_data_values_view, name="sat_data_values_view"),
     path("time_travel/details/<uuid:time_travel_id>/", views.time_travel_details_view, name="time_travel_details_view"),
     path("time_travel/delete/<uuid:time_travel_id>/", views.time_travel_delete_view, name="time_travel_delete_view"),
     path("create/", views.sat_data_create_view, name="sat_data_create_view"),
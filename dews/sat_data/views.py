@@ -1,8 +1,8 @@
 
 from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import logging
 import os
-from threading import Thread
 import uuid
 from requests import HTTPError
 from sentinelhub import MimeType, DataCollection
@@ -10,7 +10,7 @@ from datetime import datetime, timedelta, date
 import json
 from PIL import Image
 
-from django.contrib.gis.geos import Polygon, GEOSGeometry
+from django.contrib.gis.geos import Point, Polygon, GEOSGeometry
 
 from django.core.serializers import serialize
 from django.http import HttpResponseBadRequest, JsonResponse
@@ -20,13 +20,15 @@ from django.views.decorators.http import require_POST
 from sat_data.enums.sat_mission import SatMission
 from sat_data.enums.status import Status
 from sat_data.services.utils.file_utils import FileUtils
-from sat_data.models import SHRequest, SatData, TimeTravel, remove_media_root
+from sat_data.models import IngestJob, SHRequest, SatData, TimeTravel, remove_media_root
 from sat_data.forms import SHRequestForm, SatDataForm
 from sat_data.services.attr_adder import AttrAdder
-from sat_data.services.metrics_calc import MetricsCalculator
+from sat_data.services.band_raster import drop_partition, remove_band_cogs
+from sat_data.services.job_queue import JobQueue
 from sat_data.services.sentinel_hub import request_sat_data
-from dews.settings import MEDIA_ROOT, VERSION, ARCHIVE_FILES_PATH
-from django.db import connection
+from sat_data.services.value_query import query_point, query_polygon
+from dews.settings import MEDIA_ROOT, VERSION, ARCHIVE_FILES_PATH, DEFAULT_METRICS_TO_CALC
+from django.db import connection, transaction
 import shutil
 from werkzeug.utils import secure_filename
 
@@ -125,13 +127,17 @@ def sat_data_delete_view(request, sat_data_id):
         return redirect("dashboard_view")
 
     # Delete sat data obj
-    # Get the `band_tables` from the sat_data object
+    # Drop the partition with the band tiles, also if the import was interrupted before `band_tables` was saved
+    drop_partition(sat_data.id)
+    remove_band_cogs(sat_data.id)
+
+    # Get the `band_tables` (e.g. index tables) from the sat_data object
     if hasattr(sat_data, "band_tables") and sat_data.band_tables is not None:
         band_tables = sat_data.band_tables
 
-        # Iterate over each resolution in the `band_tables`
+        # Iterate over each kind of table in the `band_tables`
         for _, tables in band_tables.items():
-            # Iterate over each table in the resolution
+            # Iterate over each table of the kind
             for table in tables:
                 # Create the SQL statement to drop the table
                 sql = f'DROP TABLE IF EXISTS "{table}";'
@@ -158,6 +164,43 @@ def sat_data_delete_view(request, sat_data_id):
     return redirect("overview_view")
 
 
+def sat_data_values_view(request, sat_data_id):
+    """
+    Returns band and spectral index values of a SatData object as JSON.
+
+    Query parameters (GET or POST):
+    - `lon` and `lat` (WGS 84): values at the point
+    - `geometry` (WKT, EWKT or GeoJSON; WGS 84 without SRID): value of a point or statistics within a polygon
+    """
+    if not request.user.is_authenticated:
+        logger.debug(
+            f"User '{request.user}' is not authenticated to query values of SatData object '{sat_data_id}'.")
+        return JsonResponse({"error": "Authentication required."}, status=401)
+
+    params = request.POST if request.method == "POST" else request.GET
+    try:
+        if params.get("geometry"):
+            geometry = GEOSGeometry(params.get("geometry"))
+            if geometry.srid is None:
+                geometry.srid = 4326
+        else:
+            geometry = Point(float(params.get("lon")), float(params.get("lat")), srid=4326)
+    except Exception as e:
+        logger.debug(
+            f"Invalid geometry of value query. sat_data_id='{sat_data_id}', params='{params}', error='{e}'")
+        return JsonResponse({"error": "Pass 'lon' and 'lat' or a 'geometry' (WKT or GeoJSON)."}, status=400)
+
+    sat_data: SatData = get_object_or_404(SatData, id=sat_data_id)
+    if geometry.geom_type == "Point":
+        result = query_point(sat_data, geometry)
+    elif geometry.geom_type in ["Polygon", "MultiPolygon"]:
+        result = query_polygon(sat_data, geometry)
+    else:
+        return JsonResponse({"error": f"Unsupported geometry type '{geometry.geom_type}'."}, status=400)
+
+    return JsonResponse({"sat_data_id": str(sat_data.id), "geometry": geometry.geom_type, **result})
+
+
 def overview_view(request):
     if not request.user.is_authenticated:
         logger.debug(
@@ -243,45 +286,74 @@ def sat_data_create_view(request):
             # Validate and sanitize the filename
             filename = secure_filename(archive.name)
 
-            # Write archive to file system
+            # Write archive to file system and hash it while writing
             archive_path = ARCHIVE_FILES_PATH / filename
-            if not os.path.exists(archive_path):
-                # Archive does not exist
-                logger.info(
-                    f"Archive does not exist. Will write archive to file system. archive_path='{archive_path}'")
-                try:
-                    with open(archive_path, "wb+") as file_ref:
-                        logger.info(f"Writing archive to file system. archive_path='{archive_path}'")
-                        for chunk in archive.chunks():
-                            file_ref.write(chunk)
-                    logger.info(
-                        f"Done writing archive to file system. archive_path='{archive_path}'")
-                except Exception as e:
-                    logger.error(
-                        f"Failed to write archive to file system. archive_path='{archive_path}', error='{e}'")
-            else:
-                # Archive already exists
-                logger.info(
-                    f"Archive already exists. archive_path='{archive_path}'")
-
-            # Extract and create SatData obj
+            partial_path = ARCHIVE_FILES_PATH / f".{filename}.{uuid.uuid4().hex}.partial"
+            sha256 = hashlib.sha256()
             try:
-                sat_data_id = create_sat_data(request, archive_path)
-                if sat_data_id is None:
-                    raise Exception(
-                        f"Failed to create SatData object. sat_data_id='{sat_data_id}'")
+                with open(partial_path, "wb+") as file_ref:
+                    logger.info(f"Writing archive to file system. archive_path='{archive_path}'")
+                    for chunk in archive.chunks():
+                        sha256.update(chunk)
+                        file_ref.write(chunk)
+                logger.info(
+                    f"Done writing archive to file system. archive_path='{archive_path}'")
             except Exception as e:
-                # Background task failed
                 logger.error(
-                    f"Failed 'extract_and_create' background task. username='{request.user.username}', error='{e}'")
-                err_msg = "Failed to extract and create archive. However, an entry was still created."
-                context["error"] = err_msg
-                logger.debug(
-                    f"Render 'sat_data_create_view.html' with error message: '{err_msg}'.")
+                    f"Failed to write archive to file system. archive_path='{archive_path}', error='{e}'")
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                context["error"] = "Failed to write the archive to the file system."
                 return render(request, "sat_data_create_view.html", context)
+            archive_hash = sha256.hexdigest()
+
+            # Check for an identical archive and enqueue it in one transaction, identical uploads are serialized
+            with transaction.atomic():
+                JobQueue.lock_archive(archive_hash)
+                existing_sat_data, pending_job = JobQueue.find_duplicate(archive_hash)
+                if existing_sat_data is not None or pending_job is not None:
+                    os.remove(partial_path)
+                    if existing_sat_data is not None:
+                        logger.info(
+                            f"Archive was already imported. archive_hash='{archive_hash}', sat_data.id='{existing_sat_data.id}'")
+                        context["success"] = f"Archive was already imported. archive='{filename}'"
+                        context["sat_data_id"] = existing_sat_data.id
+                    else:
+                        logger.info(
+                            f"Archive is already queued for processing. archive_hash='{archive_hash}', job.id='{pending_job.id}'")
+                        context["success"] = f"Archive is already queued for processing... archive='{filename}'"
+                    return render(request, "sat_data_create_view.html", context)
+
+                # Archive is stored under its name (the extraction relies on it), a different archive must not replace it
+                try:
+                    os.link(partial_path, archive_path)
+                except FileExistsError:
+                    if FileUtils.hash_file(archive_path) != archive_hash:
+                        os.remove(partial_path)
+                        logger.info(
+                            f"Different archive with the same name exists. archive_path='{archive_path}', archive_hash='{archive_hash}'")
+                        context["error"] = f"A different archive with the same name was already uploaded. archive='{filename}'"
+                        return render(request, "sat_data_create_view.html", context)
+                os.remove(partial_path)
+
+                # Enqueue extraction and creation of SatData obj
+                try:
+                    job = create_sat_data(request, archive_path, archive_hash)
+                    if job is None:
+                        raise Exception(
+                            f"Failed to enqueue ingest job. archive_path='{archive_path}'")
+                except Exception as e:
+                    # Enqueueing failed
+                    logger.error(
+                        f"Failed to enqueue ingest job. username='{request.user.username}', error='{e}'")
+                    err_msg = "Failed to schedule the extraction of the archive."
+                    context["error"] = err_msg
+                    logger.debug(
+                        f"Render 'sat_data_create_view.html' with error message: '{err_msg}'.")
+                    return render(request, "sat_data_create_view.html", context)
 
             # Upload done
-            success_msg = f"Upload done! Work in progress... archive='{filename}'"
+            success_msg = f"Upload done! Archive is queued for processing... archive='{filename}'"
             context["success"] = success_msg
             logger.debug(
                 f"Render 'sat_data_create_view.html' with success message: '{success_msg}'.")
@@ -296,97 +368,28 @@ def sat_data_create_view(request):
     return render(request, "sat_data_create_view.html", context)
 
 
-def create_sat_data(request, archive_path) -> bool:
-    logger.debug(f"Create background task.")
+def create_sat_data(request, archive_path, archive_hash: str = "") -> IngestJob | None:
+    """
+    Enqueues the archive for ingestion. Extraction, attribute adding and metrics calculation
+    are done by the ingest workers (`python manage.py runworker`).
+
+    :return: IngestJob object on success; None on failure
+    """
     logger.info(
-        f"Extract and create SatData obj. username='{request.user.username}', archive_path='{archive_path}'")
+        f"Enqueue archive for ingestion. username='{request.user.username}', archive_path='{archive_path}'")
     try:
-        # Start background task
-        thread = Thread(target=__extract_and_create,
-                        args=(request, str(archive_path), logger))
-        thread.start()
-        logger.debug(
-            f"Started 'extract_and_create' background task. username='{request.user.username}', archive_path='{archive_path}'")
+        job = JobQueue.enqueue(
+            user=request.user,
+            archive_path=archive_path,
+            metrics_to_calc=DEFAULT_METRICS_TO_CALC,
+            archive_hash=archive_hash,
+        )
     except Exception as e:
-        # Background task failed
         logger.error(
-            f"Failed to start 'extract_and_create' background task. username='{request.user.username}', error='{e}'")
-        return False
-
-    return True
-
-
-def __extract_and_create(request, archive_path: str, logger: logging.Logger = None):
-    # Extract archive
-    logger.info(f"Extracting archive. archive_path='{archive_path}'")
-    mission = SatMission.get_mission_by_filename(archive_path)
-    # Check if extracted directory exists
-    extracted_path = FileUtils.extract_archive(archive_path, mission)
-    logger.debug(f"Extracted path='{extracted_path}'")
-    if extracted_path is None or extracted_path == "":
-        logger.error(
-            f"Extracting archive failed... extracted_path='{extracted_path}'")
-        return
-
-    # Create SatData object
-    logger.info(
-        f"Creating SatData object. username='{request.user.username}', extracted_path='{extracted_path}'")
-    form = SatDataForm(request.POST or None, request.FILES or None)
-    # Check form
-    if form.is_valid():
-        logger.debug(f"Form is valid. form='{form}'")
-        try:
-            # Save SatData object to database
-            sat_data: SatData = form.save(commit=False)
-            sat_data.id = uuid.uuid4()
-            sat_data.user = request.user
-            logger.debug(
-                f"Created form, added id and user. id='{sat_data.id}'")
+            f"Failed to enqueue archive for ingestion. username='{request.user.username}', archive_path='{archive_path}', error='{e}'")
+        return None
 
-            # Add paths
-            sat_data.archive = remove_media_root(archive_path)
-            logger.debug(f"Added archive file. sat_data.id='{sat_data.id}'")
-            sat_data.extracted_path = remove_media_root(extracted_path)
-            logger.debug(f"Added extracted path. sat_data.id='{sat_data.id}'")
-
-            # Add attributes (like mission, product type, band img paths, ...)
-            logger.debug(
-                f"Calling AttrAdder. sat_data.id='{sat_data.id}', extracted_path='{extracted_path}', mission='{mission}', product_type='{sat_data.product_type}'")
-            attr_adder = AttrAdder(
-                sat_data=sat_data,
-                extracted_path=extracted_path,
-                mission=mission)
-            attr_adder.start()
-            logger.info(
-                f"Created SatData with several attributes. id='{sat_data.id}', extracted_path='{extracted_path}'")
-            sat_data.save()
-
-            # Calculate metrics
-            metrics_to_calc = ["ndvi", "rgb"]
-            if metrics_to_calc:
-                logger.debug(
-                    f"Calling MetricsCalculator. sat_data.id='{sat_data.id}', extracted_path='{extracted_path}', mission='{mission}', product_type='{sat_data.product_type}'")
-                mc = MetricsCalculator(
-                    sat_data=sat_data,
-                    metrics_to_calc=metrics_to_calc)
-                mc.start()
-                logger.info(
-                    f"Metrics calculation done. metrics_to_calc='{metrics_to_calc}', sat_data.id='{sat_data.id}'")
-            else:
-                logger.info(
-                    f"No metrics to calculate. sat_data.id='{sat_data.id}'")
-
-            return
-        except Exception as e:
-            # Save failed
-            logger.error(
-                f"Failed to create, add attributes and save a SatData object. username='{request.user.username}', extracted_path='{extracted_path}', error='{e}'")
-            return
-    else:
-        # Form is not valid
-        logger.error(
-            f"Form is not valid. username='{request.user.username}', extracted_path='{extracted_path}', form='{form}'")
-        return
+    return job
 
 
 def create_sh_sat_data(request, data_folder, dir_name, bbox, bands, metrics_to_calc: list, date) -> str:
@@ -426,19 +429,10 @@ def create_sh_sat_data(request, data_folder, dir_name, bbox, bands, metrics_to_c
         logger.info(
             f"Created SatData with several attributes. id='{sat_data.id}', extracted_path='{extracted_path}'")
 
-        # Calculate metrics
+        # Calculate metrics, done by the ingest workers which mark the SatData object as processed afterwards
         logger.debug(
-            f"Calling MetricsCalculator. sat_data.id='{sat_data.id}', extracted_path='{extracted_path}', sat_data.mission='{sat_data.mission}', sat_data.product_type='{sat_data.product_type}'")
-        if metrics_to_calc:
-            mc = MetricsCalculator(
-                sat_data=sat_data,
-                metrics_to_calc=metrics_to_calc)
-            mc.start()
-            logger.info(
-                f"Metrics calculation done. metrics_to_calc='{metrics_to_calc}', sat_data.id='{sat_data.id}'")
-        else:
-            logger.info(
-                f"No metrics to calculate. sat_data.id='{sat_data.id}'")
+            f"Enqueue metrics calculation. sat_data.id='{sat_data.id}', extracted_path='{extracted_path}', sat_data.mission='{sat_data.mission}', sat_data.product_type='{sat_data.product_type}'")
+        JobQueue.enqueue_metrics(sat_data, metrics_to_calc or [])
 
         return sat_data
     except Exception as e:
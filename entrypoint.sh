@@ -47,6 +47,18 @@ python manage.py collectstatic --noinput
 echo "Create default super user..."
 python manage.py createsuperuser --noinput
 
+# Start ingest workers (archives uploaded via the web app are processed by them)
+echo "Start ingest workers..."
+python manage.py runworker &
+WORKER_PID=$!
+
 # Start
 echo "Start main app..."
-gunicorn dews.wsgi:application --bind 0.0.0.0:8000  -k gevent --workers 3 --reload --timeout 120
+gunicorn dews.wsgi:application --bind 0.0.0.0:8000  -k gevent --workers 3 --reload --timeout 120 &
+APP_PID=$!
+
+# sh does not forward signals to background processes, workers have to finish their jobs on shutdown
+trap 'kill -TERM $APP_PID $WORKER_PID 2>/dev/null' TERM INT
+wait $APP_PID
+kill -TERM $WORKER_PID 2>/dev/null
+wait $WORKER_PID